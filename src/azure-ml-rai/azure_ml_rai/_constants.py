@@ -26,7 +26,18 @@ class PropertyKeyValues:
     )
 
 
+class DashboardInfo:
+    RAI_INSIGHTS_RUN_ID_KEY = "rai_insights_parent_run_id"
+    RAI_INSIGHTS_PARENT_FILENAME = "rai_insights.json"
+
+    ARTIFACT_MANIFEST_FILENAME = "artifact_manifest.json"
+    ARTIFACT_MANIFEST_DIGEST_KEY = "digest"
+    ARTIFACT_MANIFEST_FILES_KEY = "files"
+    ARTIFACT_MANIFEST_SIZE_KEY = "size"
+
+
 # This comes from the component definitions
 class OutputPortNames:
+    RAI_INSIGHTS_CONSTRUCTOR_PORT = "rai_insights_dashboard"
     RAI_INSIGHTS_GATHER_RAIINSIGHTS_PORT = "dashboard"
     RAI_INSIGHTS_GATHER_RAIINSIGHTS_UX_PORT = "ux_json"
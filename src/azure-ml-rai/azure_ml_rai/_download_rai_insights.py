@@ -18,7 +18,8 @@ from azure.storage.blob import BlobServiceClient
 
 from azure.ml import MLClient
 
-from ._constants import OutputPortNames
+from ._constants import DashboardInfo, OutputPortNames
+from ._manifest import rebuild_from_manifest
 from ._utilities import _get_v1_workspace_client
 
 
@@ -63,6 +64,32 @@ def _download_port_files(
     abar.download_artifacts("", target_directory)
 
 
+def _hydrate_from_constructor(
+    mlflow_client: MlflowClient,
+    output_directory: Path,
+    credential: ChainedTokenCredential,
+) -> None:
+    # Dashboards saved with the 'full' layout are already complete
+    manifest_file = output_directory / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    if not manifest_file.exists():
+        return
+
+    info_file = output_directory / DashboardInfo.RAI_INSIGHTS_PARENT_FILENAME
+    with open(info_file, "r") as inf:
+        constructor_run_id = json.load(inf)[DashboardInfo.RAI_INSIGHTS_RUN_ID_KEY]
+
+    with tempfile.TemporaryDirectory() as constructor_temp_dir:
+        constructor_dir = Path(constructor_temp_dir)
+        _download_port_files(
+            mlflow_client,
+            constructor_run_id,
+            OutputPortNames.RAI_INSIGHTS_CONSTRUCTOR_PORT,
+            constructor_dir,
+            credential,
+        )
+        rebuild_from_manifest(output_directory, constructor_dir)
+
+
 def download_rai_insights(ml_client: MLClient, rai_insight_id: str, path: str) -> None:
     v1_ws = _get_v1_workspace_client(ml_client)
 
@@ -81,6 +108,8 @@ def download_rai_insights(ml_client: MLClient, rai_insight_id: str, path: str) -
         ml_client._credential,
     )
 
+    _hydrate_from_constructor(mlflow_client, output_directory, ml_client._credential)
+
     # Ensure empty directories are present
     tool_dirs = ["causal", "counterfactual", "error_analysis", "explainer"]
     for t in tool_dirs:
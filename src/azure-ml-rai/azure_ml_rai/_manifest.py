@@ -0,0 +1,49 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+from pathlib import Path
+import shutil
+
+from typing import Any, Dict, Optional
+
+from ._constants import DashboardInfo
+
+
+def _load_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+    manifest_file = Path(directory) / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, "r") as mf:
+        return json.load(mf)
+
+
+def rebuild_from_manifest(dashboard_dir: Path, constructor_dir: Path) -> None:
+    # A dashboard saved with the 'manifest' layout only contains the
+    # tool results. The remaining files are copied from the output of
+    # the constructor, which wrote its own manifest when it hashed the
+    # files. Comparing the digests means they need not be hashed again
+    manifest = _load_manifest(dashboard_dir)
+    if manifest is None:
+        raise ValueError("No artifact manifest in {0}".format(dashboard_dir))
+    constructor_manifest = _load_manifest(constructor_dir)
+    if (
+        constructor_manifest is None
+        or constructor_manifest[DashboardInfo.ARTIFACT_MANIFEST_DIGEST_KEY]
+        != manifest[DashboardInfo.ARTIFACT_MANIFEST_DIGEST_KEY]
+    ):
+        raise ValueError("Constructor output does not match the dashboard manifest")
+
+    for relative_path, file_info in manifest[
+        DashboardInfo.ARTIFACT_MANIFEST_FILES_KEY
+    ].items():
+        src = Path(constructor_dir) / relative_path
+        if (
+            not src.is_file()
+            or src.stat().st_size != file_info[DashboardInfo.ARTIFACT_MANIFEST_SIZE_KEY]
+        ):
+            raise ValueError("Content mismatch for {0}".format(relative_path))
+        dst = Path(dashboard_dir) / relative_path
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dst)
@@ -2,6 +2,7 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # ---------------------------------------------------------
 
+import argparse
 import json
 import logging
 
@@ -72,3 +73,56 @@ def int_or_none_parser(target: str) -> Union[None, int]:
         if "None" in target:
             return None
         raise ValueError("int_or_none_parser failed on: {0}".format(target))
+
+
+def float_or_none_parser(target: str) -> Union[None, float]:
+    try:
+        return float(target.strip('"').strip("'"))
+    except ValueError:
+        if "None" in target:
+            return None
+        raise ValueError("float_or_none_parser failed on: {0}".format(target))
+
+
+def add_inference_arguments(parser: argparse.ArgumentParser) -> None:
+    # Shared by the tool components, see model_wrappers.py
+    parser.add_argument(
+        "--inference_chunk_size",
+        type=int_or_none_parser,
+        default=None,
+        help="Optional[int] rows per model call, use 'None' to disable",
+    )
+    parser.add_argument(
+        "--inference_n_jobs",
+        type=int,
+        default=1,
+        help="Threads for scoring chunks, -1 to use all cores",
+    )
+    parser.add_argument(
+        "--prediction_cache_rows",
+        type=int_or_none_parser,
+        default=None,
+        help="Optional[int] rows to memoize model output for, 'None' to disable",
+    )
+    parser.add_argument(
+        "--cache_preprocessing",
+        type=boolean_parser,
+        default=False,
+        help="Preprocess the train and test rows of Pipeline models up front",
+    )
+
+
+def add_result_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    # Shared by the tool components, see result_cache.py
+    parser.add_argument(
+        "--use_result_cache",
+        type=boolean_parser,
+        default=False,
+        help="Reuse results of earlier runs with the same inputs",
+    )
+    parser.add_argument(
+        "--result_cache_dir",
+        type=str,
+        default=None,
+        help="Optional directory for cached results, shared between runs",
+    )
@@ -0,0 +1,259 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from constants import CacheSettings
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+_DEFAULT_CACHE_ROOT = os.path.join(tempfile.gettempdir(), "azureml_rai_cache")
+
+_ENTRIES_DIR = "entries"
+_LOCKS_DIR = "locks"
+_STAGING_DIR = "staging"
+_CONTENT_DIR = "content"
+_ENTRY_INFO_FILENAME = "entry.json"
+_CACHE_LOCK_FILENAME = "cache.lock"
+
+_ENTRY_KEY = "key"
+_ENTRY_FILES = "files"
+_ENTRY_SHA256 = "sha256"
+_ENTRY_SIZE = "size"
+_ENTRY_LAST_ACCESS = "last_access"
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_node_cache(subdir: str, max_megabytes: int) -> Optional["DirectoryLRUCache"]:
+    # The cache root can be moved (e.g. onto a persistent disk) or
+    # disabled by setting the environment variable to an empty string
+    cache_root = os.environ.get(CacheSettings.CACHE_ROOT_ENV_VAR, _DEFAULT_CACHE_ROOT)
+    if cache_root == "":
+        _logger.info("Node cache disabled")
+        return None
+    try:
+        return DirectoryLRUCache(
+            os.path.join(cache_root, subdir), max_megabytes * 1024 * 1024
+        )
+    except OSError as e:
+        _logger.warning("Unable to create node cache ({0})".format(e))
+        return None
+
+
+@contextlib.contextmanager
+def _file_lock(lock_path: Path, blocking: bool = True) -> Iterator[bool]:
+    # Yields whether the lock was acquired (always True if blocking)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class DirectoryLRUCache:
+    """A size-bounded cache of directories, shared between processes.
+
+    Each entry is a directory populated by a caller-supplied function,
+    stored under a hash of its key. The sha256, size and modification
+    time of each file are recorded when the entry is created. The first
+    hit on an entry from a cache object (so from each component run)
+    reads the files and checks their hashes, as does any hit where the
+    sizes or modification times have changed. Other hits only compare
+    those stats. An entry which fails the check is rebuilt. Concurrent
+    jobs on the same node are serialised per key with file locks, and
+    least recently used entries are evicted once the total size exceeds
+    max_bytes.
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int):
+        self._root = Path(root_dir)
+        self._max_bytes = max_bytes
+        # Hashes of the keys whose entries this object has checked
+        self._verified: Set[str] = set()
+        for d in [_ENTRIES_DIR, _LOCKS_DIR, _STAGING_DIR]:
+            (self._root / d).mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def _key_hash(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key_hash: str) -> Path:
+        return self._root / _ENTRIES_DIR / key_hash
+
+    def _entry_lock(self, key_hash: str) -> Path:
+        return self._root / _LOCKS_DIR / (key_hash + ".lock")
+
+    @staticmethod
+    def _read_entry_info(entry_dir: Path) -> Optional[Dict[str, Any]]:
+        info_file = entry_dir / _ENTRY_INFO_FILENAME
+        if not info_file.exists():
+            return None
+        with open(info_file, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_entry_info(entry_dir: Path, info: Dict[str, Any]) -> None:
+        # Replace atomically, since eviction reads these without the
+        # entry lock
+        temp_file = entry_dir / (_ENTRY_INFO_FILENAME + ".tmp")
+        with open(temp_file, "w") as f:
+            json.dump(info, f)
+        os.replace(temp_file, entry_dir / _ENTRY_INFO_FILENAME)
+
+    @staticmethod
+    def _file_stats(content_dir: Path) -> Dict[str, List[int]]:
+        # The size and modification time of every file in content_dir
+        stats = {}
+        for current_dir, _, filenames in os.walk(content_dir):
+            for filename in filenames:
+                file_path = Path(current_dir) / filename
+                file_stat = os.stat(file_path)
+                relative_path = file_path.relative_to(content_dir).as_posix()
+                stats[relative_path] = [file_stat.st_size, file_stat.st_mtime_ns]
+        return stats
+
+    @staticmethod
+    def _file_hashes(
+        content_dir: Path, relative_paths: Iterable[str]
+    ) -> Dict[str, str]:
+        return {p: hash_file(content_dir / p) for p in relative_paths}
+
+    def _is_valid(self, key_hash: str, entry_dir: Path, info: Dict[str, Any]) -> bool:
+        # Updates the stats in info if only those have changed
+        content_dir = entry_dir / _CONTENT_DIR
+        files = self._file_stats(content_dir)
+        if key_hash in self._verified and files == info.get(_ENTRY_FILES):
+            return True
+        hashes = info.get(_ENTRY_SHA256)
+        if hashes is None or files.keys() != hashes.keys():
+            return False
+        if self._file_hashes(content_dir, files.keys()) != hashes:
+            return False
+        info[_ENTRY_FILES] = files
+        self._verified.add(key_hash)
+        return True
+
+    @contextlib.contextmanager
+    def entry(
+        self, key: str, populate: Optional[Callable[[Path], Any]] = None
+    ) -> Iterator[Optional[Path]]:
+        # Yields the content directory for key, which is locked (and so
+        # safe from eviction) until the block exits. On a miss, the entry
+        # is created with populate(target_dir) if given, else None is
+        # yielded. Holding the lock means populate runs once per node
+        key_hash = self._key_hash(key)
+        with _file_lock(self._entry_lock(key_hash)):
+            content_dir = self._get_locked(key, key_hash)
+            if content_dir is None and populate is not None:
+                content_dir = self._create_locked(key, key_hash, populate)
+            yield content_dir
+        self._evict(keep=[key_hash])
+
+    def put(self, key: str, source_dir: Path) -> None:
+        def _copy(target_dir: Path):
+            shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+
+        with self.entry(key, _copy):
+            pass
+
+    def _get_locked(self, key: str, key_hash: str) -> Optional[Path]:
+        entry_dir = self._entry_dir(key_hash)
+        info = self._read_entry_info(entry_dir)
+        if info is None:
+            _logger.info("Cache miss for {0}".format(key))
+            return None
+        if not self._is_valid(key_hash, entry_dir, info):
+            _logger.warning("Discarding corrupt cache entry for {0}".format(key))
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        info[_ENTRY_LAST_ACCESS] = time.time()
+        self._write_entry_info(entry_dir, info)
+        _logger.info("Cache hit for {0}".format(key))
+        return entry_dir / _CONTENT_DIR
+
+    def _create_locked(
+        self, key: str, key_hash: str, populate: Callable[[Path], Any]
+    ) -> Path:
+        staging_dir = (
+            self._root / _STAGING_DIR / "{0}-{1}".format(key_hash, uuid.uuid4())
+        )
+        try:
+            (staging_dir / _CONTENT_DIR).mkdir(parents=True)
+            populate(staging_dir / _CONTENT_DIR)
+            # Renaming the staging directory keeps the modification times
+            files = self._file_stats(staging_dir / _CONTENT_DIR)
+            info = {
+                _ENTRY_KEY: key,
+                _ENTRY_FILES: files,
+                _ENTRY_SHA256: self._file_hashes(
+                    staging_dir / _CONTENT_DIR, files.keys()
+                ),
+                _ENTRY_SIZE: sum(f[0] for f in files.values()),
+                _ENTRY_LAST_ACCESS: time.time(),
+            }
+            self._write_entry_info(staging_dir, info)
+
+            entry_dir = self._entry_dir(key_hash)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(staging_dir, entry_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self._verified.add(key_hash)
+        _logger.info("Cached {0} ({1} bytes)".format(key, info[_ENTRY_SIZE]))
+        return entry_dir / _CONTENT_DIR
+
+    def _evict(self, keep: List[str]) -> None:
+        with _file_lock(self._root / _CACHE_LOCK_FILENAME):
+            entries = []
+            for entry_dir in (self._root / _ENTRIES_DIR).iterdir():
+                info = self._read_entry_info(entry_dir)
+                if info is not None:
+                    entries.append(
+                        (info[_ENTRY_LAST_ACCESS], info[_ENTRY_SIZE], entry_dir)
+                    )
+            total_bytes = sum(e[1] for e in entries)
+
+            for _, size, entry_dir in sorted(entries, key=lambda e: e[0]):
+                if total_bytes <= self._max_bytes:
+                    break
+                if entry_dir.name in keep:
+                    continue
+                # Skip entries which another job is using right now
+                with _file_lock(
+                    self._entry_lock(entry_dir.name), blocking=False
+                ) as locked:
+                    if not locked:
+                        continue
+                    _logger.info("Evicting cache entry {0}".format(entry_dir.name))
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    total_bytes -= size
@@ -0,0 +1,218 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import logging
+import os
+import pickle
+
+from pathlib import Path
+from typing import Any, Callable, Iterator, List, Optional
+
+import econml
+import joblib
+import sklearn
+
+from econml.solutions.causal_analysis._causal_analysis import (
+    _first_stage_clf,
+    _first_stage_reg,
+)
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from threadpoolctl import threadpool_limits
+
+from constants import RAIToolType
+from result_cache import get_result_cache, get_result_fingerprint
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+_OUTCOME_MODEL_FILENAME = "outcome_model.pkl"
+
+
+@contextlib.contextmanager
+def replaced_causal_fit(manager: Any, fit: Callable[..., None]) -> Iterator[None]:
+    # Have the causal manager fit its CausalAnalysis with fit(), which
+    # takes the arguments of _fit_causal_analysis(). Nested uses restore
+    # the fit they replaced
+    patched = "_fit_causal_analysis" in vars(manager)
+    previous = manager._fit_causal_analysis
+    manager._fit_causal_analysis = fit
+    try:
+        yield
+    finally:
+        if patched:
+            manager._fit_causal_analysis = previous
+        else:
+            del manager._fit_causal_analysis
+
+
+def get_core_budget(core_budget: Optional[int]) -> int:
+    # Non-positive values mean all the cores of the node
+    if core_budget is None or core_budget < 1:
+        return os.cpu_count()
+    return core_budget
+
+
+def get_treatment_n_jobs(
+    n_jobs: Optional[int], treatment_features: List[str], core_budget: int
+) -> int:
+    # EconML fits the treatment features on a process pool of n_jobs
+    # workers, which is capped to the budget and the number of features
+    n_workers = joblib.effective_n_jobs(n_jobs)
+    return max(1, min(n_workers, len(treatment_features), core_budget))
+
+
+@contextlib.contextmanager
+def causal_core_budget(n_jobs: int, core_budget: int) -> Iterator[None]:
+    """Keep the fits of the treatment features within core_budget cores.
+
+    The n_jobs worker processes of EconML's joblib pool share the budget
+    between their thread pools (BLAS, and OpenMP for models such as
+    LightGBM), which would otherwise each use every core of the node.
+    Without workers, the fit's own thread pools are limited instead.
+    """
+    if n_jobs <= 1:
+        with threadpool_limits(limits=core_budget):
+            yield
+        return
+
+    n_threads = max(1, core_budget // n_jobs)
+    _logger.info(
+        "Fitting treatments on {0} processes of {1} threads each".format(
+            n_jobs, n_threads
+        )
+    )
+    with joblib.parallel_backend("loky", inner_max_num_threads=n_threads):
+        yield
+
+
+def _select_outcome_model(causal_analysis: Any, X: Any, y: Any) -> Any:
+    # As CausalAnalysis.fit() does before fitting any treatment, using
+    # all the features rather than those of each treatment
+    allX = ColumnTransformer(
+        [
+            (
+                "encode",
+                OneHotEncoder(drop="first", sparse=False),
+                causal_analysis.categorical,
+            )
+        ],
+        remainder=StandardScaler(),
+    ).fit_transform(X)
+    automl = causal_analysis.nuisance_models == "automl"
+    if causal_analysis.classification:
+        return _first_stage_clf(
+            allX,
+            y,
+            automl=automl,
+            make_regressor=True,
+            random_state=causal_analysis.random_state,
+            verbose=causal_analysis.verbose,
+        )
+    return _first_stage_reg(
+        allX,
+        y,
+        automl=automl,
+        random_state=causal_analysis.random_state,
+        verbose=causal_analysis.verbose,
+    )
+
+
+def fit_with_outcome_model(
+    fit_causal_analysis: Any,
+    causal_analysis: Any,
+    X: Any,
+    y: Any,
+    max_cat_expansion: int,
+    outcome_model: Any,
+) -> None:
+    # Seed the analysis as if an earlier fit had selected the outcome
+    # model, so that a warm start fits every treatment against it.
+    # Nested uses (e.g. a checkpointed fit around a cached outcome
+    # model) seed the analysis again, but start warm only once
+    causal_analysis._model_y = outcome_model
+    causal_analysis._results = []
+    causal_analysis._cache = {}
+    causal_analysis._d_x = X.shape[1]
+    causal_analysis.nuisance_models_ = causal_analysis.nuisance_models
+    causal_analysis.heterogeneity_model_ = causal_analysis.heterogeneity_model
+
+    if "fit" in vars(causal_analysis):
+        fit_causal_analysis(causal_analysis, X, y, max_cat_expansion)
+        return
+
+    fit = causal_analysis.fit
+    causal_analysis.fit = lambda X, y: fit(X, y, warm_start=True)
+    try:
+        fit_causal_analysis(causal_analysis, X, y, max_cat_expansion)
+    finally:
+        # Not to be pickled with the analysis
+        del causal_analysis.fit
+
+
+@contextlib.contextmanager
+def cached_outcome_model(
+    manager: Any,
+    enabled: bool,
+    input_port_path: str,
+    result_cache_dir: Optional[str],
+) -> Iterator[None]:
+    """Have the causal manager take the outcome model of its
+    CausalAnalysis from the result cache.
+
+    EconML selects the outcome model (over every model family, for
+    automl nuisance models) on all the features, before fitting any
+    treatment feature, so the selection depends on the data and the
+    nuisance model but not on the treatments. It is made once per
+    cache key, and reused by causal analyses of other treatments.
+
+    The cross-fitted outcome models of each treatment are not shared,
+    since they leave out that treatment's own column.
+    """
+    cache = get_result_cache(enabled, result_cache_dir)
+    if cache is None:
+        yield
+        return
+
+    fit_causal_analysis = manager._fit_causal_analysis
+
+    def _fit_with_cached_outcome_model(causal_analysis, X, y, max_cat_expansion):
+        cache_key = get_result_fingerprint(
+            input_port_path,
+            RAIToolType.CAUSAL,
+            {
+                "outcome_model": causal_analysis.nuisance_models,
+                "classification": causal_analysis.classification,
+                "categorical": causal_analysis.categorical,
+                "random_state": causal_analysis.random_state,
+                "sklearn_version": sklearn.__version__,
+                "econml_version": econml.__version__,
+            },
+        )
+        if cache_key is None:
+            fit_causal_analysis(causal_analysis, X, y, max_cat_expansion)
+            return
+
+        def _populate(target_dir: Path):
+            _logger.info("Selecting outcome model")
+            outcome_model = _select_outcome_model(causal_analysis, X, y)
+            with open(target_dir / _OUTCOME_MODEL_FILENAME, "wb") as f:
+                pickle.dump(outcome_model, f)
+
+        with cache.entry(cache_key, _populate) as cached_dir:
+            with open(cached_dir / _OUTCOME_MODEL_FILENAME, "rb") as f:
+                outcome_model = pickle.load(f)
+        _logger.info("Using outcome model {0}".format(outcome_model))
+        fit_with_outcome_model(
+            fit_causal_analysis,
+            causal_analysis,
+            X,
+            y,
+            max_cat_expansion,
+            outcome_model,
+        )
+
+    with replaced_causal_fit(manager, _fit_with_cached_outcome_model):
+        yield
@@ -0,0 +1,265 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import joblib
+import pandas as pd
+
+from dice_ml.counterfactual_explanations import CounterfactualExplanations
+
+from causal_fits import fit_with_outcome_model, replaced_causal_fit
+from counterfactual_parallel import wrapped_explainer_creation
+from model_wrappers import fingerprint_rows
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+CHECKPOINT_DIRECTORY = "checkpoints"
+_CHECKPOINT_INFO_FILENAME = "checkpoint.json"
+_CHECKPOINT_CONFIG_KEY = "config"
+_CHECKPOINT_FILENAME_FORMAT = "{0}.pkl"
+
+_CAUSAL_CHECKPOINT_NAME = "causal_analysis"
+
+
+class CheckpointStore:
+    """Partial results of a tool component, kept in its output port so
+    that a run restarted after preemption can pick up from them.
+
+    The checkpoints belong to one tool configuration, and are discarded
+    if the store is opened with another.
+    """
+
+    def __init__(self, output_port_path: str, tool_type: str, config: Dict[str, Any]):
+        self._dir = Path(output_port_path) / CHECKPOINT_DIRECTORY / tool_type
+        serialised_config = json.dumps(config, sort_keys=True, default=str)
+        info_file = self._dir / _CHECKPOINT_INFO_FILENAME
+        if info_file.exists():
+            with open(info_file, "r") as f:
+                info = json.load(f)
+            if info[_CHECKPOINT_CONFIG_KEY] == serialised_config:
+                _logger.info("Found checkpoints in {0}".format(self._dir))
+                return
+            _logger.info("Discarding checkpoints for another configuration")
+            shutil.rmtree(self._dir)
+
+        self._dir.mkdir(parents=True, exist_ok=True)
+        with open(info_file, "w") as f:
+            json.dump({_CHECKPOINT_CONFIG_KEY: serialised_config}, f)
+
+    def _path(self, name: str) -> Path:
+        return self._dir / _CHECKPOINT_FILENAME_FORMAT.format(name)
+
+    def load(self, name: str) -> Optional[Any]:
+        path = self._path(name)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, name: str, value: Any) -> None:
+        # Replace atomically, so that preemption cannot leave a partial
+        # checkpoint behind
+        temp_path = self._dir / (_CHECKPOINT_FILENAME_FORMAT.format(name) + ".tmp")
+        with open(temp_path, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(temp_path, self._path(name))
+
+    def clear(self) -> None:
+        # Called once the results are in the output port
+        shutil.rmtree(self._dir.parent, ignore_errors=True)
+
+
+class CheckpointedCounterfactualGenerator:
+    """Wraps the generate_counterfactuals() method of a DiCE explainer,
+    generating counterfactuals for batches of query rows in turn and
+    checkpointing those of each batch.
+
+    Batches already in the checkpoint store are not generated again.
+    """
+
+    def __init__(self, explainer: Any, store: CheckpointStore, batch_size: int):
+        self._explainer = explainer
+        self._generate = explainer.generate_counterfactuals
+        self._store = store
+        self._batch_size = batch_size
+
+    def __call__(
+        self, query_instances: Any, total_CFs: int, **kwargs
+    ) -> CounterfactualExplanations:
+        if not isinstance(query_instances, pd.DataFrame):
+            return self._generate(query_instances, total_CFs, **kwargs)
+
+        # Identifies the call, since DiCE's feature importance methods
+        # also generate counterfactuals
+        call_source = [fingerprint_rows(query_instances), total_CFs, kwargs]
+        call_key = hashlib.sha256(
+            json.dumps(call_source, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+        examples_list = []
+        n_resumed = 0
+        n_rows = query_instances.shape[0]
+        for start in range(0, n_rows, self._batch_size):
+            name = "{0}_{1}".format(call_key, start)
+            batch_examples = self._store.load(name)
+            if batch_examples is None:
+                batch = query_instances.iloc[start : start + self._batch_size]
+                n_timeouts = getattr(self._generate, "n_timeouts", 0)
+                explanations = self._generate(batch, total_CFs, **kwargs)
+                batch_examples = explanations.cf_examples_list
+                # Holds the training data, which is in the input port
+                for examples in batch_examples:
+                    examples.data_interface = None
+                # Instances which timed out are tried again on resume
+                if getattr(self._generate, "n_timeouts", 0) == n_timeouts:
+                    self._store.save(name, batch_examples)
+            else:
+                n_resumed += len(batch_examples)
+            for examples in batch_examples:
+                examples.data_interface = self._explainer.data_interface
+            examples_list.extend(batch_examples)
+
+        if n_resumed > 0:
+            _logger.info(
+                "Resumed {0} of {1} query instances from checkpoints".format(
+                    n_resumed, n_rows
+                )
+            )
+        return CounterfactualExplanations(cf_examples_list=examples_list)
+
+
+@contextlib.contextmanager
+def checkpointed_counterfactuals(
+    manager: Any, store: Optional[CheckpointStore], batch_size: int
+) -> Iterator[None]:
+    """Have the DiCE explainers created by the counterfactual manager
+    checkpoint their counterfactuals every batch_size query rows.
+
+    This wraps whichever generate_counterfactuals() the explainer has,
+    so should be entered after parallel_counterfactuals().
+    """
+    if store is None or batch_size < 1:
+        yield
+        return
+
+    def _checkpoint(explainer):
+        explainer.generate_counterfactuals = CheckpointedCounterfactualGenerator(
+            explainer, store, batch_size
+        )
+        return explainer
+
+    with wrapped_explainer_creation(manager, _checkpoint):
+        yield
+
+
+def _trained_treatments(causal_analysis: Any) -> List[Any]:
+    # EconML records the treatments by column index
+    return [
+        causal_analysis.feature_names_[i]
+        for i in causal_analysis.trained_feature_indices_
+    ]
+
+
+@contextlib.contextmanager
+def checkpointed_causal_fits(
+    manager: Any, store: Optional[CheckpointStore]
+) -> Iterator[None]:
+    """Have the causal manager fit its CausalAnalysis a few treatment
+    features at a time, checkpointing the analysis after each step.
+
+    EconML's warm start only fits the treatments which have not been
+    fit before, against the outcome model of the first fit, so the
+    result is the same as fitting every treatment at once. As many
+    treatments are fit per step as the analysis has jobs.
+
+    This wraps whichever fit the manager has, so should be entered
+    after cached_outcome_model().
+    """
+    if store is None:
+        yield
+        return
+
+    fit_causal_analysis = manager._fit_causal_analysis
+
+    def _fit_first_step(causal_analysis, X, y, max_cat_expansion):
+        if "_model_y" in vars(causal_analysis):
+            # Selected by an earlier attempt, which fit no treatments
+            fit_with_outcome_model(
+                fit_causal_analysis,
+                causal_analysis,
+                X,
+                y,
+                max_cat_expansion,
+                causal_analysis._model_y,
+            )
+        else:
+            fit_causal_analysis(causal_analysis, X, y, max_cat_expansion)
+
+    def _fit_with_checkpoints(causal_analysis, X, y, max_cat_expansion):
+        treatments = list(causal_analysis.feature_inds)
+        fitted: List[Any] = []
+        # The (column index, reason) of each treatment EconML dropped
+        untrained: List[Tuple[int, Any]] = []
+        checkpoint = store.load(_CAUSAL_CHECKPOINT_NAME)
+        if checkpoint is not None:
+            causal_analysis.__dict__.update(checkpoint.__dict__)
+            fitted = list(checkpoint.feature_inds)
+            untrained = list(getattr(checkpoint, "untrained_feature_indices_", []))
+            _logger.info("Resumed causal analysis of {0}".format(fitted))
+
+        step = max(1, joblib.effective_n_jobs(causal_analysis.n_jobs))
+        step_size = step
+        skipped = [causal_analysis.feature_names_[i] for i, _ in untrained]
+        pending = [t for t in treatments if t not in fitted and t not in skipped]
+        while len(pending) > 0:
+            step_treatments = pending[:step_size]
+            causal_analysis.feature_inds = fitted + step_treatments
+            # A warm start expects the treatments it dropped before to be
+            # fit again, so only those of this step are left in
+            causal_analysis.untrained_feature_indices_ = []
+            if len(fitted) > 0:
+                causal_analysis.fit(X, y, warm_start=True)
+            else:
+                try:
+                    _fit_first_step(causal_analysis, X, y, max_cat_expansion)
+                except ValueError as e:
+                    # The first fit needs one treatment which can be
+                    # fit, so take in more of them
+                    if "No features remain" not in str(e) or step_size >= len(pending):
+                        raise
+                    step_size += step
+                    continue
+            # Treatments EconML could not fit stay out of later steps,
+            # which would otherwise try them again
+            untrained.extend(causal_analysis.untrained_feature_indices_)
+            trained = _trained_treatments(causal_analysis)
+            fitted.extend(t for t in step_treatments if t in trained)
+            pending = pending[step_size:]
+            step_size = step
+            causal_analysis.feature_inds = fitted
+            causal_analysis.untrained_feature_indices_ = sorted(
+                untrained, key=lambda u: u[0]
+            )
+            store.save(_CAUSAL_CHECKPOINT_NAME, causal_analysis)
+            _logger.info(
+                "Checkpointed causal analysis of {0} of {1} treatments".format(
+                    len(fitted) + len(untrained), len(treatments)
+                )
+            )
+        # In the original order, which the results follow
+        causal_analysis.feature_inds = treatments
+
+    with replaced_causal_fit(manager, _fit_with_checkpoints):
+        yield
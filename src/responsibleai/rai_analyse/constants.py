@@ -10,6 +10,22 @@ class DashboardInfo:
     RAI_INSIGHTS_MODEL_ID_KEY = "model_id"
     RAI_INSIGHTS_RUN_ID_KEY = "rai_insights_parent_run_id"
     RAI_INSIGHTS_PARENT_FILENAME = "rai_insights.json"
+    RAI_INSIGHTS_CONSTRUCTOR_DIGEST_KEY = "constructor_digest"
+
+    # Content hashes of the files saved by the constructor
+    ARTIFACT_MANIFEST_FILENAME = "artifact_manifest.json"
+    ARTIFACT_MANIFEST_DIGEST_KEY = "digest"
+    ARTIFACT_MANIFEST_FILES_KEY = "files"
+    ARTIFACT_MANIFEST_SHA256_KEY = "sha256"
+    ARTIFACT_MANIFEST_SIZE_KEY = "size"
+
+
+class DashboardLayout:
+    # Dashboard output contains a full copy of the RAIInsights
+    FULL = "full"
+    # Dashboard output contains only the tool results plus the
+    # artifact manifest pointing at the constructor output
+    MANIFEST = "manifest"
 
 
 class PropertyKeyValues:
@@ -44,3 +60,48 @@ class RAIToolType:
     COUNTERFACTUAL = "counterfactual"
     ERROR_ANALYSIS = "error_analysis"
     EXPLANATION = "explanation"
+
+
+class CacheSettings:
+    # Root directory for node-local caches
+    CACHE_ROOT_ENV_VAR = "AZUREML_RAI_CACHE_DIR"
+
+    MODEL_CACHE_SUBDIR = "models"
+
+    RESULT_CACHE_SUBDIR = "results"
+    RESULT_CACHE_MAX_MB_ENV_VAR = "AZUREML_RAI_RESULT_CACHE_MAX_MB"
+    RESULT_CACHE_DEFAULT_MAX_MB = 4096
+
+
+class LocalImportanceMode:
+    # Dense local importances for every row and feature
+    FULL = "full"
+    # Only the k largest (by magnitude) local importances of each row.
+    # The explanation output stores just those, and the dashboard gets
+    # them with the others set to zero
+    TOP_K = "top_k"
+    # No local importances, only the global ones
+    GLOBAL_ONLY = "global_only"
+
+
+class ExplanationSettings:
+    # Written next to the explanation results, and read by gather
+    FILENAME = "explanation_settings.json"
+    LOCAL_IMPORTANCE_MODE_KEY = "local_importance_mode"
+    TOP_K_KEY = "top_k"
+
+
+class NumericPayloadFormat:
+    # Numeric arrays are written inline in dashboard.json
+    JSON = "json"
+    # Local importances, counterfactuals and error analysis matrices are
+    # written to float32 .npy files next to dashboard.json, which holds
+    # references to them
+    NPY = "npy"
+
+
+class ErrorAnalysisEngine:
+    # The LightGBM surrogate tree of the erroranalysis package
+    LIGHTGBM = "lightgbm"
+    # Tree grown from histograms of the pre-binned features
+    HISTOGRAM = "histogram"
@@ -0,0 +1,263 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import functools
+import json
+import logging
+import pickle
+import threading
+
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from dice_ml.constants import ModelTypes
+from sklearn.neighbors import KDTree
+
+from artifact_cache import DirectoryLRUCache
+from constants import RAIToolType
+from counterfactual_parallel import wrapped_explainer_creation
+from result_cache import get_result_cache, get_result_fingerprint
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+_PREDICTIONS_FILENAME = "predictions.npy"
+_LABELS_FILENAME = "labels.npy"
+_POSITIONS_FILENAME_FORMAT = "segment_{0}_positions.npy"
+_TREE_ARRAY_FILENAME_FORMAT = "segment_{0}_tree_{1}.npy"
+_TREE_STATE_FILENAME_FORMAT = "segment_{0}_tree.pkl"
+
+_PREDICTIONS = "predictions"
+_LABELS = "labels"
+_SEGMENTS = "segments"
+
+# The rows in one segment of the training data (those predicted as one
+# class, or within the desired range), and their KD-tree
+_Segment = Tuple[np.ndarray, Optional[KDTree]]
+
+
+def _save_tree(tree: KDTree, target_dir: Path, segment: int) -> None:
+    # The arrays of the tree state go to .npy files, so that they can be
+    # memory-mapped, and everything else is pickled
+    state = list(tree.__getstate__())
+    for i, value in enumerate(state):
+        if isinstance(value, np.ndarray):
+            np.save(target_dir / _TREE_ARRAY_FILENAME_FORMAT.format(segment, i), value)
+            state[i] = None
+    with open(target_dir / _TREE_STATE_FILENAME_FORMAT.format(segment), "wb") as f:
+        pickle.dump(state, f)
+
+
+def _load_tree(source_dir: Path, segment: int) -> KDTree:
+    with open(source_dir / _TREE_STATE_FILENAME_FORMAT.format(segment), "rb") as f:
+        state = pickle.load(f)
+    for i in range(len(state)):
+        array_file = source_dir / _TREE_ARRAY_FILENAME_FORMAT.format(segment, i)
+        if array_file.exists():
+            # Copy-on-write, since some versions of sklearn need
+            # writeable buffers
+            state[i] = np.load(array_file, mmap_mode="c")
+    tree = KDTree.__new__(KDTree)
+    tree.__setstate__(tuple(state))
+    return tree
+
+
+class KDTreeIndex:
+    """The partitions of the training data and their KD-trees which
+    DiCE's build_KD_tree() would compute, for every query instance.
+
+    For classification, the training data is split by predicted class,
+    so one index serves every desired class. For regression, there is
+    one segment per desired range. Each tree is built over the same
+    one-hot encoding of its rows as DiCE uses, so the counterfactuals
+    found are unchanged.
+
+    Indices are built once per process, and if a cache is given, once
+    per cache key, with later runs memory-mapping the saved arrays.
+    """
+
+    def __init__(self, cache: Optional[DirectoryLRUCache], cache_key: Optional[str]):
+        self._cache = cache
+        self._cache_key = cache_key
+        self._indices: Dict[str, Dict[str, Any]] = {}
+        # Explainers computing on several threads may share an index
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Worker processes load the index from the cache again, rather
+        # than receiving a copy of the arrays
+        state = self.__dict__.copy()
+        state["_indices"] = {}
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _compute(
+        self, explainer: Any, data_df: pd.DataFrame, target: Any
+    ) -> Dict[str, Any]:
+        feature_names = explainer.data_interface.feature_names
+        dataset_instance = explainer.data_interface.prepare_query_instance(
+            query_instance=data_df[feature_names]
+        )
+        predictions = np.asarray(explainer.model.model.predict(dataset_instance))
+
+        if explainer.model.model_type == ModelTypes.Classifier:
+            labels = pd.unique(predictions)
+            rows = [np.flatnonzero(predictions == c) for c in labels]
+        else:
+            labels = None
+            low, high = target
+            rows = [np.flatnonzero((low <= predictions) & (predictions <= high))]
+
+        segments: List[_Segment] = []
+        for positions in rows:
+            tree = None
+            if len(positions) > 0:
+                tree = KDTree(pd.get_dummies(data_df[feature_names].iloc[positions]))
+            segments.append((positions, tree))
+        _logger.info("Built KD-tree index with {0} segments".format(len(segments)))
+        return {_PREDICTIONS: predictions, _LABELS: labels, _SEGMENTS: segments}
+
+    @staticmethod
+    def _save(index: Dict[str, Any], target_dir: Path) -> None:
+        np.save(target_dir / _PREDICTIONS_FILENAME, index[_PREDICTIONS])
+        if index[_LABELS] is not None:
+            np.save(target_dir / _LABELS_FILENAME, index[_LABELS])
+        for i, (positions, tree) in enumerate(index[_SEGMENTS]):
+            np.save(target_dir / _POSITIONS_FILENAME_FORMAT.format(i), positions)
+            if tree is not None:
+                _save_tree(tree, target_dir, i)
+
+    @staticmethod
+    def _load(source_dir: Path) -> Dict[str, Any]:
+        labels = None
+        if (source_dir / _LABELS_FILENAME).exists():
+            labels = np.load(source_dir / _LABELS_FILENAME, allow_pickle=True)
+        segments: List[_Segment] = []
+        i = 0
+        while (source_dir / _POSITIONS_FILENAME_FORMAT.format(i)).exists():
+            positions = np.load(source_dir / _POSITIONS_FILENAME_FORMAT.format(i))
+            tree = None
+            if len(positions) > 0:
+                tree = _load_tree(source_dir, i)
+            segments.append((positions, tree))
+            i += 1
+        predictions = np.load(source_dir / _PREDICTIONS_FILENAME, allow_pickle=True)
+        return {_PREDICTIONS: predictions, _LABELS: labels, _SEGMENTS: segments}
+
+    def _get_index(
+        self, explainer: Any, data_df: pd.DataFrame, target: Any
+    ) -> Dict[str, Any]:
+        key = json.dumps([self._cache_key, target])
+        with self._lock:
+            if key not in self._indices:
+                self._indices[key] = self._create_index(explainer, data_df, target, key)
+            return self._indices[key]
+
+    def _create_index(
+        self, explainer: Any, data_df: pd.DataFrame, target: Any, key: str
+    ) -> Dict[str, Any]:
+        if self._cache is None or self._cache_key is None:
+            index = self._compute(explainer, data_df, target)
+        else:
+
+            def _populate(target_dir: Path):
+                self._save(self._compute(explainer, data_df, target), target_dir)
+
+            # Mapped files stay readable even if the entry is evicted
+            with self._cache.entry(key, _populate) as cached_dir:
+                index = self._load(cached_dir)
+        return index
+
+    def build_KD_tree(
+        self,
+        explainer: Any,
+        data_df_copy: pd.DataFrame,
+        desired_range: Any,
+        desired_class: Any,
+        predicted_outcome_name: str,
+    ):
+        # Same arguments and results as DiCE's build_KD_tree()
+        is_classifier = explainer.model.model_type == ModelTypes.Classifier
+        target = None if is_classifier else list(desired_range)
+        index = self._get_index(explainer, data_df_copy, target)
+        predictions = index[_PREDICTIONS]
+        data_df_copy[predicted_outcome_name] = predictions
+
+        segment = None
+        if is_classifier:
+            # Compared as DiCE does
+            for label, label_segment in zip(index[_LABELS], index[_SEGMENTS]):
+                if label == desired_class:
+                    segment = label_segment
+                    break
+        else:
+            segment = index[_SEGMENTS][0]
+
+        if segment is None:
+            return data_df_copy.iloc[[]].copy(), None, predictions
+        positions, tree = segment
+        return data_df_copy.iloc[positions].copy(), tree, predictions
+
+
+def _index_cache_key(input_port_path: str, explainer: Any) -> Optional[str]:
+    # The constructor digest covers the model and training data. The
+    # encoding depends on which features DiCE treats as continuous, and
+    # the saved trees on the library versions
+    return get_result_fingerprint(
+        input_port_path,
+        RAIToolType.COUNTERFACTUAL,
+        {
+            "index": "kdtree",
+            "continuous_features": explainer.data_interface.continuous_feature_names,
+            "model_type": explainer.model.model_type,
+            "sklearn_version": sklearn.__version__,
+            "pandas_version": pd.__version__,
+        },
+    )
+
+
+@contextlib.contextmanager
+def kdtree_index(
+    manager: Any,
+    input_port_path: str,
+    use_result_cache: bool,
+    result_cache_dir: Optional[str],
+) -> Iterator[None]:
+    """Have the DiCE explainers created by the counterfactual manager
+    take their KD-trees from a KDTreeIndex, kept in the result cache if
+    one is used.
+
+    Only the kdtree method (and the genetic method's kdtree
+    initialization) build KD-trees, so nothing is built otherwise.
+    """
+    cache = get_result_cache(use_result_cache, result_cache_dir)
+    # Shared by the explainers of configurations with the same encoding
+    indices: Dict[Any, KDTreeIndex] = {}
+    lock = threading.Lock()
+
+    def _use_index(explainer):
+        cache_key = _index_cache_key(input_port_path, explainer)
+        # Without a cache key, only explainers over the same DiCE data
+        # interface share an index
+        index_key = cache_key
+        if cache_key is None:
+            index_key = id(explainer.data_interface)
+        with lock:
+            if index_key not in indices:
+                indices[index_key] = KDTreeIndex(cache, cache_key)
+            index = indices[index_key]
+        explainer.build_KD_tree = functools.partial(index.build_KD_tree, explainer)
+        return explainer
+
+    with wrapped_explainer_creation(manager, _use_index):
+        yield
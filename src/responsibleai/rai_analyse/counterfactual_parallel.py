@@ -0,0 +1,291 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import signal
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from dice_ml.counterfactual_explanations import CounterfactualExplanations
+from dice_ml.diverse_counterfactuals import CounterfactualExamples
+from dice_ml.utils.exception import UserConfigValidationException
+
+from model_wrappers import single_threaded_workers
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+# DiCE explainer unpickled once in each worker process
+_worker_explainer: Optional[Any] = None
+
+
+class _InstanceTimeout(BaseException):
+    # Not an Exception, so that DiCE cannot swallow it
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _InstanceTimeout()
+
+
+@contextlib.contextmanager
+def _time_limit(seconds: Optional[float]) -> Iterator[None]:
+    # SIGALRM is only available on Unix, and only in the main thread
+    if (
+        seconds is None
+        or not hasattr(signal, "SIGALRM")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _empty_examples(
+    explainer: Any, query_instance: pd.DataFrame, kwargs: Dict[str, Any]
+) -> CounterfactualExamples:
+    # What DiCE records for a query instance without counterfactuals
+    data_interface = explainer.data_interface
+    test_instance_df = data_interface.prepare_query_instance(query_instance)
+    test_instance_df[data_interface.outcome_name] = explainer.model.model.predict(
+        query_instance
+    )
+    return CounterfactualExamples(
+        data_interface=data_interface,
+        final_cfs_df=None,
+        test_instance_df=test_instance_df,
+        final_cfs_df_sparse=None,
+        posthoc_sparsity_param=kwargs.get("posthoc_sparsity_param", 0.1),
+        desired_class=kwargs.get("desired_class", "opposite"),
+        desired_range=kwargs.get("desired_range"),
+        model_type=explainer.model.model_type,
+    )
+
+
+def _generate_one(
+    explainer: Any,
+    query_instance: pd.DataFrame,
+    total_CFs: int,
+    timeout: Optional[float],
+    kwargs: Dict[str, Any],
+) -> Optional[CounterfactualExamples]:
+    # As DiCE's generate_counterfactuals() does for each query instance,
+    # but giving up after the timeout. None is returned on a timeout
+    explainer.data_interface.set_continuous_feature_indexes(query_instance)
+    try:
+        with _time_limit(timeout):
+            return explainer._generate_counterfactuals(
+                query_instance, total_CFs, **kwargs
+            )
+    except _InstanceTimeout:
+        return None
+
+
+def _init_worker(pickled_explainer: bytes) -> None:
+    global _worker_explainer
+    _worker_explainer = pickle.loads(pickled_explainer)
+
+
+def _generate_in_worker(
+    query_instance: pd.DataFrame,
+    total_CFs: int,
+    timeout: Optional[float],
+    kwargs: Dict[str, Any],
+) -> Optional[CounterfactualExamples]:
+    examples = _generate_one(
+        _worker_explainer, query_instance, total_CFs, timeout, kwargs
+    )
+    if examples is not None:
+        # Holds the training data, which the parent process already has
+        examples.data_interface = None
+    return examples
+
+
+class ParallelCounterfactualGenerator:
+    """Replacement for the generate_counterfactuals() method of a DiCE
+    explainer, which spreads the query instances over a process pool
+    and limits the time spent on each of them.
+
+    The explainer, including the model, is pickled once and loaded
+    once per worker. A query instance which runs out of time is
+    recorded without counterfactuals, as DiCE does for instances it
+    finds none for, so a few slow instances cannot stall the run.
+    """
+
+    def __init__(
+        self, explainer: Any, n_jobs: int, per_instance_timeout: Optional[float]
+    ):
+        self._explainer = explainer
+        self._n_jobs = n_jobs
+        self._timeout = per_instance_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_workers = 0
+        self.n_timeouts = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The explainer sent to the workers holds this generator
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
+
+    def close(self) -> None:
+        # The pool is kept between calls (e.g. for batches of query
+        # instances), so that the workers load the explainer once
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+            self._executor_workers = 0
+
+    def __call__(
+        self, query_instances: Any, total_CFs: int, **kwargs
+    ) -> CounterfactualExplanations:
+        if total_CFs <= 0:
+            raise UserConfigValidationException(
+                "The number of counterfactuals generated per query instance "
+                "(total_CFs) should be a positive integer."
+            )
+        if isinstance(query_instances, pd.DataFrame):
+            query_list = [
+                query_instances[i : i + 1] for i in range(query_instances.shape[0])
+            ]
+        else:
+            query_list = list(query_instances)
+
+        n_workers = max(1, min(self._n_jobs, len(query_list)))
+        # Timeouts can only be enforced in the main thread, so a worker
+        # process is used from other threads (e.g. concurrent targets)
+        in_process = self._timeout is None or (
+            threading.current_thread() is threading.main_thread()
+        )
+        if n_workers <= 1 and in_process:
+            results = [
+                _generate_one(self._explainer, q, total_CFs, self._timeout, kwargs)
+                for q in query_list
+            ]
+        else:
+            results = self._generate_on_pool(query_list, total_CFs, kwargs, n_workers)
+
+        examples_list = []
+        n_timeouts = 0
+        for query_instance, examples in zip(query_list, results):
+            if examples is None:
+                n_timeouts += 1
+                examples = _empty_examples(self._explainer, query_instance, kwargs)
+            examples.data_interface = self._explainer.data_interface
+            examples_list.append(examples)
+        if n_timeouts > 0:
+            _logger.warning(
+                "{0} of {1} query instances timed out after {2} seconds".format(
+                    n_timeouts, len(query_list), self._timeout
+                )
+            )
+        self.n_timeouts += n_timeouts
+        return CounterfactualExplanations(cf_examples_list=examples_list)
+
+    def _generate_on_pool(
+        self,
+        query_list: List[pd.DataFrame],
+        total_CFs: int,
+        kwargs: Dict[str, Any],
+        n_workers: int,
+    ) -> List[Optional[CounterfactualExamples]]:
+        _logger.info(
+            "Generating counterfactuals for {0} instances on {1} processes".format(
+                len(query_list), n_workers
+            )
+        )
+        # Small chunks, so that slow instances even out over the workers
+        chunksize = max(1, int(math.ceil(len(query_list) / (n_workers * 16))))
+        with single_threaded_workers():
+            if self._executor_workers < n_workers:
+                # Only as many workers as the calls so far have needed
+                self.close()
+                self._executor_workers = n_workers
+                self._executor = ProcessPoolExecutor(
+                    max_workers=n_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(pickle.dumps(self._explainer),),
+                )
+            return list(
+                self._executor.map(
+                    _generate_in_worker,
+                    query_list,
+                    [total_CFs] * len(query_list),
+                    [self._timeout] * len(query_list),
+                    [kwargs] * len(query_list),
+                    chunksize=chunksize,
+                )
+            )
+
+
+@contextlib.contextmanager
+def wrapped_explainer_creation(
+    manager: Any, wrap: Callable[[Any], Any]
+) -> Iterator[None]:
+    # Pass each DiCE explainer the counterfactual manager creates
+    # through wrap(). Nested uses wrap in turn, innermost last
+    create_explainer = manager._create_diceml_explainer
+    patched = "_create_diceml_explainer" in vars(manager)
+
+    def _create_wrapped_explainer(*args, **kwargs):
+        return wrap(create_explainer(*args, **kwargs))
+
+    manager._create_diceml_explainer = _create_wrapped_explainer
+    try:
+        yield
+    finally:
+        if patched:
+            manager._create_diceml_explainer = create_explainer
+        else:
+            del manager._create_diceml_explainer
+
+
+@contextlib.contextmanager
+def parallel_counterfactuals(
+    manager: Any, n_jobs: int, per_instance_timeout: Optional[float]
+) -> Iterator[List[ParallelCounterfactualGenerator]]:
+    """Have the DiCE explainers created by the counterfactual manager
+    generate counterfactuals with ParallelCounterfactualGenerator.
+
+    DiCE's feature importance methods also go through the explainer's
+    generate_counterfactuals(), so they are covered as well. Yields the
+    list of generators, which count the instances that timed out.
+    """
+    generators: List[ParallelCounterfactualGenerator] = []
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if n_jobs == 1 and per_instance_timeout is None:
+        yield generators
+        return
+
+    def _parallelise(explainer):
+        generator = ParallelCounterfactualGenerator(
+            explainer, n_jobs, per_instance_timeout
+        )
+        generators.append(generator)
+        explainer.generate_counterfactuals = generator
+        return explainer
+
+    try:
+        with wrapped_explainer_creation(manager, _parallelise):
+            yield generators
+    finally:
+        for generator in generators:
+            generator.close()
@@ -0,0 +1,115 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import copy
+import json
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+import dice_ml
+
+from dice_ml import Dice
+from responsibleai._managers.counterfactual_manager import CounterfactualConstants
+from responsibleai.rai_insights.constants import ModelTask
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+# The parts of a counterfactual configuration which a target sets
+TARGET_KEYS = ["desired_class", "desired_range"]
+
+
+def get_target_configs(
+    counterfactual_config: Dict[str, Any], targets: List[Dict[str, Any]]
+) -> List[Dict[str, Any]]:
+    # One configuration per target, which otherwise match the given one
+    configs = []
+    for target in targets:
+        unknown_keys = set(target) - set(TARGET_KEYS)
+        if len(unknown_keys) > 0:
+            raise ValueError(
+                "Unknown counterfactual target keys {0}, expected {1}".format(
+                    sorted(unknown_keys), TARGET_KEYS
+                )
+            )
+        configs.append(dict(counterfactual_config, **target))
+    return configs
+
+
+@contextlib.contextmanager
+def shared_dice_setup(manager: Any) -> Iterator[None]:
+    """Have the counterfactual manager create its DiCE explainers from a
+    single DiCE data interface (per set of continuous features) and
+    model, instead of building both again for every configuration.
+
+    Each configuration still gets an explainer of its own, since DiCE
+    keeps per-query state on the explainer. This replaces the manager's
+    own _create_diceml_explainer(), so must be entered before any
+    context which wraps it.
+    """
+    lock = threading.Lock()
+    data_interfaces: Dict[str, Any] = {}
+    models: List[Any] = []
+
+    def _create_diceml_explainer(method, continuous_features):
+        key = json.dumps(list(continuous_features))
+        with lock:
+            if key not in data_interfaces:
+                data_interfaces[key] = dice_ml.Data(
+                    dataframe=manager._train,
+                    continuous_features=continuous_features,
+                    outcome_name=manager._target_column,
+                )
+            if len(models) == 0:
+                model_type = (
+                    CounterfactualConstants.CLASSIFIER
+                    if manager._task_type == ModelTask.CLASSIFICATION
+                    else CounterfactualConstants.REGRESSOR
+                )
+                models.append(
+                    dice_ml.Model(
+                        model=manager._model,
+                        backend=CounterfactualConstants.SKLEARN,
+                        model_type=model_type,
+                    )
+                )
+        return Dice(data_interfaces[key], models[0], method=method)
+
+    manager._create_diceml_explainer = _create_diceml_explainer
+    try:
+        yield
+    finally:
+        del manager._create_diceml_explainer
+
+
+def compute_concurrently(manager: Any, n_workers: int) -> None:
+    """Compute the pending configurations of the counterfactual manager
+    on a thread pool, leaving nothing for its compute() to do.
+
+    Each configuration is computed by the manager's own compute(), on a
+    shallow copy of the manager which holds only that configuration, so
+    the results and any failure are recorded as usual.
+    """
+    configs = [c for c in manager._counterfactual_config_list if not c.is_computed]
+    n_workers = min(n_workers, len(configs))
+    if n_workers <= 1:
+        return
+
+    def _compute(config):
+        config_manager = copy.copy(manager)
+        config_manager._counterfactual_config_list = [config]
+        config_manager.compute()
+
+    _logger.info(
+        "Computing {0} counterfactual configurations on {1} threads".format(
+            len(configs), n_workers
+        )
+    )
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for future in [executor.submit(_compute, c) for c in configs]:
+            future.result()
@@ -8,17 +8,29 @@ import logging
 
 from pathlib import Path
 from shutil import copyfile
+from typing import Any, Dict, Optional
 
 from responsibleai import RAIInsights
 
 
+from causal_fits import (
+    cached_outcome_model,
+    causal_core_budget,
+    get_core_budget,
+    get_treatment_n_jobs,
+)
+from checkpoints import CheckpointStore, checkpointed_causal_fits
 from constants import RAIToolType, DashboardInfo
+from result_cache import compute_with_result_cache
+from model_wrappers import create_model_wrapper, log_model_statistics
 from rai_component_utilities import (
     load_rai_insights_from_input_port,
     save_to_output_port,
     copy_dashboard_info_file,
 )
 from arg_helpers import (
+    add_inference_arguments,
+    add_result_cache_arguments,
     float_or_json_parser,
     boolean_parser,
     str_or_list_parser,
@@ -58,8 +70,30 @@ def parse_args():
     parser.add_argument("--verbose", type=int)
     parser.add_argument("--random_state", type=int_or_none_parser)
 
+    parser.add_argument(
+        "--checkpoint_treatments",
+        type=boolean_parser,
+        default=False,
+        help="Checkpoint the analysis as each treatment feature is fit",
+    )
+    parser.add_argument(
+        "--core_budget",
+        type=int,
+        default=0,
+        help="Cores shared by the treatment fits, 0 to use all cores",
+    )
+    parser.add_argument(
+        "--cache_outcome_model",
+        type=boolean_parser,
+        default=False,
+        help="Reuse the outcome model selection of earlier causal analyses",
+    )
+
     parser.add_argument("--causal_path", type=str)
 
+    add_inference_arguments(parser)
+    add_result_cache_arguments(parser)
+
     # parse args
     args = parser.parse_args()
 
@@ -67,12 +101,51 @@ def parse_args():
     return args
 
 
-def main(args):
+def compute_causal(
+    args,
+    causal_config: Dict[str, Any],
+    checkpoint_store: Optional[CheckpointStore],
+) -> None:
     # Load the RAI Insights object
-    rai_i: RAIInsights = load_rai_insights_from_input_port(args.rai_insights_dashboard)
+    rai_i: RAIInsights = load_rai_insights_from_input_port(
+        args.rai_insights_dashboard,
+        tool_type=RAIToolType.CAUSAL,
+        model_wrapper=create_model_wrapper(
+            args.inference_chunk_size,
+            args.inference_n_jobs,
+            args.prediction_cache_rows,
+        ),
+        cache_preprocessing=args.cache_preprocessing,
+    )
+
+    # The treatments are fit concurrently, within the core budget
+    core_budget = get_core_budget(args.core_budget)
+    n_jobs = get_treatment_n_jobs(
+        causal_config["n_jobs"], causal_config["treatment_features"], core_budget
+    )
+
+    # Add the causal analysis, which is computed as it is added
+    with causal_core_budget(n_jobs, core_budget), cached_outcome_model(
+        rai_i.causal,
+        args.cache_outcome_model,
+        args.rai_insights_dashboard,
+        args.result_cache_dir,
+    ), checkpointed_causal_fits(rai_i.causal, checkpoint_store):
+        rai_i.causal.add(**dict(causal_config, n_jobs=n_jobs))
+    _logger.info("Added causal")
+
+    # Compute
+    rai_i.compute()
+    _logger.info("Computation complete")
+    log_model_statistics(rai_i.model)
 
-    # Add the causal analysis
-    rai_i.causal.add(
+    # Save
+    save_to_output_port(rai_i, args.causal_path, RAIToolType.CAUSAL)
+    _logger.info("Saved computation to output port")
+
+
+def main(args):
+    causal_config = dict(
         treatment_features=args.treatment_features,
         heterogeneity_features=args.heterogeneity_features,
         nuisance_model=args.nuisance_model,
@@ -88,15 +161,25 @@ def main(args):
         verbose=args.verbose,
         random_state=args.random_state,
     )
-    _logger.info("Added causal")
 
-    # Compute
-    rai_i.compute()
-    _logger.info("Computation complete")
-
-    # Save
-    save_to_output_port(rai_i, args.causal_path, RAIToolType.CAUSAL)
-    _logger.info("Saved computation to output port")
+    # Partial results, in case the run is preempted and restarted
+    checkpoint_store = None
+    if args.checkpoint_treatments:
+        checkpoint_store = CheckpointStore(
+            args.causal_path, RAIToolType.CAUSAL, causal_config
+        )
+
+    compute_with_result_cache(
+        args.rai_insights_dashboard,
+        args.causal_path,
+        RAIToolType.CAUSAL,
+        causal_config,
+        args.use_result_cache,
+        args.result_cache_dir,
+        lambda: compute_causal(args, causal_config, checkpoint_store),
+    )
+    if checkpoint_store is not None:
+        checkpoint_store.clear()
 
     # Copy the dashboard info file
     copy_dashboard_info_file(args.rai_insights_dashboard, args.causal_path)
@@ -5,17 +5,37 @@
 import argparse
 import json
 import logging
+import os
+
+from typing import Any, Dict, List, Optional
 
 from responsibleai import RAIInsights
 
 
+from checkpoints import CheckpointStore, checkpointed_counterfactuals
 from constants import RAIToolType
+from counterfactual_index import kdtree_index
+from counterfactual_parallel import parallel_counterfactuals
+from counterfactual_targets import (
+    compute_concurrently,
+    get_target_configs,
+    shared_dice_setup,
+)
+from result_cache import compute_with_result_cache
+from model_wrappers import create_model_wrapper, log_model_statistics
 from rai_component_utilities import (
     load_rai_insights_from_input_port,
     save_to_output_port,
     copy_dashboard_info_file,
 )
-from arg_helpers import boolean_parser, str_or_int_parser, str_or_list_parser
+from arg_helpers import (
+    boolean_parser,
+    str_or_int_parser,
+    str_or_list_parser,
+    float_or_none_parser,
+    add_inference_arguments,
+    add_result_cache_arguments,
+)
 
 _logger = logging.getLogger(__file__)
 logging.basicConfig(level=logging.INFO)
@@ -33,8 +53,30 @@ def parse_args():
     parser.add_argument("--permitted_range", type=json.loads, help="Dict")
     parser.add_argument("--features_to_vary", type=str_or_list_parser)
     parser.add_argument("--feature_importance", type=boolean_parser)
+    parser.add_argument(
+        "--targets",
+        type=json.loads,
+        default=None,
+        help="Optional[List[Dict]] desired_class or desired_range per target",
+    )
+    parser.add_argument("--n_jobs", type=int, default=1)
+    parser.add_argument(
+        "--per_instance_timeout_seconds",
+        type=float_or_none_parser,
+        default=None,
+        help="Optional[float] use 'None' for no timeout",
+    )
+    parser.add_argument(
+        "--checkpoint_batch_size",
+        type=int,
+        default=0,
+        help="Query rows per checkpoint, 0 to disable checkpoints",
+    )
     parser.add_argument("--counterfactual_path", type=str)
 
+    add_inference_arguments(parser)
+    add_result_cache_arguments(parser)
+
     # parse args
     args = parser.parse_args()
 
@@ -42,12 +84,71 @@ def parse_args():
     return args
 
 
-def main(args):
+def get_counterfactual_configs(
+    args, counterfactual_config: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    if args.targets is None:
+        return [counterfactual_config]
+    assert isinstance(args.targets, list), "Expected a list"
+    assert len(args.targets) > 0, "Expected at least one target"
+    return get_target_configs(counterfactual_config, args.targets)
+
+
+def compute_counterfactual(
+    args,
+    counterfactual_configs: List[Dict[str, Any]],
+    checkpoint_store: Optional[CheckpointStore],
+) -> bool:
     # Load the RAI Insights object
-    rai_i: RAIInsights = load_rai_insights_from_input_port(args.rai_insights_dashboard)
+    rai_i: RAIInsights = load_rai_insights_from_input_port(
+        args.rai_insights_dashboard,
+        tool_type=RAIToolType.COUNTERFACTUAL,
+        model_wrapper=create_model_wrapper(
+            args.inference_chunk_size,
+            args.inference_n_jobs,
+            args.prediction_cache_rows,
+        ),
+        cache_preprocessing=args.cache_preprocessing,
+    )
 
-    # Add the counterfactual
-    rai_i.counterfactual.add(
+    # Add the counterfactuals, one per target
+    for counterfactual_config in counterfactual_configs:
+        rai_i.counterfactual.add(**counterfactual_config)
+    _logger.info("Added {0} counterfactuals".format(len(counterfactual_configs)))
+
+    # The jobs are split between the targets computed at once, and the
+    # query instances of each
+    n_jobs = args.n_jobs if args.n_jobs >= 1 else os.cpu_count()
+    n_target_jobs = min(n_jobs, len(counterfactual_configs))
+    n_instance_jobs = max(1, n_jobs // n_target_jobs)
+
+    # Compute, with the KD-trees of the kdtree method reused between runs
+    with shared_dice_setup(rai_i.counterfactual), kdtree_index(
+        rai_i.counterfactual,
+        args.rai_insights_dashboard,
+        args.use_result_cache,
+        args.result_cache_dir,
+    ), parallel_counterfactuals(
+        rai_i.counterfactual, n_instance_jobs, args.per_instance_timeout_seconds
+    ) as generators, checkpointed_counterfactuals(
+        rai_i.counterfactual, checkpoint_store, args.checkpoint_batch_size
+    ):
+        compute_concurrently(rai_i.counterfactual, n_target_jobs)
+        rai_i.compute()
+    _logger.info("Computation complete")
+    log_model_statistics(rai_i.model)
+
+    # Save
+    save_to_output_port(rai_i, args.counterfactual_path, RAIToolType.COUNTERFACTUAL)
+    _logger.info("Saved to output port")
+
+    # Which instances time out depends on the load of the node, so such
+    # results are not kept in the result cache
+    return sum(generator.n_timeouts for generator in generators) == 0
+
+
+def main(args):
+    counterfactual_config = dict(
         total_CFs=args.total_CFs,
         method=args.method,
         desired_class=args.desired_class,
@@ -56,15 +157,32 @@ def main(args):
         features_to_vary=args.features_to_vary,
         feature_importance=args.feature_importance,
     )
-    _logger.info("Added counterfactual")
-
-    # Compute
-    rai_i.compute()
-    _logger.info("Computation complete")
+    counterfactual_configs = get_counterfactual_configs(args, counterfactual_config)
+    # Timeouts change which instances get counterfactuals
+    result_config = dict(
+        counterfactual_config,
+        targets=args.targets,
+        per_instance_timeout_seconds=args.per_instance_timeout_seconds,
+    )
 
-    # Save
-    save_to_output_port(rai_i, args.counterfactual_path, RAIToolType.COUNTERFACTUAL)
-    _logger.info("Saved to output port")
+    # Partial results, in case the run is preempted and restarted
+    checkpoint_store = None
+    if args.checkpoint_batch_size > 0:
+        checkpoint_store = CheckpointStore(
+            args.counterfactual_path, RAIToolType.COUNTERFACTUAL, result_config
+        )
+
+    compute_with_result_cache(
+        args.rai_insights_dashboard,
+        args.counterfactual_path,
+        RAIToolType.COUNTERFACTUAL,
+        result_config,
+        args.use_result_cache,
+        args.result_cache_dir,
+        lambda: compute_counterfactual(args, counterfactual_configs, checkpoint_store),
+    )
+    if checkpoint_store is not None:
+        checkpoint_store.clear()
 
     # Copy the dashboard info file
     copy_dashboard_info_file(args.rai_insights_dashboard, args.counterfactual_path)
@@ -6,10 +6,16 @@ import argparse
 import json
 import logging
 
+from typing import Any, Dict, List
+
 from responsibleai import RAIInsights
 
 
-from constants import RAIToolType
+from constants import ErrorAnalysisEngine, RAIToolType
+from arg_helpers import add_inference_arguments, add_result_cache_arguments
+from error_analysis_reports import precomputed_error_reports
+from result_cache import compute_with_result_cache
+from model_wrappers import create_model_wrapper, log_model_statistics
 from rai_component_utilities import (
     load_rai_insights_from_input_port,
     save_to_output_port,
@@ -28,39 +34,95 @@ def parse_args():
     parser.add_argument("--max_depth", type=int)
     parser.add_argument("--num_leaves", type=int)
     parser.add_argument("--filter_features", type=json.loads, help="List")
+    parser.add_argument(
+        "--configurations",
+        type=json.loads,
+        help="Optional[List[Dict]] use 'null' to skip",
+        default="null",
+    )
+    parser.add_argument("--n_jobs", type=int, default=1)
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=[ErrorAnalysisEngine.LIGHTGBM, ErrorAnalysisEngine.HISTOGRAM],
+        default=ErrorAnalysisEngine.LIGHTGBM,
+    )
     parser.add_argument("--error_analysis_path", type=str)
 
+    add_inference_arguments(parser)
+    add_result_cache_arguments(parser)
+
     # parse args
     args = parser.parse_args()
 
-    # Patch issue with argument passing
-    if isinstance(args.filter_features, list) and len(args.filter_features) == 0:
-        args.filter_features = None
-
     # return args
     return args
 
 
-def main(args):
+def get_error_analysis_configs(args) -> List[Dict[str, Any]]:
+    if args.configurations is None:
+        configs = [
+            dict(
+                max_depth=args.max_depth,
+                num_leaves=args.num_leaves,
+                filter_features=args.filter_features,
+            )
+        ]
+    else:
+        assert isinstance(args.configurations, list), "Expected a list"
+        assert len(args.configurations) > 0, "Expected at least one configuration"
+        configs = [dict(c) for c in args.configurations]
+
+    for config in configs:
+        # Patch issue with argument passing
+        filter_features = config.get("filter_features")
+        if isinstance(filter_features, list) and len(filter_features) == 0:
+            config["filter_features"] = None
+    return configs
+
+
+def compute_error_analysis(args, error_analysis_configs: List[Dict[str, Any]]) -> None:
     # Load the RAI Insights object
-    rai_i: RAIInsights = load_rai_insights_from_input_port(args.rai_insights_dashboard)
-
-    # Add the error analysis
-    rai_i.error_analysis.add(
-        max_depth=args.max_depth,
-        num_leaves=args.num_leaves,
-        filter_features=args.filter_features,
+    rai_i: RAIInsights = load_rai_insights_from_input_port(
+        args.rai_insights_dashboard,
+        tool_type=RAIToolType.ERROR_ANALYSIS,
+        model_wrapper=create_model_wrapper(
+            args.inference_chunk_size,
+            args.inference_n_jobs,
+            args.prediction_cache_rows,
+        ),
+        cache_preprocessing=args.cache_preprocessing,
     )
-    _logger.info("Added error analysis")
 
-    # Compute
-    rai_i.compute()
+    # Add the error analyses
+    for config in error_analysis_configs:
+        rai_i.error_analysis.add(**config)
+    _logger.info("Added {0} error analyses".format(len(error_analysis_configs)))
+
+    # Compute, building the reports for all configurations together
+    with precomputed_error_reports(rai_i.error_analysis, args.n_jobs, args.engine):
+        rai_i.compute()
     _logger.info("Computation complete")
+    log_model_statistics(rai_i.model)
 
     # Save
     save_to_output_port(rai_i, args.error_analysis_path, RAIToolType.ERROR_ANALYSIS)
     _logger.info("Saved to output port")
 
+
+def main(args):
+    error_analysis_configs = get_error_analysis_configs(args)
+
+    compute_with_result_cache(
+        args.rai_insights_dashboard,
+        args.error_analysis_path,
+        RAIToolType.ERROR_ANALYSIS,
+        dict(configurations=error_analysis_configs, engine=args.engine),
+        args.use_result_cache,
+        args.result_cache_dir,
+        lambda: compute_error_analysis(args, error_analysis_configs),
+    )
+
     # Copy the dashboard info file
     copy_dashboard_info_file(args.rai_insights_dashboard, args.error_analysis_path)
 
@@ -5,10 +5,25 @@
 import argparse
 import logging
 
+from pathlib import Path
+from typing import Any, Dict
+
 from responsibleai import RAIInsights
 
 
-from constants import RAIToolType
+from constants import LocalImportanceMode, RAIToolType
+from arg_helpers import (
+    add_inference_arguments,
+    add_result_cache_arguments,
+    int_or_none_parser,
+)
+from explanation_output import (
+    save_explanation_settings,
+    store_top_k_local_importances,
+)
+from explanation_sharding import sharded_explanations
+from result_cache import compute_with_result_cache
+from model_wrappers import create_model_wrapper, log_model_statistics
 from rai_component_utilities import (
     load_rai_insights_from_input_port,
     save_to_output_port,
@@ -26,30 +41,93 @@ def parse_args():
     parser.add_argument("--rai_insights_dashboard", type=str, required=True)
     parser.add_argument("--comment", type=str, required=True)
     parser.add_argument("--explanation_path", type=str, required=True)
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Processes for local importances, -1 to use all cores",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int_or_none_parser,
+        default=None,
+        help="Optional[int] rows per shard, 'None' for one shard per process",
+    )
+    parser.add_argument(
+        "--local_importance_mode",
+        type=str,
+        default=LocalImportanceMode.FULL,
+        choices=[
+            LocalImportanceMode.FULL,
+            LocalImportanceMode.TOP_K,
+            LocalImportanceMode.GLOBAL_ONLY,
+        ],
+    )
+    parser.add_argument("--top_k", type=int, default=10)
+
+    add_inference_arguments(parser)
+    add_result_cache_arguments(parser)
 
     # parse args
     args = parser.parse_args()
 
+    if args.local_importance_mode == LocalImportanceMode.TOP_K and args.top_k < 1:
+        raise ValueError("top_k must be positive: {0}".format(args.top_k))
+
     # return args
     return args
 
 
-def main(args):
+def compute_explanation(args, explanation_config: Dict[str, Any]) -> None:
     # Load the RAI Insights object
-    rai_i: RAIInsights = load_rai_insights_from_input_port(args.rai_insights_dashboard)
-
-    # Add the explanation
-    rai_i.explainer.add()
-    _logger.info("Added explanation")
-
-    # Compute
-    rai_i.compute()
-    _logger.info("Computation complete")
+    rai_i: RAIInsights = load_rai_insights_from_input_port(
+        args.rai_insights_dashboard,
+        tool_type=RAIToolType.EXPLANATION,
+        model_wrapper=create_model_wrapper(
+            args.inference_chunk_size,
+            args.inference_n_jobs,
+            args.prediction_cache_rows,
+        ),
+        cache_preprocessing=args.cache_preprocessing,
+    )
+
+    # Sharding does not change the result, so is not part of the config
+    with sharded_explanations(args.n_jobs, args.chunk_size):
+        # Add the explanation
+        rai_i.explainer.add(**explanation_config)
+        _logger.info("Added explanation")
+
+        # Compute
+        rai_i.compute()
+        _logger.info("Computation complete")
+    log_model_statistics(rai_i.model)
 
     # Save
     save_to_output_port(rai_i, args.explanation_path, RAIToolType.EXPLANATION)
     _logger.info("Saved to output port")
 
+
+def main(args):
+    explanation_config = dict()
+
+    compute_with_result_cache(
+        args.rai_insights_dashboard,
+        args.explanation_path,
+        RAIToolType.EXPLANATION,
+        explanation_config,
+        args.use_result_cache,
+        args.result_cache_dir,
+        lambda: compute_explanation(args, explanation_config),
+    )
+
+    # The cached result keeps the full local importances, since the mode
+    # is not part of its config. Gather expands the top-k form again
+    if args.local_importance_mode == LocalImportanceMode.TOP_K:
+        store_top_k_local_importances(Path(args.explanation_path), args.top_k)
+    save_explanation_settings(
+        args.explanation_path, args.local_importance_mode, args.top_k
+    )
+
     # Copy the dashboard info file
     copy_dashboard_info_file(args.rai_insights_dashboard, args.explanation_path)
 
@@ -6,17 +6,24 @@ import argparse
 import json
 import logging
 import os
-from typing import Any
+from pathlib import Path
+from typing import Any, List, Optional
 
 import mlflow
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
 
 from azureml.core import Model, Run, Workspace
 
 from responsibleai import RAIInsights, __version__ as responsibleai_version
 
-from constants import DashboardInfo, PropertyKeyValues
-from arg_helpers import get_from_args
+from constants import CacheSettings, DashboardInfo, PropertyKeyValues
+from arg_helpers import boolean_parser, get_from_args, int_or_none_parser
+from artifact_cache import DirectoryLRUCache, get_node_cache
+from model_wrappers import save_prediction_store
+from dataset_sampling import count_rows, find_arrow_files, sample_dataset
+from rai_component_utilities import load_saved_features, write_artifact_manifest
 
 _logger = logging.getLogger(__file__)
 logging.basicConfig(level=logging.INFO)
@@ -42,9 +49,32 @@ def parse_args():
     parser.add_argument("--target_column_name", type=str, required=True)
 
     parser.add_argument("--maximum_rows_for_test_dataset", type=int, default=5000)
+    parser.add_argument("--maximum_rows_for_train_dataset", type=int, default=None)
+    parser.add_argument("--stratify_sampling", type=boolean_parser, default=True)
+    parser.add_argument(
+        "--sampling_random_state", type=int_or_none_parser, default=None
+    )
     parser.add_argument(
         "--categorical_column_names", type=str, help="Optional[List[str]]"
     )
+    parser.add_argument(
+        "--feature_column_names",
+        type=str,
+        help="Optional[List[str]] use 'null' to load all columns",
+    )
+
+    parser.add_argument(
+        "--model_cache_max_mb",
+        type=int_or_none_parser,
+        default=None,
+        help="Optional[int] size of the model cache, 'None' to disable",
+    )
+    parser.add_argument(
+        "--model_cache_dir",
+        type=str,
+        default=None,
+        help="Optional directory for the model cache, else a node-local one",
+    )
 
     parser.add_argument("--output_path", type=str, help="Path to output JSON")
 
@@ -64,35 +94,167 @@ def fetch_model_id(args):
     return model_info[DashboardInfo.MODEL_ID_KEY]
 
 
-def load_mlflow_model(workspace: Workspace, model_id: str) -> Any:
+def _get_model_uri(workspace: Workspace, model_id: str) -> str:
+    model = Model._get(workspace, id=model_id)
+    return "models:/{}/{}".format(model.name, model.version)
+
+
+def _find_mlflow_model_dir(download_dir: Path) -> Path:
+    for current_dir, _, files in os.walk(download_dir):
+        if "MLmodel" in files:
+            return Path(current_dir)
+    raise ValueError("No MLmodel file found in {0}".format(download_dir))
+
+
+def get_model_cache(
+    max_mb: Optional[int], model_cache_dir: Optional[str]
+) -> Optional[DirectoryLRUCache]:
+    # Models are only cached when given a size. Use the given directory
+    # if there is one, otherwise the node-local cache
+    if max_mb is None or max_mb <= 0:
+        return None
+    if model_cache_dir is None:
+        return get_node_cache(CacheSettings.MODEL_CACHE_SUBDIR, max_mb)
+    try:
+        return DirectoryLRUCache(model_cache_dir, max_mb * 1024 * 1024)
+    except OSError as e:
+        _logger.warning("Unable to open model cache ({0})".format(e))
+        return None
+
+
+def load_mlflow_model(
+    workspace: Workspace, model_id: str, model_cache: Optional[DirectoryLRUCache]
+) -> Any:
     mlflow.set_tracking_uri(workspace.get_mlflow_tracking_uri())
 
-    model = Model._get(workspace, id=model_id)
-    model_uri = "models:/{}/{}".format(model.name, model.version)
-    return mlflow.pyfunc.load_model(model_uri)._model_impl
+    if model_cache is None:
+        model_uri = _get_model_uri(workspace, model_id)
+        return mlflow.pyfunc.load_model(model_uri)._model_impl
+
+    def _download(target_dir: Path):
+        model_uri = _get_model_uri(workspace, model_id)
+        _logger.info("Downloading {0} to model cache".format(model_uri))
+        mlflow.artifacts.download_artifacts(
+            artifact_uri=model_uri, dst_path=str(target_dir)
+        )
+
+    # Registered model versions are immutable, so the id is a safe key
+    # within a workspace. The cache may be shared between workspaces
+    cache_key = "{0}/{1}/{2}/{3}".format(
+        workspace.subscription_id,
+        workspace.resource_group,
+        workspace.name,
+        model_id,
+    )
+    with model_cache.entry(cache_key, _download) as model_dir:
+        model_path = _find_mlflow_model_dir(model_dir)
+        return mlflow.pyfunc.load_model(str(model_path))._model_impl
+
+
+def load_dataset(dataset_path: str, columns: Optional[List[str]] = None):
+    arrow_files = find_arrow_files(dataset_path)
+    if len(arrow_files) > 0:
+        _logger.info("Memory mapping Arrow files: {0}".format(arrow_files))
+        table = pa.concat_tables(
+            [
+                feather.read_table(f, columns=columns, memory_map=True)
+                for f in arrow_files
+            ]
+        )
+        # split_blocks avoids consolidating columns into 2D blocks, so
+        # suitable columns can be wrapped without a copy
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+    else:
+        _logger.info("Loading parquet file: {0}".format(dataset_path))
+        df = pd.read_parquet(dataset_path, columns=columns)
+    _logger.info("Loaded dataset with shape {0}".format(df.shape))
+    _logger.debug("Column types:\n{0}".format(df.dtypes))
+    return df
 
 
-def load_dataset(parquet_path: str):
-    _logger.info("Loading parquet file: {0}".format(parquet_path))
-    df = pd.read_parquet(parquet_path)
-    print(df.dtypes)
-    print(df.head(10))
+def load_capped_dataset(
+    dataset_path: str,
+    maximum_rows: int,
+    columns: Optional[List[str]],
+    stratify_column: Optional[str],
+    random_state: Optional[int],
+):
+    # Datasets over the limit are sampled while streaming, so they
+    # are never loaded into memory in full
+    total_rows = count_rows(dataset_path)
+    if total_rows <= maximum_rows:
+        return load_dataset(dataset_path, columns)
+
+    _logger.info(
+        "Dataset has {0} rows, sampling {1} (stratified on {2})".format(
+            total_rows, maximum_rows, stratify_column
+        )
+    )
+    df = sample_dataset(
+        dataset_path,
+        maximum_rows,
+        columns=columns,
+        stratify_column=stratify_column,
+        random_state=random_state,
+    )
+    _logger.info("Loaded dataset with shape {0}".format(df.shape))
     return df
 
 
+def get_stratify_column(args) -> Optional[str]:
+    # Stratification only makes sense for discrete targets
+    if args.stratify_sampling and args.task_type == "classification":
+        return args.target_column_name
+    return None
+
+
+def get_dataset_columns(args) -> Optional[List[str]]:
+    # Only read the features (plus the target) if they are specified
+    feature_column_names = get_from_args(
+        args, "feature_column_names", custom_parser=json.loads, allow_none=True
+    )
+    if feature_column_names is None:
+        return None
+    columns = list(feature_column_names)
+    if args.target_column_name not in columns:
+        columns.append(args.target_column_name)
+    return columns
+
+
 def main(args):
 
     my_run = Run.get_context()
 
+    dataset_columns = get_dataset_columns(args)
+
     _logger.info("Dealing with initialization dataset")
-    train_df = load_dataset(args.train_dataset)
+    if args.maximum_rows_for_train_dataset is None:
+        train_df = load_dataset(args.train_dataset, dataset_columns)
+    else:
+        train_df = load_capped_dataset(
+            args.train_dataset,
+            args.maximum_rows_for_train_dataset,
+            dataset_columns,
+            get_stratify_column(args),
+            args.sampling_random_state,
+        )
 
     _logger.info("Dealing with evaluation dataset")
-    test_df = load_dataset(args.test_dataset)
+    test_df = load_capped_dataset(
+        args.test_dataset,
+        args.maximum_rows_for_test_dataset,
+        dataset_columns,
+        get_stratify_column(args),
+        args.sampling_random_state,
+    )
 
     model_id = fetch_model_id(args)
     _logger.info("Loading model: {0}".format(model_id))
-    model_estimator = load_mlflow_model(my_run.experiment.workspace, model_id)
+    model_estimator = load_mlflow_model(
+        my_run.experiment.workspace,
+        model_id,
+        get_model_cache(args.model_cache_max_mb, args.model_cache_dir),
+    )
 
     _logger.info("Getting categorical columns")
     cat_col_names = get_from_args(
@@ -113,10 +275,22 @@ def main(args):
     _logger.info("Saving RAIInsights object")
     insights.save(args.output_path)
 
+    _logger.info("Computing predictions for tool components")
+    save_prediction_store(
+        model_estimator,
+        load_saved_features(args.output_path),
+        args.task_type,
+        args.output_path,
+    )
+
+    _logger.info("Hashing saved RAIInsights")
+    constructor_digest = write_artifact_manifest(args.output_path)
+
     _logger.info("Saving JSON for tool components")
     output_dict = {
         DashboardInfo.RAI_INSIGHTS_RUN_ID_KEY: str(my_run.id),
         DashboardInfo.RAI_INSIGHTS_MODEL_ID_KEY: model_id,
+        DashboardInfo.RAI_INSIGHTS_CONSTRUCTOR_DIGEST_KEY: constructor_digest,
     }
     output_file = os.path.join(
         args.output_path, DashboardInfo.RAI_INSIGHTS_PARENT_FILENAME
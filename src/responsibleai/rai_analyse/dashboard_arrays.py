@@ -0,0 +1,145 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+import logging
+import warnings
+
+from pathlib import Path
+from typing import Any, List, Optional
+
+import numpy as np
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+ARRAY_DIRECTORY = "arrays"
+ARRAY_REFERENCE_KEY = "__npy__"
+_DTYPE_KEY = "dtype"
+_SHAPE_KEY = "shape"
+
+# Smaller arrays stay inline in the JSON
+_DEFAULT_MIN_ARRAY_SIZE = 1024
+
+# The attributes of RAIInsightsData holding the large numeric payloads.
+# Anything else, such as the dataset with its labels and predictions,
+# stays in the JSON unchanged
+_PAYLOAD_PATHS = [
+    [
+        "modelExplanationData",
+        "precomputedExplanations",
+        "localFeatureImportance",
+        "scores",
+    ],
+    ["counterfactualData", "cfs_list"],
+    ["counterfactualData", "local_importance"],
+    ["errorAnalysisData", "matrix"],
+]
+
+
+class _ArrayWriter:
+    def __init__(self, output_dir: Path, min_size: int):
+        self._output_dir = output_dir
+        self._min_size = min_size
+        self._count = 0
+        self._bytes = 0
+
+    def _as_numeric_array(self, values: Any) -> Optional[np.ndarray]:
+        # None if values is not a rectangular block of numbers
+        if isinstance(values, np.ndarray):
+            array = values
+        else:
+            try:
+                with warnings.catch_warnings():
+                    # Older numpy warns rather than raises on ragged input
+                    warnings.simplefilter("ignore")
+                    array = np.asarray(values)
+            except ValueError:
+                return None
+        if array.dtype.kind not in "biuf" or array.size < self._min_size:
+            return None
+        if array.dtype.kind == "f":
+            array = array.astype(np.float32)
+        return array
+
+    def write(self, array: np.ndarray) -> dict:
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        file_name = "{0:06d}.npy".format(self._count)
+        np.save(self._output_dir / file_name, array, allow_pickle=False)
+        self._count += 1
+        self._bytes += array.nbytes
+        return {
+            ARRAY_REFERENCE_KEY: "{0}/{1}".format(ARRAY_DIRECTORY, file_name),
+            _DTYPE_KEY: str(array.dtype),
+            _SHAPE_KEY: list(array.shape),
+        }
+
+    def extract(self, o: Any) -> Any:
+        if isinstance(o, (list, tuple, np.ndarray)):
+            array = self._as_numeric_array(o)
+            if array is not None:
+                return self.write(array)
+            return [self.extract(v) for v in o]
+        if isinstance(o, dict):
+            return {k: self.extract(v) for k, v in o.items()}
+        if hasattr(o, "__dict__") and not hasattr(o, "item"):
+            for k, v in list(vars(o).items()):
+                setattr(o, k, self.extract(v))
+        return o
+
+
+def _extract_path(writer: _ArrayWriter, o: Any, path: List[str]) -> None:
+    if isinstance(o, list):
+        for v in o:
+            _extract_path(writer, v, path)
+        return
+    value = getattr(o, path[0], None)
+    if value is None:
+        return
+    if len(path) == 1:
+        setattr(o, path[0], writer.extract(value))
+    else:
+        _extract_path(writer, value, path[1:])
+
+
+def extract_numeric_arrays(
+    rai_data: Any, output_dir: str, min_size: int = _DEFAULT_MIN_ARRAY_SIZE
+) -> Any:
+    # Replaces every numeric array (or nested list of numbers) with at
+    # least min_size elements in the local importances, counterfactuals
+    # and error analysis matrices of rai_data by a reference to a .npy
+    # file under output_dir/arrays. Floating point data is stored as
+    # float32. Returns the updated data, which should then be serialised
+    # as usual
+    writer = _ArrayWriter(Path(output_dir) / ARRAY_DIRECTORY, min_size)
+    for path in _PAYLOAD_PATHS:
+        _extract_path(writer, rai_data, path)
+    _logger.info(
+        "Wrote {0} arrays ({1} bytes) to {2}".format(
+            writer._count, writer._bytes, ARRAY_DIRECTORY
+        )
+    )
+    return rai_data
+
+
+def resolve_numeric_arrays(o: Any, base_dir: str, mmap: bool = True) -> Any:
+    # Inverse of extract_numeric_arrays on the deserialised JSON. With
+    # mmap, the arrays are memory-mapped rather than read
+    if isinstance(o, dict):
+        if ARRAY_REFERENCE_KEY in o:
+            return np.load(
+                Path(base_dir) / o[ARRAY_REFERENCE_KEY],
+                mmap_mode="r" if mmap else None,
+                allow_pickle=False,
+            )
+        return {k: resolve_numeric_arrays(v, base_dir, mmap) for k, v in o.items()}
+    if isinstance(o, list):
+        return [resolve_numeric_arrays(v, base_dir, mmap) for v in o]
+    return o
+
+
+def load_dashboard_json(json_path: str, mmap: bool = True) -> Any:
+    with open(json_path, "r") as f:
+        dashboard = json.load(f)
+    return resolve_numeric_arrays(dashboard, str(Path(json_path).parent), mmap)
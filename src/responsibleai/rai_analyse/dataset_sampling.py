@@ -0,0 +1,159 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import logging
+import math
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+# File extensions for Arrow IPC (Feather V2) datasets
+_ARROW_EXTENSIONS = [".arrow", ".feather", ".ipc"]
+
+# Key used for the single reservoir when not stratifying
+_ALL_ROWS = "__all_rows__"
+
+
+def find_arrow_files(dataset_path: str) -> List[Path]:
+    # Returns the Arrow IPC files making up the dataset, or an
+    # empty list if it is not in Arrow format
+    path = Path(dataset_path)
+    if path.is_file():
+        candidates = [path]
+    else:
+        candidates = sorted(p for p in path.iterdir() if p.is_file())
+    arrow_files = [p for p in candidates if p.suffix.lower() in _ARROW_EXTENSIONS]
+    if len(arrow_files) > 0 and len(arrow_files) != len(candidates):
+        raise ValueError("Mixed file types in dataset {0}".format(dataset_path))
+    return arrow_files
+
+
+def open_dataset(dataset_path: str) -> ds.Dataset:
+    arrow_files = find_arrow_files(dataset_path)
+    if len(arrow_files) > 0:
+        return ds.dataset([str(f) for f in arrow_files], format="ipc")
+    return ds.dataset(dataset_path, format="parquet")
+
+
+def count_rows(dataset_path: str) -> int:
+    # For parquet this only reads the file footers
+    return open_dataset(dataset_path).count_rows()
+
+
+def _allocate_quotas(counts: Dict[Any, int], n_rows: int) -> Dict[Any, int]:
+    # Split n_rows between the strata in proportion to their sizes,
+    # handing out the rounding remainder to the largest fractions
+    total = sum(counts.values())
+    if total <= n_rows:
+        return dict(counts)
+    exact = {k: n_rows * c / total for k, c in counts.items()}
+    quotas = {k: int(math.floor(v)) for k, v in exact.items()}
+    remainder = n_rows - sum(quotas.values())
+    by_fraction = sorted(exact.keys(), key=lambda k: exact[k] - quotas[k], reverse=True)
+    for k in by_fraction[:remainder]:
+        quotas[k] += 1
+    return quotas
+
+
+def _count_strata(dataset: ds.Dataset, stratify_column: str) -> Dict[Any, int]:
+    counts: Dict[Any, int] = {}
+    for batch in dataset.to_batches(columns=[stratify_column]):
+        values = batch.column(0).to_pandas().value_counts()
+        for k, v in values.items():
+            counts[k] = counts.get(k, 0) + int(v)
+    return counts
+
+
+class _Reservoir:
+    """Keeps the rows with the smallest random keys seen so far.
+
+    Assigning every row an independent uniform key and keeping the
+    bottom-k gives a uniform sample without replacement, and lets us
+    merge whole record batches at a time.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.keys = np.empty(0, dtype=np.float64)
+        self.positions = np.empty(0, dtype=np.int64)
+        self.rows: List[pa.RecordBatch] = []
+
+    def offer(self, batch: pa.RecordBatch, keys: np.ndarray, positions: np.ndarray):
+        if self.capacity == 0 or batch.num_rows == 0:
+            return
+        if len(self.keys) == self.capacity:
+            # Once full, only rows beating the current maximum can enter
+            candidates = np.flatnonzero(keys < self.keys.max())
+            if len(candidates) == 0:
+                return
+            batch = batch.take(pa.array(candidates))
+            keys = keys[candidates]
+            positions = positions[candidates]
+
+        all_keys = np.concatenate([self.keys, keys])
+        all_positions = np.concatenate([self.positions, positions])
+        table = pa.Table.from_batches(self.rows + [batch])
+        if len(all_keys) > self.capacity:
+            keep = np.argpartition(all_keys, self.capacity - 1)[: self.capacity]
+            all_keys = all_keys[keep]
+            all_positions = all_positions[keep]
+            table = table.take(pa.array(keep))
+        self.keys = all_keys
+        self.positions = all_positions
+        self.rows = table.combine_chunks().to_batches()
+
+
+def sample_dataset(
+    dataset_path: str,
+    n_rows: int,
+    columns: Optional[List[str]] = None,
+    stratify_column: Optional[str] = None,
+    random_state: Optional[int] = None,
+) -> pd.DataFrame:
+    # Draw n_rows from the dataset without ever materialising all of
+    # it. Record batches are streamed through one reservoir (or one per
+    # value of stratify_column), so peak memory scales with n_rows
+    dataset = open_dataset(dataset_path)
+    rng = np.random.default_rng(random_state)
+
+    if stratify_column is None:
+        quotas = {_ALL_ROWS: n_rows}
+    else:
+        quotas = _allocate_quotas(_count_strata(dataset, stratify_column), n_rows)
+        _logger.info("Stratum sample sizes: {0}".format(quotas))
+    reservoirs = {k: _Reservoir(v) for k, v in quotas.items()}
+
+    row_offset = 0
+    for batch in dataset.to_batches(columns=columns):
+        keys = rng.random(batch.num_rows)
+        positions = np.arange(row_offset, row_offset + batch.num_rows)
+        row_offset += batch.num_rows
+        if stratify_column is None:
+            reservoirs[_ALL_ROWS].offer(batch, keys, positions)
+            continue
+
+        # Rows with a missing stratum value are never sampled
+        strata = batch.column(batch.schema.get_field_index(stratify_column))
+        strata_values = strata.to_pandas()
+        for value, selected in strata_values.groupby(strata_values).indices.items():
+            reservoirs[value].offer(
+                batch.take(pa.array(selected)), keys[selected], positions[selected]
+            )
+
+    # Restore the original row order, so the sample is deterministic
+    # for a given seed regardless of how the strata were laid out
+    filled = [r for r in reservoirs.values() if len(r.rows) > 0]
+    tables = [pa.Table.from_batches(r.rows) for r in filled]
+    positions = np.concatenate([r.positions for r in filled])
+    table = pa.concat_tables(tables).take(pa.array(np.argsort(positions)))
+    _logger.info("Sampled {0} of {1} rows".format(table.num_rows, row_offset))
+    return table.to_pandas()
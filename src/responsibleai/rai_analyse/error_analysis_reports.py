@@ -0,0 +1,223 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from erroranalysis._internal.error_report import ErrorReport
+
+from constants import ErrorAnalysisEngine
+from error_tree_engine import HistogramErrorTreeEngine
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+
+def _report_key(
+    filter_features: Optional[List[str]],
+    max_depth: Optional[int],
+    num_leaves: Optional[int],
+    min_child_samples: Optional[int],
+) -> str:
+    return json.dumps([filter_features, max_depth, num_leaves, min_child_samples])
+
+
+class _PrecomputedReportAnalyzer:
+    """Stands in for the ModelAnalyzer of an ErrorAnalysisManager,
+    handing back reports which have already been computed.
+
+    Anything other than create_error_report goes to the real analyzer.
+    """
+
+    def __init__(self, analyzer: Any, reports: Dict[str, ErrorReport]):
+        self._analyzer = analyzer
+        self._reports = reports
+
+    def create_error_report(
+        self,
+        filter_features=None,
+        max_depth=None,
+        num_leaves=None,
+        min_child_samples=None,
+        compute_importances=False,
+    ) -> ErrorReport:
+        key = _report_key(filter_features, max_depth, num_leaves, min_child_samples)
+        if key not in self._reports:
+            return self._analyzer.create_error_report(
+                filter_features,
+                max_depth=max_depth,
+                num_leaves=num_leaves,
+                min_child_samples=min_child_samples,
+                compute_importances=compute_importances,
+            )
+        return self._reports[key]
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._analyzer, name)
+
+
+class _SavedReportAnalyzer:
+    """Stands in for the ModelAnalyzer of a loaded ErrorAnalysisManager,
+    serving the trees and importances of its saved reports rather than
+    computing them again.
+    """
+
+    def __init__(self, analyzer: Any, configs: List[Any], reports: List[Any]):
+        self._analyzer = analyzer
+        self._trees = {}
+        self._importances = None
+        for config, report in zip(configs, reports):
+            key = (config.max_depth, config.num_leaves, config.min_child_samples)
+            self._trees[json.dumps(key)] = report.tree
+            if report.importances is not None:
+                self._importances = report.importances
+
+    def compute_error_tree(
+        self,
+        features,
+        filters,
+        composite_filters,
+        max_depth=None,
+        num_leaves=None,
+        min_child_samples=None,
+    ):
+        key = json.dumps((max_depth, num_leaves, min_child_samples))
+        if (
+            filters
+            or composite_filters
+            or list(features) != list(self._analyzer.feature_names)
+            or key not in self._trees
+        ):
+            return self._analyzer.compute_error_tree(
+                features,
+                filters,
+                composite_filters,
+                max_depth,
+                num_leaves,
+                min_child_samples,
+            )
+        return self._trees[key]
+
+    def compute_importances(self):
+        if self._importances is None:
+            return self._analyzer.compute_importances()
+        return self._importances
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._analyzer, name)
+
+
+def _compute_reports(
+    analyzer: Any,
+    configs: List[Any],
+    n_jobs: int,
+    compute_error_tree: Callable[..., Any],
+    compute_matrix: Callable[..., Any],
+):
+    tree_keys = {}
+    matrix_keys = {}
+    for config in configs:
+        tree_key = (config.max_depth, config.num_leaves, config.min_child_samples)
+        tree_keys[json.dumps(tree_key)] = tree_key
+        if config.filter_features is not None:
+            matrix_keys[json.dumps(config.filter_features)] = config.filter_features
+
+    _logger.info(
+        "Computing {0} trees and {1} heatmaps for {2} configurations".format(
+            len(tree_keys), len(matrix_keys), len(configs)
+        )
+    )
+    feature_names = analyzer.feature_names
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        importances = executor.submit(analyzer.compute_importances)
+        trees = {
+            key: executor.submit(
+                compute_error_tree,
+                feature_names,
+                None,
+                None,
+                max_depth=max_depth,
+                num_leaves=num_leaves,
+                min_child_samples=min_child_samples,
+            )
+            for key, (max_depth, num_leaves, min_child_samples) in tree_keys.items()
+        }
+        matrices = {
+            key: executor.submit(compute_matrix, filter_features, None, None)
+            for key, filter_features in matrix_keys.items()
+        }
+
+    reports = {}
+    for config in configs:
+        tree_key = (config.max_depth, config.num_leaves, config.min_child_samples)
+        matrix = None
+        if config.filter_features is not None:
+            matrix = matrices[json.dumps(config.filter_features)].result()
+        reports[_report_key(config.filter_features, *tree_key)] = ErrorReport(
+            trees[json.dumps(tree_key)].result(),
+            matrix,
+            tree_features=feature_names,
+            matrix_features=config.filter_features,
+            importances=importances.result(),
+        )
+    return reports
+
+
+@contextlib.contextmanager
+def precomputed_error_reports(
+    manager: Any, n_jobs: int, engine: str = ErrorAnalysisEngine.LIGHTGBM
+) -> Iterator[None]:
+    """Compute the reports for every pending configuration of the
+    error analysis manager on a thread pool, so that its compute()
+    only has to collect them.
+
+    The feature importances are computed once, as are trees and
+    heatmaps shared between configurations. The trees and heatmaps
+    are built by the given engine.
+    """
+    configs = [c for c in manager._ea_config_list if not c.is_computed]
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    if len(configs) < 2 and n_jobs == 1 and engine == ErrorAnalysisEngine.LIGHTGBM:
+        yield
+        return
+
+    analyzer = manager._analyzer
+    tree_engine = analyzer
+    if engine == ErrorAnalysisEngine.HISTOGRAM:
+        tree_engine = HistogramErrorTreeEngine(analyzer)
+    reports = _compute_reports(
+        analyzer,
+        configs,
+        n_jobs,
+        tree_engine.compute_error_tree,
+        tree_engine.compute_matrix,
+    )
+    manager._analyzer = _PrecomputedReportAnalyzer(analyzer, reports)
+    try:
+        yield
+    finally:
+        manager._analyzer = analyzer
+
+
+@contextlib.contextmanager
+def saved_error_reports(manager: Any) -> Iterator[None]:
+    """Have the get_data() of a loaded error analysis manager use the
+    trees and importances of the saved reports, instead of computing
+    them again (with the LightGBM surrogate, whichever engine built
+    them).
+    """
+    analyzer = manager._analyzer
+    manager._analyzer = _SavedReportAnalyzer(
+        analyzer, manager._ea_config_list, manager._ea_report_list
+    )
+    try:
+        yield
+    finally:
+        manager._analyzer = analyzer
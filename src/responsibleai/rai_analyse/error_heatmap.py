@@ -0,0 +1,127 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from erroranalysis._internal.constants import Metrics, metric_to_display_name
+from erroranalysis._internal.matrix_filter import (
+    CATEGORY1,
+    CATEGORY2,
+    COUNT,
+    FALSE_COUNT,
+    INTERVAL_MAX,
+    INTERVAL_MIN,
+    MATRIX,
+    METRIC_NAME,
+    METRIC_VALUE,
+    VALUES,
+    get_py_value,
+)
+
+# Metrics which are sums over the rows of a cell, so can be computed for
+# every cell at once
+VECTORIZED_METRICS = {
+    Metrics.ERROR_RATE,
+    Metrics.MEAN_ABSOLUTE_ERROR,
+    Metrics.MEAN_SQUARED_ERROR,
+}
+
+# The cell index (-1 when missing) of each row along one heatmap axis,
+# and the categories of the cells
+HeatmapAxis = Tuple[np.ndarray, Sequence[Any]]
+
+
+def compute_heatmap(
+    axes: List[HeatmapAxis],
+    diff: np.ndarray,
+    metric: str,
+) -> Dict[str, Any]:
+    """Build the error heatmap of one or two binned features, in the
+    format of erroranalysis' compute_matrix.
+
+    Each metric is accumulated for every cell in a single bincount over
+    the rows, so the time taken is linear in the number of rows.
+
+    :param axes: The binned rows and categories of each feature.
+    :param diff: The error of each row, whether it is misclassified
+        for classification or the residual for regression.
+    :param metric: One of VECTORIZED_METRICS.
+    """
+    if metric not in VECTORIZED_METRICS:
+        raise ValueError("Metric {0} cannot be vectorized".format(metric))
+    shape = tuple(len(categories) for _, categories in axes)
+    cells = axes[0][0]
+    present = cells >= 0
+    for codes, categories in axes[1:]:
+        cells = cells * len(categories) + codes
+        present &= codes >= 0
+    cells = cells[present]
+    n_cells = int(np.prod(shape))
+
+    counts = np.bincount(cells, minlength=n_cells).reshape(shape)
+    diff = diff[present]
+    if metric == Metrics.ERROR_RATE:
+        errors = np.bincount(cells, weights=diff, minlength=n_cells)
+        values = errors.reshape(shape).astype(int)
+    else:
+        if metric == Metrics.MEAN_ABSOLUTE_ERROR:
+            errors = np.abs(diff)
+        else:
+            errors = diff * diff
+        sums = np.bincount(cells, weights=errors, minlength=n_cells).reshape(shape)
+        values = np.divide(sums, counts, out=np.zeros(shape), where=counts > 0)
+
+    metric_name = metric_to_display_name[metric]
+
+    def cell(index):
+        if metric == Metrics.ERROR_RATE:
+            return {
+                FALSE_COUNT: int(values[index]),
+                COUNT: int(counts[index]),
+                METRIC_NAME: metric_name,
+            }
+        return {
+            METRIC_VALUE: float(values[index]),
+            METRIC_NAME: metric_name,
+            COUNT: int(counts[index]),
+        }
+
+    # The first feature's categories run from last to first, as they do
+    # in erroranalysis
+    categories1 = axes[0][1]
+    if len(axes) == 1:
+        row = [cell(i) for i in reversed(range(shape[0]))]
+        return {
+            MATRIX: [row],
+            CATEGORY1: _category_info(categories1, reverse=True),
+        }
+    matrix = [
+        [cell((i, j)) for j in range(shape[1])] for i in reversed(range(shape[0]))
+    ]
+    return {
+        MATRIX: matrix,
+        CATEGORY1: _category_info(categories1, reverse=True),
+        CATEGORY2: _category_info(axes[1][1], reverse=False),
+    }
+
+
+def _category_info(categories: Sequence[Any], reverse: bool) -> Dict[str, List]:
+    order = range(len(categories))
+    if reverse:
+        order = reversed(order)
+    values = []
+    interval_min = []
+    interval_max = []
+    for i in order:
+        category = categories[i]
+        if isinstance(categories, pd.IntervalIndex):
+            interval_min.append(category.left)
+            interval_max.append(category.right)
+            values.append(str(category))
+        else:
+            values.append(get_py_value(category))
+    return {VALUES: values, INTERVAL_MIN: interval_min, INTERVAL_MAX: interval_max}
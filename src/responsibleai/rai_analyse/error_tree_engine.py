@@ -0,0 +1,523 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import heapq
+import logging
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from erroranalysis._internal.constants import (
+    METHOD,
+    METHOD_EXCLUDES,
+    METHOD_INCLUDES,
+    Metrics,
+    ModelTask,
+    error_metrics,
+    f1_metrics,
+    metric_to_display_name,
+    precision_metrics,
+    recall_metrics,
+)
+from erroranalysis._internal.matrix_filter import BIN_THRESHOLD, PRECISION
+from erroranalysis._internal.metrics import metric_to_func
+from erroranalysis._internal.surrogate_error_tree import (
+    DEFAULT_MAX_DEPTH,
+    DEFAULT_MIN_CHILD_SAMPLES,
+    DEFAULT_NUM_LEAVES,
+    compute_metric_value,
+)
+
+from error_heatmap import VECTORIZED_METRICS, HeatmapAxis, compute_heatmap
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+# Bins per numeric feature, one code is kept back for missing values
+DEFAULT_MAX_BINS = 255
+# As in LightGBM, categorical features with at most this many values are
+# split one category against the rest
+MAX_CAT_TO_ONEHOT = 4
+# Largest number of categories sent down the left side of a split
+MAX_CAT_THRESHOLD = 32
+
+_regression_metrics = {
+    Metrics.MEAN_ABSOLUTE_ERROR,
+    Metrics.MEAN_SQUARED_ERROR,
+    Metrics.MEDIAN_ABSOLUTE_ERROR,
+    Metrics.R2_SCORE,
+}
+
+
+class FeatureBins:
+    """Features of a dataset binned into a compact integer matrix.
+
+    Numeric features are cut at (at most max_bins) quantiles, or at
+    their distinct values when there are few enough, and categorical
+    features keep their category codes. Missing values get the last
+    code, n_bins - 1.
+
+    Numeric features with more than heatmap_bins distinct values also
+    get the equal width intervals the error heatmap puts them in. Their
+    edges are always among the bin edges, so the heatmap cell of a row
+    can be looked up from its bin code.
+    """
+
+    def __init__(
+        self,
+        X: np.ndarray,
+        is_categorical: List[bool],
+        max_bins: int = DEFAULT_MAX_BINS,
+        heatmap_bins: int = BIN_THRESHOLD,
+    ):
+        self.is_categorical = list(is_categorical)
+        self.edges: List[Optional[np.ndarray]] = []
+        self.heatmap_intervals: List[Optional[pd.IntervalIndex]] = []
+        self.heatmap_edges: List[Optional[np.ndarray]] = []
+        n_codes = 1
+        for column, is_cat in zip(X.T, self.is_categorical):
+            finite = column[~np.isnan(column)]
+            intervals = heatmap_edges = None
+            if is_cat:
+                edges = None
+                n_codes = max(n_codes, int(finite.max()) + 1 if len(finite) else 0)
+            else:
+                edges, intervals, heatmap_edges = _bin_edges(
+                    finite, max_bins, heatmap_bins
+                )
+                n_codes = max(n_codes, len(edges))
+            self.edges.append(edges)
+            self.heatmap_intervals.append(intervals)
+            self.heatmap_edges.append(heatmap_edges)
+        self.n_bins = n_codes + 1
+        dtype = np.uint8 if self.n_bins <= 256 else np.uint16
+        self.codes = np.empty(X.shape, dtype=dtype, order="F")
+        for i, column in enumerate(X.T):
+            self.codes[:, i] = self._bin_column(i, column)
+
+    def _bin_column(self, i: int, column: np.ndarray) -> np.ndarray:
+        missing = np.isnan(column)
+        if self.edges[i] is None:
+            codes = np.where(missing, 0, column).astype(np.intp)
+        else:
+            codes = np.searchsorted(self.edges[i], column, side="left")
+        codes[missing] = self.n_bins - 1
+        return codes
+
+    def heatmap_lookup(self, i: int) -> np.ndarray:
+        """Heatmap interval of each bin code of numeric feature i, -1 for
+        missing values."""
+        lookup = np.full(self.n_bins, -1, dtype=np.intp)
+        edges = self.edges[i]
+        lookup[: len(edges)] = np.searchsorted(
+            self.heatmap_edges[i], edges, side="left"
+        )
+        return lookup
+
+
+def _bin_edges(finite: np.ndarray, max_bins: int, heatmap_bins: int):
+    # Upper (inclusive) edge of each bin, the last being the maximum
+    if len(finite) == 0:
+        return np.zeros(1), None, None
+    ordered = np.sort(finite)
+    distinct = ordered[np.r_[True, ordered[1:] != ordered[:-1]]]
+    intervals = None
+    heatmap_edges = None
+    n_quantiles = max_bins
+    if len(distinct) > heatmap_bins:
+        # The intervals of erroranalysis' heatmap, which come from pd.cut
+        # on the column with the number of bins
+        binned, breaks = pd.cut(
+            distinct[[0, -1]], heatmap_bins, retbins=True, precision=PRECISION
+        )
+        intervals = binned.categories
+        heatmap_edges = breaks[1:]
+        n_quantiles = max_bins - heatmap_bins
+    if len(distinct) <= max_bins:
+        return distinct, intervals, heatmap_edges
+    # Quantiles taken as values of the column
+    positions = np.linspace(0, len(ordered) - 1, n_quantiles + 1)[1:]
+    quantiles = ordered[np.ceil(positions).astype(np.intp)]
+    if heatmap_edges is not None:
+        quantiles = np.concatenate([quantiles, heatmap_edges[:-1]])
+    return np.unique(quantiles), intervals, heatmap_edges
+
+
+def _split_table(n_bins: int, left_codes: np.ndarray) -> np.ndarray:
+    table = np.zeros(n_bins, dtype=bool)
+    table[left_codes] = True
+    return table
+
+
+class _Node:
+    def __init__(self, rows: np.ndarray, depth: int):
+        self.rows = rows
+        self.depth = depth
+        self.split_index: Optional[int] = None
+        self.leaf_index = 0
+        self.feature: Optional[int] = None
+        self.left_codes: Optional[np.ndarray] = None
+        self.left: Optional["_Node"] = None
+        self.right: Optional["_Node"] = None
+        # Best split found for the node while it is a leaf
+        self.counts: Optional[np.ndarray] = None
+        self.sums: Optional[np.ndarray] = None
+        self.gain = 0.0
+        self.best: Optional[tuple] = None
+
+
+class HistogramErrorTreeEngine:
+    """Grows the error analysis surrogate tree from histograms of the
+    pre-binned test features, in place of fitting a LightGBM model on
+    the raw values.
+
+    Trees are grown leaf-wise with the gain LightGBM uses for a single
+    boosting round, which with a constant hessian is the reduction in
+    the squared error of the error (or residual) column. The output has
+    the same format as ModelAnalyzer.compute_error_tree. The binned
+    features and the model's errors are computed once, and shared by
+    every tree built by the engine.
+
+    The engine also builds the error heatmaps, on bins that share their
+    edges with the ones the trees split on.
+    """
+
+    def __init__(self, analyzer: Any, max_bins: int = DEFAULT_MAX_BINS):
+        self._analyzer = analyzer
+        dataset = analyzer.dataset
+        if not isinstance(dataset, pd.DataFrame):
+            dataset = pd.DataFrame(dataset, columns=analyzer.feature_names)
+
+        true_y = np.asarray(analyzer.true_y)
+        pred_y = np.asarray(analyzer.model.predict(dataset))
+        if analyzer.model_task == ModelTask.CLASSIFICATION:
+            diff = pred_y != true_y
+        else:
+            diff = pred_y - true_y
+        self._true_y = true_y
+        self._pred_y = pred_y
+        self._diff = np.asarray(diff)
+        self._target = self._diff.astype(np.float64)
+
+        # Categorical features are binned on their string indexes
+        X = np.empty(dataset.shape, dtype=np.float64)
+        is_categorical = [False] * dataset.shape[1]
+        categorical_indexes = list(analyzer.categorical_indexes or [])
+        for i, name in enumerate(dataset.columns):
+            if i in categorical_indexes:
+                idx = categorical_indexes.index(i)
+                X[:, i] = analyzer.string_indexed_data[:, idx]
+                is_categorical[i] = True
+            else:
+                X[:, i] = pd.to_numeric(dataset[name], errors="coerce")
+        self.bins = FeatureBins(X, is_categorical, max_bins)
+        _logger.info(
+            "Binned {0} rows of {1} features into {2} codes".format(
+                X.shape[0], X.shape[1], self.bins.n_bins
+            )
+        )
+
+    def compute_error_tree(
+        self,
+        features: List[str],
+        filters: Any,
+        composite_filters: Any,
+        max_depth: Optional[int] = DEFAULT_MAX_DEPTH,
+        num_leaves: Optional[int] = DEFAULT_NUM_LEAVES,
+        min_child_samples: Optional[int] = DEFAULT_MIN_CHILD_SAMPLES,
+    ) -> List[Dict[str, Any]]:
+        if filters or composite_filters:
+            # The bins are only computed for the whole test set
+            return self._analyzer.compute_error_tree(
+                features,
+                filters,
+                composite_filters,
+                max_depth=max_depth,
+                num_leaves=num_leaves,
+                min_child_samples=min_child_samples,
+            )
+        if max_depth is None:
+            max_depth = DEFAULT_MAX_DEPTH
+        if num_leaves is None:
+            num_leaves = DEFAULT_NUM_LEAVES
+        if min_child_samples is None:
+            min_child_samples = DEFAULT_MIN_CHILD_SAMPLES
+
+        feature_names = list(self._analyzer.feature_names)
+        indexes = [feature_names.index(f) for f in features]
+        root = self._grow(indexes, max_depth, num_leaves, min_child_samples)
+        return self._to_json(root, feature_names)
+
+    def compute_matrix(
+        self, features: List[Optional[str]], filters: Any, composite_filters: Any
+    ) -> Dict[str, Any]:
+        features = [f for f in features if f is not None]
+        if not features:
+            raise ValueError(
+                "One or two features must be specified to compute the heat map"
+            )
+        if (
+            filters
+            or composite_filters
+            or self._analyzer.metric not in VECTORIZED_METRICS
+        ):
+            return self._analyzer.compute_matrix(features, filters, composite_filters)
+
+        # As in erroranalysis, only a pair of features gives a 2D heatmap
+        feature_names = list(self._analyzer.feature_names)
+        if len(features) != 2:
+            features = features[:1]
+        axes = [self._heatmap_axis(feature_names.index(f)) for f in features]
+        return compute_heatmap(axes, self._diff, self._analyzer.metric)
+
+    def _heatmap_axis(self, i: int) -> HeatmapAxis:
+        codes = self.bins.codes[:, i].astype(np.intp)
+        missing = codes == self.bins.n_bins - 1
+        if self.bins.is_categorical[i]:
+            analyzer = self._analyzer
+            idx = list(analyzer.categorical_indexes).index(i)
+            categories = analyzer.categories[idx]
+        elif self.bins.heatmap_intervals[i] is not None:
+            codes = self.bins.heatmap_lookup(i)[codes]
+            categories = self.bins.heatmap_intervals[i]
+        else:
+            categories = self.bins.edges[i]
+        codes[missing] = -1
+        return codes, categories
+
+    def _histograms(self, rows: np.ndarray, indexes: List[int]):
+        n_bins = self.bins.n_bins
+        target = self._target[rows]
+        counts = np.empty((len(indexes), n_bins))
+        sums = np.empty((len(indexes), n_bins))
+        for i, f in enumerate(indexes):
+            codes = self.bins.codes[rows, f]
+            counts[i] = np.bincount(codes, minlength=n_bins)
+            sums[i] = np.bincount(codes, weights=target, minlength=n_bins)
+        return counts, sums
+
+    def _find_split(
+        self, node: _Node, indexes: List[int], min_child_samples: int
+    ) -> None:
+        total_count = len(node.rows)
+        total_sum = node.sums[0].sum()
+        parent_score = total_sum * total_sum / total_count
+        min_gain = 1e-12 * abs(parent_score)
+        node.gain = 0.0
+        node.best = None
+        for i, f in enumerate(indexes):
+            # The last bin holds missing values, which always go right
+            counts = node.counts[i, :-1]
+            sums = node.sums[i, :-1]
+            if self.bins.is_categorical[f]:
+                candidates = _categorical_candidates(counts, sums)
+                count_left = np.array([counts[c].sum() for c in candidates])
+                sum_left = np.array([sums[c].sum() for c in candidates])
+            else:
+                # Every non-empty bin can end the left side of a "<=" split
+                candidates = np.flatnonzero(counts)[:-1]
+                count_left = np.cumsum(counts)[candidates]
+                sum_left = np.cumsum(sums)[candidates]
+            if len(candidates) == 0:
+                continue
+            count_right = total_count - count_left
+            valid = (count_left >= min_child_samples) & (
+                count_right >= min_child_samples
+            )
+            if not valid.any():
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"):
+                sum_right = total_sum - sum_left
+                gains = (
+                    sum_left * sum_left / count_left
+                    + sum_right * sum_right / count_right
+                    - parent_score
+                )
+            gains[~valid] = -np.inf
+            best = int(np.argmax(gains))
+            if gains[best] > node.gain + min_gain:
+                node.gain = gains[best]
+                if self.bins.is_categorical[f]:
+                    node.best = (f, candidates[best])
+                else:
+                    node.best = (f, np.arange(candidates[best] + 1))
+
+    def _grow(
+        self,
+        indexes: List[int],
+        max_depth: int,
+        num_leaves: int,
+        min_child_samples: int,
+    ) -> _Node:
+        root = _Node(np.arange(len(self._target)), 0)
+        root.counts, root.sums = self._histograms(root.rows, indexes)
+        self._find_split(root, indexes, min_child_samples)
+
+        # Leaf-wise growth, splitting the leaf with the largest gain first
+        n_leaves = 1
+        n_splits = 0
+        n_pushed = 1
+        heap = []
+        if root.best is not None:
+            heap.append((-root.gain, 0, root))
+        while heap and n_leaves < num_leaves:
+            _, _, node = heapq.heappop(heap)
+            f, left_codes = node.best
+            table = _split_table(self.bins.n_bins, left_codes)
+            go_left = table[self.bins.codes[node.rows, f]]
+
+            node.split_index = n_splits
+            node.feature = f
+            node.left_codes = left_codes
+            node.left = _Node(node.rows[go_left], node.depth + 1)
+            node.right = _Node(node.rows[~go_left], node.depth + 1)
+            # The left child keeps the leaf index, as in LightGBM
+            node.left.leaf_index = node.leaf_index
+            node.right.leaf_index = n_leaves
+            n_splits += 1
+            n_leaves += 1
+
+            # Build the histogram of the smaller child, and get the
+            # other one by subtracting it from the parent's
+            small, large = node.left, node.right
+            if len(small.rows) > len(large.rows):
+                small, large = large, small
+            small.counts, small.sums = self._histograms(small.rows, indexes)
+            large.counts = node.counts - small.counts
+            large.sums = node.sums - small.sums
+            node.counts = node.sums = None
+
+            for child in (node.left, node.right):
+                if max_depth > 0 and child.depth >= max_depth:
+                    child.counts = child.sums = None
+                    continue
+                self._find_split(child, indexes, min_child_samples)
+                if child.best is not None:
+                    heapq.heappush(heap, (-child.gain, n_pushed, child))
+                    n_pushed += 1
+                else:
+                    child.counts = child.sums = None
+        return root
+
+    def _to_json(self, root: _Node, feature_names: List[str]) -> List[Dict]:
+        analyzer = self._analyzer
+        n_splits = _count_splits(root)
+        nodes = []
+
+        def visit(node: _Node, parent: Optional[_Node], is_left: bool):
+            if node.split_index is not None:
+                nodeid = node.split_index
+            elif parent is None:
+                nodeid = 0
+            else:
+                nodeid = n_splits + node.leaf_index
+            arg = None
+            condition = None
+            method = None
+            parent_id = None
+            parent_name = None
+            if parent is not None:
+                parent_id = parent.split_index
+                parent_name = str(feature_names[parent.feature])
+                arg, condition, method = self._describe_split(
+                    parent, parent_name, is_left
+                )
+            metric_value, error, success = self._node_metric(node.rows)
+            node_name = None
+            if node.split_index is not None:
+                node_name = feature_names[node.feature]
+            nodes.append(
+                {
+                    "arg": arg,
+                    "badFeaturesRowCount": 0,
+                    "condition": condition,
+                    "error": float(error),
+                    "id": int(nodeid),
+                    METHOD: method,
+                    "nodeIndex": int(nodeid),
+                    "nodeName": node_name,
+                    "parentId": parent_id,
+                    "parentNodeName": parent_name,
+                    "pathFromRoot": "",
+                    "size": float(len(node.rows)),
+                    "sourceRowKeyHash": "hashkey",
+                    "success": float(success),
+                    "metricName": metric_to_display_name[analyzer.metric],
+                    "metricValue": float(metric_value),
+                    "isErrorMetric": analyzer.metric in error_metrics,
+                }
+            )
+            if node.split_index is not None:
+                visit(node.left, node, True)
+                visit(node.right, node, False)
+
+        visit(root, None, True)
+        return nodes
+
+    def _describe_split(self, parent: _Node, parent_name: str, is_left: bool):
+        f = parent.feature
+        if not self.bins.is_categorical[f]:
+            threshold = float(self.bins.edges[f][parent.left_codes[-1]])
+            if is_left:
+                condition = "{} <= {:.2f}".format(parent_name, threshold)
+                return threshold, condition, "less and equal"
+            condition = "{} > {:.2f}".format(parent_name, threshold)
+            return threshold, condition, "greater"
+
+        analyzer = self._analyzer
+        categories = analyzer.categories[list(analyzer.categorical_indexes).index(f)]
+        arg = [float(code) for code in parent.left_codes]
+        values = " | ".join(str(categories[int(code)]) for code in arg)
+        if is_left:
+            return arg, "{} == {}".format(parent_name, values), METHOD_INCLUDES
+        return arg, "{} != {}".format(parent_name, values), METHOD_EXCLUDES
+
+    def _node_metric(self, rows: np.ndarray):
+        # Same values as erroranalysis' node_to_dict
+        metric = self._analyzer.metric
+        pred_y = self._pred_y[rows]
+        true_y = self._true_y[rows]
+        total = len(rows)
+        if metric in _regression_metrics:
+            error = np.abs(pred_y - true_y).sum()
+            return metric_to_func[metric](true_y, pred_y), error, 0
+        error = self._diff[rows].sum()
+        if (
+            metric in precision_metrics
+            or metric in recall_metrics
+            or metric in f1_metrics
+            or metric == Metrics.ACCURACY_SCORE
+        ):
+            metric_value = compute_metric_value(
+                metric_to_func[metric],
+                self._analyzer.classes,
+                true_y,
+                pred_y,
+                metric,
+            )
+        else:
+            metric_value = error / total if total else 0
+        return metric_value, error, total - error
+
+
+def _categorical_candidates(counts: np.ndarray, sums: np.ndarray) -> List:
+    occupied = np.flatnonzero(counts)
+    if len(occupied) < 2:
+        return []
+    if len(occupied) <= MAX_CAT_TO_ONEHOT:
+        return [occupied[i : i + 1] for i in range(len(occupied))]
+    # Categories ordered by their mean error, split on prefixes of the order
+    order = occupied[np.argsort(sums[occupied] / counts[occupied], kind="stable")]
+    n_prefixes = min(MAX_CAT_THRESHOLD, len(order) - 1)
+    candidates = [np.sort(order[:n]) for n in range(1, n_prefixes + 1)]
+    candidates += [np.sort(order[-n:]) for n in range(1, n_prefixes + 1)]
+    return candidates
+
+
+def _count_splits(node: _Node) -> int:
+    if node.split_index is None:
+        return 0
+    return 1 + _count_splits(node.left) + _count_splits(node.right)
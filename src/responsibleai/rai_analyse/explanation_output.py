@@ -0,0 +1,171 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+import logging
+import os
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from constants import ExplanationSettings, LocalImportanceMode
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+_SHAPE_KEY = "shape"
+_TOP_K_KEY = "k"
+_INDICES_KEY = "indices"
+_VALUES_KEY = "values"
+
+# The file in which interpret-community's save_explanation() writes the
+# local importances, as {"metadata": <type>, "data": <values>}
+_LOCAL_IMPORTANCE_FILENAME = "local_importance_values.json"
+_METADATA_KEY = "metadata"
+_DATA_KEY = "data"
+_DENSE_METADATA = ["ndarray", "list"]
+# Our metadata for the top-k form, which load_explanation() cannot read
+_TOP_K_METADATA = "rai_top_k"
+_ORIGINAL_METADATA_KEY = "original_metadata"
+
+
+def save_explanation_settings(
+    output_port_path: str, local_importance_mode: str, top_k: Optional[int]
+) -> None:
+    settings = {
+        ExplanationSettings.LOCAL_IMPORTANCE_MODE_KEY: local_importance_mode,
+        ExplanationSettings.TOP_K_KEY: top_k,
+    }
+    with open(Path(output_port_path) / ExplanationSettings.FILENAME, "w") as f:
+        json.dump(settings, f)
+
+
+def load_explanation_settings(input_port_path: str) -> Tuple[str, Optional[int]]:
+    # Explanations from before the settings file existed are full
+    settings_file = Path(input_port_path) / ExplanationSettings.FILENAME
+    if not settings_file.exists():
+        return LocalImportanceMode.FULL, None
+    with open(settings_file, "r") as f:
+        settings = json.load(f)
+    return (
+        settings[ExplanationSettings.LOCAL_IMPORTANCE_MODE_KEY],
+        settings[ExplanationSettings.TOP_K_KEY],
+    )
+
+
+def to_top_k_scores(scores: Any, top_k: int) -> Dict[str, Any]:
+    # scores is (rows x features) or (classes x rows x features). For
+    # each row keep the top_k features with the largest magnitude, in
+    # decreasing order of magnitude
+    dense = np.asarray(scores, dtype=np.float64)
+    k = min(top_k, dense.shape[-1])
+    magnitudes = np.abs(dense)
+    indices = np.argpartition(-magnitudes, k - 1, axis=-1)[..., :k]
+    order = np.argsort(
+        -np.take_along_axis(magnitudes, indices, axis=-1), axis=-1, kind="stable"
+    )
+    indices = np.take_along_axis(indices, order, axis=-1)
+    return {
+        _SHAPE_KEY: list(dense.shape),
+        _TOP_K_KEY: k,
+        _INDICES_KEY: indices.astype(np.int32).tolist(),
+        _VALUES_KEY: np.take_along_axis(dense, indices, axis=-1).tolist(),
+    }
+
+
+def from_top_k_scores(sparse_scores: Dict[str, Any]) -> np.ndarray:
+    # Inverse of to_top_k_scores, with zeros for the dropped features
+    dense = np.zeros(sparse_scores[_SHAPE_KEY], dtype=np.float64)
+    np.put_along_axis(
+        dense,
+        np.asarray(sparse_scores[_INDICES_KEY], dtype=np.int64),
+        np.asarray(sparse_scores[_VALUES_KEY], dtype=np.float64),
+        axis=-1,
+    )
+    return dense
+
+
+def _rewrite_local_importances(
+    directory: Path, rewrite: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+) -> int:
+    # rewrite returns None to leave a file as it is
+    n_rewritten = 0
+    for file_path in sorted(Path(directory).rglob(_LOCAL_IMPORTANCE_FILENAME)):
+        with open(file_path, "r") as f:
+            saved = json.load(f)
+        rewritten = rewrite(saved)
+        if rewritten is None:
+            continue
+        # Replace rather than write over the file, which may be a link
+        # to the same file in an input port
+        temp_path = file_path.with_name(file_path.name + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(rewritten, f)
+        os.replace(temp_path, file_path)
+        n_rewritten += 1
+    return n_rewritten
+
+
+def store_top_k_local_importances(directory: Path, top_k: int) -> None:
+    # Replaces the dense local importances of the explanations saved
+    # under directory by their top-k form. Sparse local importances are
+    # left as they are
+    def _to_top_k(saved: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if saved[_METADATA_KEY] not in _DENSE_METADATA:
+            return None
+        top_k_scores = to_top_k_scores(saved[_DATA_KEY], top_k)
+        top_k_scores[_ORIGINAL_METADATA_KEY] = saved[_METADATA_KEY]
+        return {_METADATA_KEY: _TOP_K_METADATA, _DATA_KEY: top_k_scores}
+
+    n_rewritten = _rewrite_local_importances(directory, _to_top_k)
+    _logger.info(
+        "Stored top {0} local importances in {1} files".format(top_k, n_rewritten)
+    )
+
+
+def expand_top_k_local_importances(directory: Path) -> None:
+    # Inverse of store_top_k_local_importances, so that the explanations
+    # can be loaded again. The dropped importances are zero
+    def _expand(saved: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if saved[_METADATA_KEY] != _TOP_K_METADATA:
+            return None
+        return {
+            _METADATA_KEY: saved[_DATA_KEY][_ORIGINAL_METADATA_KEY],
+            _DATA_KEY: from_top_k_scores(saved[_DATA_KEY]).tolist(),
+        }
+
+    n_rewritten = _rewrite_local_importances(directory, _expand)
+    if n_rewritten > 0:
+        _logger.info(
+            "Expanded top-k local importances in {0} files".format(n_rewritten)
+        )
+
+
+def apply_local_importance_mode(
+    rai_data: Any, local_importance_mode: str, top_k: Optional[int]
+) -> None:
+    # Rewrites the local importances in the data from RAIInsights.get_data()
+    if local_importance_mode == LocalImportanceMode.FULL:
+        return
+    for explanation_data in rai_data.modelExplanationData:
+        precomputed = getattr(explanation_data, "precomputedExplanations", None)
+        local_importance = getattr(precomputed, "localFeatureImportance", None)
+        if local_importance is None:
+            continue
+        if local_importance_mode == LocalImportanceMode.GLOBAL_ONLY:
+            precomputed.localFeatureImportance = None
+        elif local_importance_mode == LocalImportanceMode.TOP_K:
+            # Usually already the case, as the explanation output only
+            # holds the top-k form. The dashboard reads dense scores, so
+            # the dropped importances are written as zeros
+            local_importance.scores = from_top_k_scores(
+                to_top_k_scores(local_importance.scores, top_k)
+            ).tolist()
+        else:
+            raise ValueError(
+                "Unknown local importance mode: {0}".format(local_importance_mode)
+            )
+    _logger.info("Applied local importance mode {0}".format(local_importance_mode))
@@ -0,0 +1,138 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from interpret_community.mimic.models.lightgbm_model import LGBMExplainableModel
+from responsibleai._managers import explainer_manager
+
+from model_wrappers import single_threaded_workers
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+# Surrogate model unpickled once in each worker process
+_worker_surrogate: Optional[LGBMExplainableModel] = None
+
+
+def _init_worker(pickled_surrogate: bytes) -> None:
+    global _worker_surrogate
+    _worker_surrogate = pickle.loads(pickled_surrogate)
+
+
+def _explain_shard(evaluation_examples: Any, probabilities: Any, kwargs) -> Any:
+    return LGBMExplainableModel.explain_local(
+        _worker_surrogate, evaluation_examples, probabilities=probabilities, **kwargs
+    )
+
+
+def _take_rows(X: Any, start: int, stop: int) -> Any:
+    if X is None:
+        return None
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[start:stop]
+    return X[start:stop]
+
+
+def _merge_shards(shards: List[Any]) -> Any:
+    # explain_local returns one (rows x features) block, or a list of
+    # them (one per class), and the blocks may be sparse
+    if isinstance(shards[0], list):
+        return [_merge_shards([s[i] for s in shards]) for i in range(len(shards[0]))]
+    if scipy.sparse.issparse(shards[0]):
+        return scipy.sparse.vstack(shards, format="csr")
+    return np.concatenate(shards, axis=0)
+
+
+class ShardedLGBMExplainableModel(LGBMExplainableModel):
+    """LightGBM surrogate whose local explanations run on a process pool.
+
+    The rows to explain are split into shards of chunk_size rows (or
+    one shard per job), and the TreeExplainer SHAP values for each shard
+    are computed in a separate process. SHAP values of a row do not
+    depend on the other rows, so stacking the shards gives the same
+    result as a single pass. The settings are class attributes, because
+    MimicExplainer creates the surrogate itself.
+    """
+
+    n_jobs = 1
+    chunk_size: Optional[int] = None
+
+    def __getstate__(self):
+        # The TreeExplainer is rebuilt on demand in each worker
+        state = self.__dict__.copy()
+        state["_tree_explainer"] = None
+        return state
+
+    def _shard_bounds(self, n_rows: int) -> List[Tuple[int, int]]:
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = int(math.ceil(n_rows / self.n_jobs))
+        return [
+            (start, min(start + chunk_size, n_rows))
+            for start in range(0, n_rows, max(chunk_size, 1))
+        ]
+
+    def explain_local(self, evaluation_examples, probabilities=None, **kwargs):
+        n_rows = evaluation_examples.shape[0]
+        bounds = self._shard_bounds(n_rows)
+        if self.n_jobs == 1 or len(bounds) < 2:
+            return super().explain_local(
+                evaluation_examples, probabilities=probabilities, **kwargs
+            )
+
+        n_workers = min(self.n_jobs, len(bounds))
+        _logger.info(
+            "Explaining {0} rows in {1} shards on {2} processes".format(
+                n_rows, len(bounds), n_workers
+            )
+        )
+        # Spawn rather than fork, since LightGBM's OpenMP runtime is not
+        # safe to use in a forked child
+        with single_threaded_workers(), ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(pickle.dumps(self),),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _explain_shard,
+                    _take_rows(evaluation_examples, start, stop),
+                    _take_rows(probabilities, start, stop),
+                    kwargs,
+                )
+                for start, stop in bounds
+            ]
+            shards = [f.result() for f in futures]
+        return _merge_shards(shards)
+
+
+@contextlib.contextmanager
+def sharded_explanations(n_jobs: int, chunk_size: Optional[int]) -> Iterator[None]:
+    # ExplainerManager picks its surrogate model class from the module
+    # namespace in add(), and MimicExplainer instantiates it in compute(),
+    # so both calls should be made inside this block
+    if n_jobs < 1:
+        n_jobs = os.cpu_count()
+    original_class = explainer_manager.LGBMExplainableModel
+    ShardedLGBMExplainableModel.n_jobs = n_jobs
+    ShardedLGBMExplainableModel.chunk_size = chunk_size
+    explainer_manager.LGBMExplainableModel = ShardedLGBMExplainableModel
+    try:
+        yield
+    finally:
+        explainer_manager.LGBMExplainableModel = original_class
@@ -6,20 +6,35 @@ import argparse
 import json
 import logging
 from pathlib import Path
-import shutil
 import tempfile
 
-from typing import Dict
+from typing import Dict, List
 
-from responsibleai import RAIInsights
 from responsibleai.serialization_utilities import serialize_json_safe
 
-from constants import DashboardInfo, RAIToolType
+from constants import (
+    DashboardInfo,
+    DashboardLayout,
+    LocalImportanceMode,
+    NumericPayloadFormat,
+    RAIToolType,
+)
+from dashboard_arrays import extract_numeric_arrays
+from error_analysis_reports import saved_error_reports
+from explanation_output import (
+    apply_local_importance_mode,
+    expand_top_k_local_importances,
+    load_explanation_settings,
+)
 from rai_component_utilities import (
     create_rai_tool_directories,
+    copy_dashboard_info_file,
     copy_insight_to_raiinsights,
+    load_artifact_manifest,
     load_dashboard_info_file,
+    load_staged_rai_insights,
     add_properties_to_gather_run,
+    stage_input_port,
 )
 
 _DASHBOARD_CONSTRUCTOR_MISMATCH = (
@@ -41,6 +56,18 @@ def parse_args():
     parser.add_argument("--insight_4", type=str, default=None)
     parser.add_argument("--dashboard", type=str, required=True)
     parser.add_argument("--ux_json", type=str, required=True)
+    parser.add_argument(
+        "--dashboard_layout",
+        type=str,
+        default=DashboardLayout.FULL,
+        choices=[DashboardLayout.FULL, DashboardLayout.MANIFEST],
+    )
+    parser.add_argument(
+        "--numeric_payload_format",
+        type=str,
+        default=NumericPayloadFormat.JSON,
+        choices=[NumericPayloadFormat.JSON, NumericPayloadFormat.NPY],
+    )
 
     # parse args
     args = parser.parse_args()
@@ -49,20 +76,48 @@ def parse_args():
     return args
 
 
+def save_manifest_dashboard(
+    constructor_dir: str, insight_dirs: List[Path], dashboard_dir: str
+):
+    # Instead of a full copy of the RAIInsights, store the tool results
+    # plus the manifest of the constructor output. The complete
+    # directory is rebuilt from the constructor output when the
+    # dashboard is downloaded (see azure_ml_rai.download_rai_insights)
+    manifest = load_artifact_manifest(constructor_dir)
+    if manifest is None:
+        raise ValueError(
+            "Constructor output has no artifact manifest, use the {0} "
+            "dashboard layout".format(DashboardLayout.FULL)
+        )
+
+    manifest_file = Path(dashboard_dir) / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    with open(manifest_file, "w") as mf:
+        json.dump(manifest, mf)
+    copy_dashboard_info_file(constructor_dir, dashboard_dir)
+
+    for insight_dir in insight_dirs:
+        copy_insight_to_raiinsights(Path(dashboard_dir), insight_dir)
+    # So that the dashboard can be loaded as a RAIInsights
+    expand_top_k_local_importances(Path(dashboard_dir))
+    _logger.info("Saved manifest dashboard")
+
+
 def main(args):
     dashboard_info = load_dashboard_info_file(args.constructor)
     _logger.info("Constructor info: {0}".format(dashboard_info))
 
     with tempfile.TemporaryDirectory() as incoming_temp_dir:
         incoming_dir = Path(incoming_temp_dir)
-        shutil.copytree(args.constructor, incoming_dir, dirs_exist_ok=True)
-        _logger.info("Copied RAI Insights input to temporary directory")
+        stage_input_port(args.constructor, incoming_dir)
+        _logger.info("Staged RAI Insights input in temporary directory")
 
         create_rai_tool_directories(incoming_dir)
         _logger.info("Copied empty RAIInsights")
 
         insight_paths = [args.insight_1, args.insight_2, args.insight_3, args.insight_4]
 
+        insight_dirs: List[Path] = []
+        local_importance_mode, top_k = LocalImportanceMode.FULL, None
         included_tools: Dict[str, bool] = {
             RAIToolType.CAUSAL: False,
             RAIToolType.COUNTERFACTUAL: False,
@@ -82,18 +137,37 @@ def main(args):
                 _logger.info("Copying insight {0}".format(i + 1))
                 tool = copy_insight_to_raiinsights(incoming_dir, Path(ip))
                 included_tools[tool] = True
+                if tool == RAIToolType.EXPLANATION:
+                    local_importance_mode, top_k = load_explanation_settings(ip)
+                    expand_top_k_local_importances(incoming_dir)
+                insight_dirs.append(Path(ip))
             else:
                 _logger.info("Insight {0} is None".format(i + 1))
 
         _logger.info("Tool summary: {0}".format(included_tools))
 
-        rai_i = RAIInsights.load(incoming_dir)
+        rai_i = load_staged_rai_insights(incoming_dir)
         _logger.info("Object loaded")
 
-        rai_i.save(args.dashboard)
+        # The staged directory also holds component outputs which are not
+        # part of the RAIInsights (e.g. the prediction store), so the full
+        # layout is written by RAIInsights.save() rather than copied
+        if args.dashboard_layout == DashboardLayout.MANIFEST:
+            save_manifest_dashboard(args.constructor, insight_dirs, args.dashboard)
+        else:
+            rai_i.save(args.dashboard)
         _logger.info("Saved dashboard to oputput")
 
-        rai_data = rai_i.get_data()
+        if included_tools[RAIToolType.ERROR_ANALYSIS]:
+            # Use the saved trees rather than growing them again
+            with saved_error_reports(rai_i.error_analysis):
+                rai_data = rai_i.get_data()
+        else:
+            rai_data = rai_i.get_data()
+        apply_local_importance_mode(rai_data, local_importance_mode, top_k)
+        if args.numeric_payload_format == NumericPayloadFormat.NPY:
+            # Must be read back with dashboard_arrays.load_dashboard_json()
+            rai_data = extract_numeric_arrays(rai_data, args.ux_json)
         rai_dict = serialize_json_safe(rai_data)
         json_filename = "dashboard.json"
         output_path = Path(args.ux_json) / json_filename
@@ -0,0 +1,470 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import contextlib
+import copyreg
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+from sklearn.pipeline import Pipeline
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+PREDICTION_STORE_DIRECTORY = "prediction_store"
+_PREDICTION_STORE_INFO_FILENAME = "prediction_store.json"
+_PREDICTION_STORE_SPLITS_KEY = "splits"
+_PREDICTION_STORE_FINGERPRINT_KEY = "fingerprint"
+_PREDICTION_STORE_ROWS_KEY = "rows"
+
+_PREDICTION_COLUMN = "prediction"
+_PROBABILITY_COLUMN_FORMAT = "proba_{0}"
+
+_PREDICT = "predict"
+_PREDICT_PROBA = "predict_proba"
+
+# Rows scored per call when filling the prediction store
+_PREDICTION_BATCH_SIZE = 10000
+
+# Key of the second row hash, which confirms a match on the first
+_CHECK_HASH_KEY = "rai_check_hashes"
+
+
+def hash_rows(X: Any, hash_key: Optional[str] = None) -> np.ndarray:
+    # One uint64 per row, computed column-wise in vectorised code. A
+    # different (16 character) hash_key gives an independent hash
+    if not isinstance(X, pd.DataFrame):
+        X = pd.DataFrame(X)
+    if hash_key is None:
+        return pd.util.hash_pandas_object(X, index=False).to_numpy()
+    return pd.util.hash_pandas_object(X, index=False, hash_key=hash_key).to_numpy()
+
+
+def fingerprint_rows(X: Any, row_hashes: Optional[np.ndarray] = None) -> str:
+    if row_hashes is None:
+        row_hashes = hash_rows(X)
+    sha256 = hashlib.sha256()
+    if isinstance(X, pd.DataFrame):
+        sha256.update(json.dumps([str(c) for c in X.columns]).encode("utf-8"))
+    sha256.update(np.ascontiguousarray(row_hashes).tobytes())
+    return sha256.hexdigest()
+
+
+class ModelWrapper:
+    """Base class for objects which stand in for the model under analysis.
+
+    Anything not overridden is delegated to the wrapped model. A wrapper
+    pickles as the model it wraps, so it never leaks into saved output.
+    predict_proba is only present if the wrapped model has it.
+    """
+
+    def __init__(self, model: Any):
+        self._model = model
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "_model":
+            raise AttributeError(name)
+        return getattr(self._model, name)
+
+    def __reduce_ex__(self, protocol):
+        reduced = self._model.__reduce_ex__(protocol)
+        if isinstance(reduced, tuple) and reduced[0] is copyreg.__newobj__:
+            # Pickle refuses __newobj__ for an object of another class,
+            # so call the constructor of the wrapped model explicitly
+            model_class = reduced[1][0]
+            reduced = (model_class.__new__,) + reduced[1:]
+        return reduced
+
+    @property
+    def wrapped_model(self) -> Any:
+        return self._model
+
+    def predict(self, X: Any) -> Any:
+        return self._model.predict(X)
+
+    @property
+    def predict_proba(self):
+        if not hasattr(self._model, _PREDICT_PROBA):
+            raise AttributeError(_PREDICT_PROBA)
+        return self._predict_proba
+
+    def _predict_proba(self, X: Any) -> Any:
+        return self._model.predict_proba(X)
+
+
+def _predict_in_batches(predict_function, X: pd.DataFrame) -> np.ndarray:
+    results = [
+        np.asarray(predict_function(X.iloc[start : start + _PREDICTION_BATCH_SIZE]))
+        for start in range(0, len(X), _PREDICTION_BATCH_SIZE)
+    ]
+    return np.concatenate(results)
+
+
+def save_prediction_store(
+    model: Any, features: Dict[str, pd.DataFrame], task_type: str, output_dir: str
+) -> None:
+    # Score each dataset (e.g. train and test features) once, and save
+    # the results with a fingerprint of the rows they belong to
+    store_dir = Path(output_dir) / PREDICTION_STORE_DIRECTORY
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    splits = {}
+    for split_name, X in features.items():
+        _logger.info("Computing predictions for {0}".format(split_name))
+        predictions = pd.DataFrame(
+            {_PREDICTION_COLUMN: _predict_in_batches(model.predict, X)}
+        )
+        if task_type == "classification" and hasattr(model, _PREDICT_PROBA):
+            probabilities = _predict_in_batches(model.predict_proba, X)
+            for i in range(probabilities.shape[1]):
+                column = _PROBABILITY_COLUMN_FORMAT.format(i)
+                predictions[column] = probabilities[:, i]
+        predictions.to_parquet(store_dir / "{0}.parquet".format(split_name))
+        splits[split_name] = {
+            _PREDICTION_STORE_FINGERPRINT_KEY: fingerprint_rows(X),
+            _PREDICTION_STORE_ROWS_KEY: len(X),
+        }
+
+    with open(store_dir / _PREDICTION_STORE_INFO_FILENAME, "w") as f:
+        json.dump({_PREDICTION_STORE_SPLITS_KEY: splits}, f)
+    _logger.info("Saved prediction store for {0}".format(list(splits.keys())))
+
+
+def load_prediction_store(input_dir: str) -> Optional[Dict[str, Any]]:
+    # Returns a dictionary of the stored predictions keyed by
+    # fingerprint, or None if there is no store
+    store_dir = Path(input_dir) / PREDICTION_STORE_DIRECTORY
+    info_file = store_dir / _PREDICTION_STORE_INFO_FILENAME
+    if not info_file.exists():
+        return None
+    with open(info_file, "r") as f:
+        info = json.load(f)
+
+    store = {}
+    for split_name, split_info in info[_PREDICTION_STORE_SPLITS_KEY].items():
+        predictions = pd.read_parquet(store_dir / "{0}.parquet".format(split_name))
+        proba_columns = [c for c in predictions.columns if c != _PREDICTION_COLUMN]
+        store[split_info[_PREDICTION_STORE_FINGERPRINT_KEY]] = {
+            _PREDICTION_STORE_ROWS_KEY: split_info[_PREDICTION_STORE_ROWS_KEY],
+            _PREDICT: predictions[_PREDICTION_COLUMN].to_numpy(),
+            _PREDICT_PROBA: (
+                predictions[proba_columns].to_numpy() if proba_columns else None
+            ),
+        }
+    _logger.info(
+        "Loaded prediction store for {0}".format(
+            list(info[_PREDICTION_STORE_SPLITS_KEY].keys())
+        )
+    )
+    return store
+
+
+class PredictionStoreModel(ModelWrapper):
+    """Serves predictions for whole datasets from the prediction store.
+
+    A call is answered from the store when the input has the same rows
+    as one of the stored datasets (checked by fingerprint). Anything
+    else is passed through to the model.
+    """
+
+    def __init__(self, model: Any, store: Dict[str, Any]):
+        super().__init__(model)
+        self._store = store
+        self._stored_row_counts = set(
+            e[_PREDICTION_STORE_ROWS_KEY] for e in store.values()
+        )
+
+    def _lookup(self, X: Any, method: str) -> Optional[np.ndarray]:
+        if len(X) not in self._stored_row_counts:
+            return None
+        entry = self._store.get(fingerprint_rows(X))
+        if entry is None or entry[method] is None:
+            return None
+        _logger.info("Serving {0} for {1} rows from store".format(method, len(X)))
+        return entry[method].copy()
+
+    def predict(self, X: Any) -> Any:
+        result = self._lookup(X, _PREDICT)
+        if result is None:
+            result = self._model.predict(X)
+        return result
+
+    def _predict_proba(self, X: Any) -> Any:
+        result = self._lookup(X, _PREDICT_PROBA)
+        if result is None:
+            result = self._model.predict_proba(X)
+        return result
+
+
+def _take_rows(X: Any, start: int, stop: int) -> Any:
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[start:stop]
+    return X[start:stop]
+
+
+class BatchedInferenceModel(ModelWrapper):
+    """Scores large inputs in fixed size chunks, optionally in parallel.
+
+    Chunks are scored on a pool of threads (the heavy lifting in most
+    models releases the GIL) and their results are joined in order.
+    Inputs no larger than one chunk are passed through untouched.
+    """
+
+    def __init__(self, model: Any, chunk_size: int, n_jobs: int = 1):
+        super().__init__(model)
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive: {0}".format(chunk_size))
+        self._chunk_size = chunk_size
+        self._n_jobs = os.cpu_count() if n_jobs < 1 else n_jobs
+
+    def _score(self, predict_function: Callable[[Any], Any], X: Any) -> Any:
+        n_rows = len(X)
+        if n_rows <= self._chunk_size:
+            return predict_function(X)
+
+        starts = range(0, n_rows, self._chunk_size)
+
+        def _score_chunk(start: int) -> np.ndarray:
+            stop = min(start + self._chunk_size, n_rows)
+            return np.asarray(predict_function(_take_rows(X, start, stop)))
+
+        if self._n_jobs == 1:
+            chunks = [_score_chunk(start) for start in starts]
+        else:
+            with ThreadPoolExecutor(max_workers=self._n_jobs) as executor:
+                chunks = list(executor.map(_score_chunk, starts))
+        # Chunks can differ in dtype (such as string labels of different
+        # lengths), so let concatenate find one which holds them all
+        return np.concatenate(chunks)
+
+    def predict(self, X: Any) -> Any:
+        return self._score(self._model.predict, X)
+
+    def _predict_proba(self, X: Any) -> Any:
+        return self._score(self._model.predict_proba, X)
+
+
+def _take_positions(X: Any, positions: np.ndarray) -> Any:
+    if isinstance(X, (pd.DataFrame, pd.Series)):
+        return X.iloc[positions]
+    return X[positions]
+
+
+class CachedPreprocessingPipeline(ModelWrapper):
+    """Skips the preprocessing steps of an sklearn Pipeline for known rows.
+
+    The rows of the fixed datasets (the train and test features) are
+    sent through every step but the last once, up front. When the model
+    is asked to score those rows again, their cached transformed values
+    go straight to the final estimator, and only unseen rows (such as
+    perturbed copies) are preprocessed. Rows are matched on two
+    independent 64-bit hashes, so a collision of one cannot return
+    another row's values. Sparse output from one-hot encoding stays
+    sparse.
+    """
+
+    def __init__(self, model: Any, pipeline: Pipeline, fixed_rows: List[pd.DataFrame]):
+        super().__init__(model)
+        self._preprocessor = pipeline[:-1]
+        self._estimator = pipeline.steps[-1][1]
+
+        X = pd.concat(fixed_rows, ignore_index=True)
+        self._transformed = self._preprocessor.transform(X)
+        if scipy.sparse.issparse(self._transformed):
+            self._transformed = scipy.sparse.csr_matrix(self._transformed)
+        unique_hashes, first_positions = np.unique(hash_rows(X), return_index=True)
+        self._row_index = pd.Index(unique_hashes)
+        self._row_positions = first_positions
+        self._check_hashes = hash_rows(X, _CHECK_HASH_KEY)[first_positions]
+        _logger.info(
+            "Cached preprocessed values for {0} rows".format(len(first_positions))
+        )
+
+    def _transform(self, X: Any) -> Any:
+        found = self._row_index.get_indexer(hash_rows(X))
+        known = found >= 0
+        if known.any():
+            check_hashes = hash_rows(X, _CHECK_HASH_KEY)
+            known[known] = check_hashes[known] == self._check_hashes[found[known]]
+        known_positions = self._row_positions[found[known]]
+        if known.all():
+            return self._transformed[known_positions]
+
+        new_rows = np.flatnonzero(~known)
+        transformed_new = self._preprocessor.transform(_take_positions(X, new_rows))
+        if not known.any():
+            return transformed_new
+        if scipy.sparse.issparse(self._transformed):
+            stacked = scipy.sparse.vstack(
+                [self._transformed[known_positions], transformed_new], format="csr"
+            )
+        else:
+            stacked = np.vstack([self._transformed[known_positions], transformed_new])
+        # Put the rows back into the order they were supplied in
+        order = np.concatenate([np.flatnonzero(known), new_rows])
+        return stacked[np.argsort(order)]
+
+    def predict(self, X: Any) -> Any:
+        return self._estimator.predict(self._transform(X))
+
+    def _predict_proba(self, X: Any) -> Any:
+        return self._estimator.predict_proba(self._transform(X))
+
+
+def create_cached_preprocessing_pipeline(
+    model: Any, fixed_rows: List[pd.DataFrame]
+) -> Any:
+    # MLflow may hand back the sklearn model itself, or a wrapper holding
+    # it. Anything other than a multi-step Pipeline is returned as is
+    pipeline = getattr(model, "sklearn_model", model)
+    if not isinstance(pipeline, Pipeline) or len(pipeline.steps) < 2:
+        return model
+    if not hasattr(pipeline.steps[-1][1], _PREDICT):
+        return model
+    return CachedPreprocessingPipeline(model, pipeline, fixed_rows)
+
+
+class MemoizedPredictionModel(ModelWrapper):
+    """Remembers the model output for individual rows.
+
+    Rows are identified by a vectorised 64-bit hash of their values, and
+    a second independent hash is checked on every hit, as in
+    CachedPreprocessingPipeline. Each call looks up every row in a
+    bounded LRU (one per predict method), and the rows not found are
+    deduplicated and scored in a single call to the wrapped model. Calls are serialised, since the
+    cache is shared.
+    """
+
+    def __init__(self, model: Any, max_rows: int):
+        super().__init__(model)
+        if max_rows < 1:
+            raise ValueError("max_rows must be positive: {0}".format(max_rows))
+        self._max_rows = max_rows
+        self._caches = {_PREDICT: OrderedDict(), _PREDICT_PROBA: OrderedDict()}
+        self._row_hits = 0
+        self._row_misses = 0
+        self._rows_scored = 0
+        self._model_calls = 0
+        self._lock = threading.Lock()
+
+    def _score(self, method: str, X: Any) -> Any:
+        with self._lock:
+            return self._score_locked(method, X)
+
+    def _score_locked(self, method: str, X: Any) -> Any:
+        cache = self._caches[method]
+        row_hashes = hash_rows(X).tolist()
+        check_hashes = hash_rows(X, _CHECK_HASH_KEY).tolist()
+        outputs = []
+        for h, c in zip(row_hashes, check_hashes):
+            entry = cache.get(h)
+            # A different check hash means another row with the same hash
+            outputs.append(entry[1] if entry is not None and entry[0] == c else None)
+        miss_positions = [i for i, output in enumerate(outputs) if output is None]
+
+        if len(miss_positions) > 0:
+            # Score each distinct missing row once
+            first_positions: Dict[Tuple[int, int], int] = {}
+            for i in miss_positions:
+                first_positions.setdefault((row_hashes[i], check_hashes[i]), i)
+            to_score = np.fromiter(first_positions.values(), dtype=np.int64)
+            scored = np.asarray(
+                getattr(self._model, method)(_take_positions(X, to_score))
+            )
+            self._model_calls += 1
+            self._rows_scored += len(to_score)
+            scored_rows = dict(zip(first_positions.keys(), scored))
+            for (h, c), output in scored_rows.items():
+                cache[h] = (c, output)
+            for i in miss_positions:
+                outputs[i] = scored_rows[(row_hashes[i], check_hashes[i])]
+
+        for h in row_hashes:
+            cache.move_to_end(h)
+        while len(cache) > self._max_rows:
+            cache.popitem(last=False)
+
+        self._row_hits += len(row_hashes) - len(miss_positions)
+        self._row_misses += len(miss_positions)
+        if len(outputs) == 0:
+            return getattr(self._model, method)(X)
+        return np.stack(outputs)
+
+    def predict(self, X: Any) -> Any:
+        return self._score(_PREDICT, X)
+
+    def _predict_proba(self, X: Any) -> Any:
+        return self._score(_PREDICT_PROBA, X)
+
+    def log_statistics(self) -> None:
+        total = self._row_hits + self._row_misses
+        _logger.info(
+            "Prediction cache: {0} of {1} rows served from cache, {2} rows "
+            "scored in {3} model calls".format(
+                self._row_hits, total, self._rows_scored, self._model_calls
+            )
+        )
+
+
+@contextlib.contextmanager
+def single_threaded_workers() -> Iterator[None]:
+    # Worker processes inherit the environment when they start. With
+    # one OpenMP thread each, the workers rather than the threads of
+    # models such as LightGBM share out the cores
+    original = os.environ.get("OMP_NUM_THREADS")
+    os.environ["OMP_NUM_THREADS"] = "1"
+    try:
+        yield
+    finally:
+        if original is None:
+            del os.environ["OMP_NUM_THREADS"]
+        else:
+            os.environ["OMP_NUM_THREADS"] = original
+
+
+def log_model_statistics(model: Any) -> None:
+    # Walk down the chain of wrappers around the model
+    while isinstance(model, ModelWrapper):
+        if isinstance(model, MemoizedPredictionModel):
+            model.log_statistics()
+        model = model.wrapped_model
+
+
+def create_model_wrapper(
+    chunk_size: Optional[int], n_jobs: int, cache_rows: Optional[int]
+) -> Optional[Callable[[Any], Any]]:
+    # Returns None if neither batching (no chunk size) nor memoization
+    # (no cache size) is switched on
+    use_batching = chunk_size is not None and chunk_size > 0
+    use_memoization = cache_rows is not None and cache_rows > 0
+    if not use_batching and not use_memoization:
+        return None
+    if use_batching:
+        _logger.info(
+            "Scoring in chunks of {0} rows with {1} jobs".format(chunk_size, n_jobs)
+        )
+    if use_memoization:
+        _logger.info("Caching predictions for up to {0} rows".format(cache_rows))
+
+    def _wrap(model: Any) -> Any:
+        # Only the rows missing from the cache reach the batching
+        if use_batching:
+            model = BatchedInferenceModel(model, chunk_size, n_jobs)
+        if use_memoization:
+            model = MemoizedPredictionModel(model, cache_rows)
+        return model
+
+    return _wrap
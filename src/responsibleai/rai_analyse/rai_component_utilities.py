@@ -2,22 +2,34 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # ---------------------------------------------------------
 
+import hashlib
 import json
 import logging
 import os
 import pathlib
 import shutil
 import tempfile
+import time
 import uuid
 
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 from azureml.core import Run
 
 from responsibleai import RAIInsights, __version__ as responsibleai_version
+from responsibleai._managers.causal_manager import CausalManager
+from responsibleai._managers.counterfactual_manager import CounterfactualManager
+from responsibleai._managers.error_analysis_manager import ErrorAnalysisManager
+from responsibleai._managers.explainer_manager import ExplainerManager
 
+from artifact_cache import hash_file
 from constants import DashboardInfo, PropertyKeyValues, RAIToolType
-
+from model_wrappers import (
+    PredictionStoreModel,
+    create_cached_preprocessing_pipeline,
+    load_prediction_store,
+)
 
 _logger = logging.getLogger(__file__)
 logging.basicConfig(level=logging.INFO)
@@ -31,6 +43,36 @@ _tool_directory_mapping: Dict[str, str] = {
     RAIToolType.EXPLANATION: "explainer",
 }
 
+# Names of the RAIInsights properties which expose each tool manager
+_tool_manager_property_mapping: Dict[str, str] = {
+    RAIToolType.CAUSAL: "causal",
+    RAIToolType.COUNTERFACTUAL: "counterfactual",
+    RAIToolType.ERROR_ANALYSIS: "error_analysis",
+    RAIToolType.EXPLANATION: "explainer",
+}
+
+# The classes implementing each tool manager
+_tool_manager_class_mapping: Dict[str, type] = {
+    RAIToolType.CAUSAL: CausalManager,
+    RAIToolType.COUNTERFACTUAL: CounterfactualManager,
+    RAIToolType.ERROR_ANALYSIS: ErrorAnalysisManager,
+    RAIToolType.EXPLANATION: ExplainerManager,
+}
+
+# Below this many files, a thread pool is not worth starting
+_PARALLEL_COPY_MIN_FILES = 16
+
+# The FICLONE ioctl from linux/fs.h, used to request a reflink
+_FICLONE_IOCTL = 0x40049409
+
+
+# Files which are written alongside the RAIInsights, and so are
+# not part of the content it is built from
+_manifest_excluded_files = [
+    DashboardInfo.RAI_INSIGHTS_PARENT_FILENAME,
+    DashboardInfo.ARTIFACT_MANIFEST_FILENAME,
+]
+
 
 def print_dir_tree(base_dir):
     for current_dir, subdirs, files in os.walk(base_dir):
@@ -75,16 +117,258 @@ def create_rai_tool_directories(rai_insights_dir: pathlib.Path) -> None:
     _logger.info("Added empty directories")
 
 
-def load_rai_insights_from_input_port(input_port_path: str) -> RAIInsights:
+def _link_file(src: pathlib.Path, dst: pathlib.Path) -> None:
+    try:
+        os.symlink(src, dst)
+    except OSError:
+        # Symlinks may be disallowed (e.g. on Windows without the
+        # right privileges), but a hardlink might still work
+        os.link(src, dst)
+
+
+def create_link_overlay(src_dir: pathlib.Path, dst_dir: pathlib.Path) -> None:
+    # Mirror the directory structure of src_dir into dst_dir, with
+    # every file replaced by a link back to the original. This
+    # lets RAIInsights.load() read straight from the (possibly
+    # mounted) input port, while still allowing us to add
+    # directories in dst_dir without touching the source
+    src_dir = pathlib.Path(src_dir).absolute()
+    dst_dir = pathlib.Path(dst_dir)
+    for current_dir, _, files in os.walk(src_dir):
+        target_dir = dst_dir / pathlib.Path(current_dir).relative_to(src_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for filename in files:
+            _link_file(pathlib.Path(current_dir) / filename, target_dir / filename)
+
+
+def _reflink_file(src: pathlib.Path, dst: pathlib.Path) -> bool:
+    # Attempt a copy-on-write clone. Only some filesystems (btrfs,
+    # XFS and the like) support this, so failure is expected
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE_IOCTL, src_file.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+class _TreeCopier:
+    """Copies a single file at a time, preferring links over data copies.
+
+    Hardlinks (and failing that reflinks) are only attempted when the
+    source and destination live on the same filesystem. After the first
+    failed attempt of each kind, we stop trying.
+    """
+
+    def __init__(self, allow_links: bool, same_filesystem: bool):
+        self._try_hardlink = allow_links and same_filesystem
+        self._try_reflink = allow_links and same_filesystem
+
+    def copy_file(self, src: pathlib.Path, dst: pathlib.Path) -> bool:
+        # Returns whether the file was linked rather than copied
+        if self._try_hardlink:
+            try:
+                os.link(src, dst)
+                return True
+            except OSError:
+                self._try_hardlink = False
+        if self._try_reflink:
+            if _reflink_file(src, dst):
+                return True
+            self._try_reflink = False
+
+        shutil.copy2(src, dst)
+        return False
+
+
+def copy_tree(
+    src_dir: pathlib.Path,
+    dst_dir: pathlib.Path,
+    allow_links: bool = True,
+    max_workers: Optional[int] = None,
+) -> Dict[str, float]:
+    # Recursively copy src_dir into dst_dir (which may already exist)
+    # Per-file latency dominates on blob-fuse mounts, so the files are
+    # copied on a thread pool. Returns statistics about the copy
+    start_time = time.perf_counter()
+    src_dir = pathlib.Path(src_dir)
+    dst_dir = pathlib.Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+
+    file_pairs: List[Tuple[pathlib.Path, pathlib.Path]] = []
+    total_bytes = 0
+    for current_dir, _, files in os.walk(src_dir):
+        target_dir = dst_dir / pathlib.Path(current_dir).relative_to(src_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for filename in files:
+            src_file = pathlib.Path(current_dir) / filename
+            file_pairs.append((src_file, target_dir / filename))
+            total_bytes += os.path.getsize(src_file)
+
+    same_filesystem = os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev
+    copier = _TreeCopier(allow_links, same_filesystem)
+    if max_workers is None:
+        max_workers = min(32, 4 * (os.cpu_count() or 1))
+
+    if len(file_pairs) < _PARALLEL_COPY_MIN_FILES or max_workers <= 1:
+        linked = [copier.copy_file(s, d) for s, d in file_pairs]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            linked = list(
+                executor.map(lambda pair: copier.copy_file(*pair), file_pairs)
+            )
+
+    elapsed = time.perf_counter() - start_time
+    stats = {
+        "files": len(file_pairs),
+        "linked_files": sum(linked),
+        "bytes": total_bytes,
+        "seconds": elapsed,
+        "megabytes_per_second": total_bytes / (1024 * 1024) / max(elapsed, 1e-9),
+    }
+    _logger.info(
+        "Copied {0} files ({1} linked), {2} bytes in {3:.2f}s ({4:.1f} MB/s): {5} -> {6}".format(
+            stats["files"],
+            stats["linked_files"],
+            stats["bytes"],
+            stats["seconds"],
+            stats["megabytes_per_second"],
+            src_dir,
+            dst_dir,
+        )
+    )
+    return stats
+
+
+def stage_input_port(
+    input_port_path: str, target_dir: pathlib.Path, use_link_overlay: bool = True
+) -> None:
+    # Make the contents of the input port available in target_dir,
+    # preferably as a link overlay. A full copy is the fallback
+    if use_link_overlay:
+        try:
+            create_link_overlay(pathlib.Path(input_port_path), target_dir)
+            _logger.info("Created link overlay of input port")
+            return
+        except OSError as e:
+            _logger.warning(
+                "Unable to create link overlay ({0}), falling back to copy".format(e)
+            )
+            shutil.rmtree(target_dir, ignore_errors=True)
+
+    copy_tree(pathlib.Path(input_port_path), target_dir)
+    _logger.info("Copied input port to {0}".format(target_dir))
+
+
+def _load_model_and_data(
+    staged_dir: pathlib.Path, wrap_model: Callable[[RAIInsights], Any]
+) -> RAIInsights:
+    # The first steps of RAIInsights.load(), with the model replaced by
+    # wrap_model(rai_insights) before any manager is created from it
+    rai_insights = RAIInsights.__new__(RAIInsights)
+    RAIInsights._load_data(rai_insights, staged_dir)
+    RAIInsights._load_metadata(rai_insights, staged_dir)
+    RAIInsights._load_model(rai_insights, staged_dir)
+    rai_insights.__dict__["model"] = wrap_model(rai_insights)
+    return rai_insights
+
+
+def load_saved_features(rai_insights_dir: pathlib.Path) -> Dict[str, Any]:
+    # The train and test features as the tool components will see them.
+    # RAIInsights.save() writes the data as JSON, which does not keep
+    # every float digit, so the in-memory frames can differ from these
+    rai_insights = RAIInsights.__new__(RAIInsights)
+    RAIInsights._load_data(rai_insights, rai_insights_dir)
+    RAIInsights._load_metadata(rai_insights, rai_insights_dir)
+    target_column = rai_insights.target_column
+    return {
+        "train": rai_insights.train.drop(columns=[target_column]),
+        "test": rai_insights.test.drop(columns=[target_column]),
+    }
+
+
+def _load_managers(
+    rai_insights: RAIInsights,
+    staged_dir: pathlib.Path,
+    loaded_tool_types: Iterable[str],
+) -> None:
+    # As RAIInsights.load() does, but only for the given tools. The
+    # other managers are left as None, and are not computed or saved
+    managers = []
+    for tool_type, manager_class in _tool_manager_class_mapping.items():
+        manager_dir_name = _tool_directory_mapping[tool_type]
+        manager = None
+        if tool_type in loaded_tool_types:
+            manager = manager_class._load(
+                pathlib.Path(staged_dir) / manager_dir_name, rai_insights
+            )
+            managers.append(manager)
+        rai_insights.__dict__["_{0}_manager".format(manager_dir_name)] = manager
+    rai_insights.__dict__["_managers"] = managers
+
+
+def load_staged_rai_insights(
+    staged_dir: pathlib.Path,
+    tool_type: Optional[str] = None,
+    model_wrapper: Optional[Callable[[Any], Any]] = None,
+    cache_preprocessing: bool = False,
+) -> RAIInsights:
+    # If tool_type is given, only the manager for that tool is loaded.
+    # If the constructor saved a prediction store, the model is wrapped
+    # so that it serves those predictions. If cache_preprocessing is set
+    # and the model is an sklearn Pipeline, the preprocessed train and
+    # test rows are cached (see model_wrappers.py)
+    if tool_type is None:
+        loaded_tool_types = list(_tool_manager_class_mapping.keys())
+    else:
+        loaded_tool_types = [tool_type]
+
+    prediction_store = load_prediction_store(staged_dir)
+
+    def _wrap_model(rai_insights):
+        model = rai_insights.model
+        if cache_preprocessing:
+            features = [
+                rai_insights.train.drop(columns=[rai_insights.target_column]),
+                rai_insights.test.drop(columns=[rai_insights.target_column]),
+            ]
+            model = create_cached_preprocessing_pipeline(model, features)
+        if model_wrapper is not None:
+            model = model_wrapper(model)
+        if prediction_store is not None:
+            model = PredictionStoreModel(model, prediction_store)
+        return model
+
+    result = _load_model_and_data(staged_dir, _wrap_model)
+    _load_managers(result, staged_dir, loaded_tool_types)
+    _logger.info("Loaded RAIInsights object for {0}".format(loaded_tool_types))
+    return result
+
+
+def load_rai_insights_from_input_port(
+    input_port_path: str,
+    use_link_overlay: bool = True,
+    tool_type: Optional[str] = None,
+    model_wrapper: Optional[Callable[[Any], Any]] = None,
+    cache_preprocessing: bool = False,
+) -> RAIInsights:
     with tempfile.TemporaryDirectory() as incoming_temp_dir:
         incoming_dir = pathlib.Path(incoming_temp_dir)
-        shutil.copytree(input_port_path, incoming_dir, dirs_exist_ok=True)
-        _logger.info("Copied RAI Insights input to temporary directory")
+        stage_input_port(input_port_path, incoming_dir, use_link_overlay)
+        _logger.info("Staged RAI Insights input in temporary directory")
 
         create_rai_tool_directories(incoming_dir)
 
-        result = RAIInsights.load(incoming_dir)
-        _logger.info("Loaded RAIInsights object")
+        result = load_staged_rai_insights(
+            incoming_dir, tool_type, model_wrapper, cache_preprocessing
+        )
     return result
 
 
@@ -96,15 +380,14 @@ def copy_insight_to_raiinsights(
     # Recall that we copy the JSON containing metadata from the
     # constructor component into each directory
     # This means we have that file and the results directory
-    # present in the insight_dir
-    dir_items = list(insight_dir.iterdir())
-    assert len(dir_items) == 2
+    # present in the insight_dir (plus possibly settings files
+    # for the tool)
+    assert (insight_dir / DashboardInfo.RAI_INSIGHTS_PARENT_FILENAME).exists()
+    dir_items = [d for d in insight_dir.iterdir() if d.is_dir()]
+    assert len(dir_items) == 1
 
     # We want the directory, not the JSON file
-    if dir_items[0].name == DashboardInfo.RAI_INSIGHTS_PARENT_FILENAME:
-        tool_dir_name = dir_items[1].name
-    else:
-        tool_dir_name = dir_items[0].name
+    tool_dir_name = dir_items[0].name
 
     _logger.info("Detected tool: {0}".format(tool_dir_name))
     assert tool_dir_name in _tool_directory_mapping.values()
@@ -115,42 +398,98 @@ def copy_insight_to_raiinsights(
     tool_dir = insight_dir / tool_dir_name
 
     tool_dir_items = list(tool_dir.iterdir())
-    assert len(tool_dir_items) == 1
-
-    src_dir = insight_dir / tool_dir_name / tool_dir_items[0].parts[-1]
-    dst_dir = rai_insights_dir / tool_dir_name / tool_dir_items[0].parts[-1]
-    print("Copy source:", str(src_dir))
-    print("Copy dest  :", str(dst_dir))
-    shutil.copytree(
-        src=src_dir,
-        dst=dst_dir,
-    )
+    assert len(tool_dir_items) >= 1
+
+    for tool_dir_item in tool_dir_items:
+        src_dir = insight_dir / tool_dir_name / tool_dir_item.parts[-1]
+        dst_dir = rai_insights_dir / tool_dir_name / tool_dir_item.parts[-1]
+        print("Copy source:", str(src_dir))
+        print("Copy dest  :", str(dst_dir))
+        copy_tree(src_dir, dst_dir)
     _logger.info("Copy complete")
     return tool_type
 
 
-def save_to_output_port(rai_i: RAIInsights, output_port_path: str, tool_type: str):
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        rai_i.save(tmpdirname)
-        _logger.info(f"Saved to {tmpdirname}")
-
-        tool_dir_name = _tool_directory_mapping[tool_type]
-        insight_dirs = os.listdir(pathlib.Path(tmpdirname) / tool_dir_name)
-        assert len(insight_dirs) == 1, "Checking for exactly one tool output"
-        _logger.info("Checking dirname is GUID")
-        uuid.UUID(insight_dirs[0])
-
-        target_path = pathlib.Path(output_port_path) / tool_dir_name
-        target_path.mkdir()
-        _logger.info("Created output directory")
-
-        _logger.info("Starting copy")
-        shutil.copytree(
-            pathlib.Path(tmpdirname) / tool_dir_name,
-            target_path,
-            dirs_exist_ok=True,
+def create_artifact_manifest(artifact_dir: pathlib.Path) -> Dict[str, Any]:
+    # Record the content hash of every file in artifact_dir, plus a
+    # digest over all of them which identifies the whole directory
+    artifact_dir = pathlib.Path(artifact_dir)
+    files: Dict[str, Dict[str, Any]] = {}
+    for current_dir, _, filenames in os.walk(artifact_dir):
+        for filename in filenames:
+            file_path = pathlib.Path(current_dir) / filename
+            relative_path = file_path.relative_to(artifact_dir).as_posix()
+            if relative_path in _manifest_excluded_files:
+                continue
+            files[relative_path] = {
+                DashboardInfo.ARTIFACT_MANIFEST_SHA256_KEY: hash_file(file_path),
+                DashboardInfo.ARTIFACT_MANIFEST_SIZE_KEY: os.path.getsize(file_path),
+            }
+
+    digest = hashlib.sha256()
+    for relative_path in sorted(files.keys()):
+        file_hash = files[relative_path][DashboardInfo.ARTIFACT_MANIFEST_SHA256_KEY]
+        digest.update("{0}:{1}\n".format(relative_path, file_hash).encode("utf-8"))
+
+    return {
+        DashboardInfo.ARTIFACT_MANIFEST_DIGEST_KEY: digest.hexdigest(),
+        DashboardInfo.ARTIFACT_MANIFEST_FILES_KEY: files,
+    }
+
+
+def write_artifact_manifest(artifact_dir: pathlib.Path) -> str:
+    manifest = create_artifact_manifest(artifact_dir)
+    manifest_file = (
+        pathlib.Path(artifact_dir) / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    )
+    with open(manifest_file, "w") as mf:
+        json.dump(manifest, mf)
+    _logger.info(
+        "Wrote manifest of {0} files".format(
+            len(manifest[DashboardInfo.ARTIFACT_MANIFEST_FILES_KEY])
         )
-    _logger.info("Copied to output")
+    )
+    return manifest[DashboardInfo.ARTIFACT_MANIFEST_DIGEST_KEY]
+
+
+def load_artifact_manifest(artifact_dir: pathlib.Path) -> Optional[Dict[str, Any]]:
+    manifest_file = (
+        pathlib.Path(artifact_dir) / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    )
+    if not manifest_file.exists():
+        return None
+    with open(manifest_file, "r") as mf:
+        return json.load(mf)
+
+
+def get_tool_manager(rai_i: RAIInsights, tool_type: str) -> Any:
+    return getattr(rai_i, _tool_manager_property_mapping[tool_type])
+
+
+def save_to_output_port(rai_i: RAIInsights, output_port_path: str, tool_type: str):
+    tool_dir_name = _tool_directory_mapping[tool_type]
+    target_path = pathlib.Path(output_port_path) / tool_dir_name
+    # A run restarted after preemption may find a partly saved output
+    if target_path.exists():
+        shutil.rmtree(target_path)
+    target_path.mkdir()
+    _logger.info("Created output directory")
+
+    # Only serialise the manager for the tool we computed. The data
+    # and model are already in the constructor output, so
+    # saving the whole RAIInsights object would be wasted effort
+    tool_manager = get_tool_manager(rai_i, tool_type)
+    tool_manager._save(target_path)
+    _logger.info(f"Saved {tool_type} manager to {target_path}")
+
+    # Some tools (e.g. error analysis with several configurations)
+    # save more than one entry
+    insight_dirs = os.listdir(target_path)
+    assert len(insight_dirs) >= 1, "Checking for at least one tool output"
+    _logger.info("Checking dirnames are GUIDs")
+    for insight_dir in insight_dirs:
+        uuid.UUID(insight_dir)
+    _logger.info("Saved {0} entries to output".format(len(insight_dirs)))
 
 
 def add_properties_to_gather_run(
@@ -0,0 +1,139 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import hashlib
+import importlib.metadata as importlib_metadata
+import json
+import logging
+import os
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from responsibleai import __version__ as responsibleai_version
+
+from artifact_cache import DirectoryLRUCache, get_node_cache
+from constants import CacheSettings, DashboardInfo
+from rai_component_utilities import (
+    _tool_directory_mapping,
+    copy_tree,
+    load_dashboard_info_file,
+)
+
+_logger = logging.getLogger(__file__)
+logging.basicConfig(level=logging.INFO)
+
+_FINGERPRINT_PACKAGES = [
+    "dice-ml",
+    "econml",
+    "erroranalysis",
+    "interpret-community",
+    "scikit-learn",
+]
+
+
+class _UncacheableResult(Exception):
+    # Raised to leave the cache entry for a result unpopulated
+    pass
+
+
+def get_result_cache(
+    use_result_cache: bool, result_cache_dir: Optional[str]
+) -> Optional[DirectoryLRUCache]:
+    # Results are only cached when asked for. Use the given directory
+    # (e.g. a mounted datastore, shared by all nodes) if there is one,
+    # otherwise the node-local cache
+    if not use_result_cache:
+        return None
+    max_mb = int(
+        os.environ.get(
+            CacheSettings.RESULT_CACHE_MAX_MB_ENV_VAR,
+            CacheSettings.RESULT_CACHE_DEFAULT_MAX_MB,
+        )
+    )
+    if result_cache_dir is None:
+        return get_node_cache(CacheSettings.RESULT_CACHE_SUBDIR, max_mb)
+    try:
+        return DirectoryLRUCache(result_cache_dir, max_mb * 1024 * 1024)
+    except OSError as e:
+        _logger.warning("Unable to open result cache ({0})".format(e))
+        return None
+
+
+def _get_package_versions() -> Dict[str, Optional[str]]:
+    # The packages which compute the tool results, besides responsibleai
+    versions = {}
+    for package in _FINGERPRINT_PACKAGES:
+        try:
+            versions[package] = importlib_metadata.version(package)
+        except importlib_metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def get_result_fingerprint(
+    input_port_path: str, tool_type: str, tool_config: Dict[str, Any]
+) -> Optional[str]:
+    # The constructor digest covers the model and data, so together with
+    # the tool configuration it determines the result. Returns None if
+    # the constructor output predates the digest
+    dashboard_info = load_dashboard_info_file(input_port_path)
+    constructor_digest = dashboard_info.get(
+        DashboardInfo.RAI_INSIGHTS_CONSTRUCTOR_DIGEST_KEY
+    )
+    if constructor_digest is None:
+        _logger.info("No constructor digest, unable to cache result")
+        return None
+
+    fingerprint_source = {
+        "constructor_digest": constructor_digest,
+        "tool_type": tool_type,
+        "responsibleai_version": responsibleai_version,
+        "package_versions": _get_package_versions(),
+        "tool_config": tool_config,
+    }
+    serialised = json.dumps(fingerprint_source, sort_keys=True, default=str)
+    return hashlib.sha256(serialised.encode("utf-8")).hexdigest()
+
+
+def compute_with_result_cache(
+    input_port_path: str,
+    output_port_path: str,
+    tool_type: str,
+    tool_config: Dict[str, Any],
+    use_result_cache: bool,
+    result_cache_dir: Optional[str],
+    compute_result: Callable[[], Optional[bool]],
+) -> None:
+    # compute_result() must save the tool output to output_port_path,
+    # and may return False to keep that output out of the cache. It is
+    # skipped if a result with the same fingerprint is cached
+    tool_dir = Path(output_port_path) / _tool_directory_mapping[tool_type]
+    result_cache = get_result_cache(use_result_cache, result_cache_dir)
+    fingerprint = get_result_fingerprint(input_port_path, tool_type, tool_config)
+    if result_cache is None or fingerprint is None:
+        compute_result()
+        return
+
+    _logger.info("Result fingerprint: {0}".format(fingerprint))
+    computed = []
+
+    def _populate(target_dir: Path):
+        cacheable = compute_result()
+        computed.append(True)
+        if cacheable is False:
+            raise _UncacheableResult()
+        copy_tree(tool_dir, target_dir)
+
+    # Holding the entry means a concurrent job with the same fingerprint
+    # waits for this one, then reuses its result
+    try:
+        with result_cache.entry(fingerprint, _populate) as cached_dir:
+            if len(computed) == 0:
+                copy_tree(cached_dir, tool_dir)
+                _logger.info("Reused cached {0} result".format(tool_type))
+            else:
+                _logger.info("Cached {0} result".format(tool_type))
+    except _UncacheableResult:
+        _logger.info("Did not cache {0} result".format(tool_type))
@@ -0,0 +1,9 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import pathlib
+import sys
+
+_PACKAGE_DIR = pathlib.Path(__file__).parents[2] / "src" / "azure-ml-rai"
+sys.path.insert(0, str(_PACKAGE_DIR))
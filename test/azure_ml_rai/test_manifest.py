@@ -0,0 +1,97 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+import pathlib
+
+import pytest
+
+from azure_ml_rai._constants import DashboardInfo
+from azure_ml_rai._manifest import rebuild_from_manifest
+
+_EXPLANATION_META = "explainer/7d2a1c3e-5b4f-4a8e-b6c9-1e0f2d3a4b5c/data/meta.json"
+
+
+def _write_manifest(directory: pathlib.Path, digest: str, files):
+    manifest = {
+        DashboardInfo.ARTIFACT_MANIFEST_DIGEST_KEY: digest,
+        DashboardInfo.ARTIFACT_MANIFEST_FILES_KEY: {
+            relative_path: {DashboardInfo.ARTIFACT_MANIFEST_SIZE_KEY: len(content)}
+            for relative_path, content in files.items()
+        },
+    }
+    manifest_file = directory / DashboardInfo.ARTIFACT_MANIFEST_FILENAME
+    with open(manifest_file, "w") as mf:
+        json.dump(manifest, mf)
+
+
+@pytest.fixture
+def constructor_files():
+    # The layout written by RAIInsights.save() in responsibleai 0.16,
+    # plus the prediction store of the constructor component
+    return {
+        "meta.json": b'{"target_column": "y", "task_type": "classification"}',
+        "model.pkl": b"model",
+        "data/train.json": b'{"columns":["a","y"],"index":[0],"data":[[0.5,1]]}',
+        "data/traindtypes.json": b'{"a":"float64","y":"int64"}',
+        "data/test.json": b'{"columns":["a","y"],"index":[0],"data":[[1.5,0]]}',
+        "data/testdtypes.json": b'{"a":"float64","y":"int64"}',
+        "predictions/predict.json": b"[0]",
+        "predictions/predict_proba.json": b"[[0.75, 0.25]]",
+        "explainer/0b6e4f51-7c1d-4f1e-9d1a-2f0c5e8a9b3d/data/meta.json": (
+            b'{"is_run": false, "is_added": false}'
+        ),
+        "prediction_store.json": b'{"splits": {}}',
+        "prediction_store/test.parquet": b"test predictions",
+    }
+
+
+@pytest.fixture
+def constructor_dir(tmp_path, constructor_files):
+    result = tmp_path / "constructor"
+    for relative_path, content in constructor_files.items():
+        (result / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (result / relative_path).write_bytes(content)
+    _write_manifest(result, "abc", constructor_files)
+    return result
+
+
+@pytest.fixture
+def dashboard_dir(tmp_path, constructor_files):
+    result = tmp_path / "dashboard"
+    # The output of the explanation component
+    tool_file = result / _EXPLANATION_META
+    tool_file.parent.mkdir(parents=True)
+    tool_file.write_bytes(b'{"is_run": true, "is_added": true}')
+    _write_manifest(result, "abc", constructor_files)
+    return result
+
+
+class TestRebuildFromManifest:
+    def test_copies_constructor_files(
+        self, dashboard_dir, constructor_dir, constructor_files
+    ):
+        rebuild_from_manifest(dashboard_dir, constructor_dir)
+
+        for relative_path, content in constructor_files.items():
+            assert (dashboard_dir / relative_path).read_bytes() == content
+        assert (dashboard_dir / _EXPLANATION_META).read_bytes() == (
+            b'{"is_run": true, "is_added": true}'
+        )
+
+    def test_digest_mismatch(self, dashboard_dir, constructor_dir, constructor_files):
+        _write_manifest(constructor_dir, "def", constructor_files)
+
+        with pytest.raises(ValueError, match="does not match"):
+            rebuild_from_manifest(dashboard_dir, constructor_dir)
+
+    def test_size_mismatch(self, dashboard_dir, constructor_dir):
+        (constructor_dir / "model.pkl").write_bytes(b"other model")
+
+        with pytest.raises(ValueError, match="model.pkl"):
+            rebuild_from_manifest(dashboard_dir, constructor_dir)
+
+    def test_missing_manifest(self, tmp_path, constructor_dir):
+        with pytest.raises(ValueError, match="No artifact manifest"):
+            rebuild_from_manifest(tmp_path, constructor_dir)
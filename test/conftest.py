@@ -5,10 +5,6 @@
 import json
 import pytest
 
-from azure.identity import DefaultAzureCredential
-from azure.ml import MLClient
-
-
 @pytest.fixture(scope='session')
 def component_config():
     config_file = 'component_config.json'
@@ -29,6 +25,11 @@ def workspace_config():
 
 @pytest.fixture(scope='function')
 def ml_client(workspace_config):
+    # Imported here so that the offline unit tests do not need the
+    # Azure packages
+    from azure.identity import DefaultAzureCredential
+    from azure.ml import MLClient
+
     client = MLClient(
         credential=DefaultAzureCredential(),
         subscription_id=workspace_config['subscription_id'],
@@ -0,0 +1,12 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import pathlib
+import sys
+
+# The component scripts import each other as top level modules
+_COMPONENT_DIR = (
+    pathlib.Path(__file__).parents[2] / "src" / "responsibleai" / "rai_analyse"
+)
+sys.path.insert(0, str(_COMPONENT_DIR))
@@ -0,0 +1,125 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import os
+
+import pytest
+
+from artifact_cache import DirectoryLRUCache
+
+
+def _writer(n_bytes, calls):
+    def _populate(target_dir):
+        calls.append(target_dir)
+        (target_dir / "blob.bin").write_bytes(b"x" * n_bytes)
+
+    return _populate
+
+
+@pytest.fixture
+def cache(tmp_path):
+    # Room for two entries of 40 bytes, but not three
+    return DirectoryLRUCache(str(tmp_path / "cache"), 100)
+
+
+def _cached_keys(cache):
+    # Looking up an entry can evict the others, so only use this when
+    # the cached entries fit
+    keys = []
+    for key in ["a", "b", "c"]:
+        with cache.entry(key) as content_dir:
+            if content_dir is not None:
+                keys.append(key)
+    return keys
+
+
+class TestDirectoryLRUCache:
+    def test_populates_once(self, cache):
+        calls = []
+        with cache.entry("a", _writer(40, calls)) as first_dir:
+            pass
+        with cache.entry("a", _writer(40, calls)) as second_dir:
+            assert (second_dir / "blob.bin").read_bytes() == b"x" * 40
+
+        assert len(calls) == 1
+        assert first_dir == second_dir
+
+    def test_miss_without_populate(self, cache):
+        with cache.entry("a") as content_dir:
+            assert content_dir is None
+
+    def test_evicts_least_recently_used(self, cache):
+        calls = []
+        with cache.entry("a", _writer(40, calls)):
+            pass
+        with cache.entry("b", _writer(40, calls)):
+            pass
+        # Using 'a' again makes 'b' the least recently used entry
+        with cache.entry("a"):
+            pass
+        with cache.entry("c", _writer(40, calls)):
+            pass
+
+        assert _cached_keys(cache) == ["a", "c"]
+
+    def test_keeps_entry_in_use(self, cache):
+        calls = []
+        with cache.entry("a", _writer(40, calls)):
+            pass
+        # A new entry is kept even if it alone exceeds the limit
+        with cache.entry("b", _writer(150, calls)):
+            pass
+
+        with cache.entry("b") as content_dir:
+            assert (content_dir / "blob.bin").exists()
+        with cache.entry("a") as content_dir:
+            assert content_dir is None
+
+    def test_rebuilds_changed_entry(self, cache):
+        calls = []
+        with cache.entry("a", _writer(40, calls)) as content_dir:
+            pass
+        (content_dir / "blob.bin").write_bytes(b"y" * 41)
+
+        with cache.entry("a", _writer(40, calls)) as content_dir:
+            assert (content_dir / "blob.bin").read_bytes() == b"x" * 40
+        assert len(calls) == 2
+
+    def test_rebuilds_same_size_corruption(self, cache, tmp_path):
+        calls = []
+        with cache.entry("a", _writer(40, calls)) as content_dir:
+            pass
+        blob = content_dir / "blob.bin"
+        blob_stat = blob.stat()
+        blob.write_bytes(b"y" * 40)
+        os.utime(blob, ns=(blob_stat.st_atime_ns, blob_stat.st_mtime_ns))
+
+        # A new job checks the hashes the first time it uses the entry
+        new_cache = DirectoryLRUCache(str(tmp_path / "cache"), 100)
+        with new_cache.entry("a", _writer(40, calls)) as content_dir:
+            assert (content_dir / "blob.bin").read_bytes() == b"x" * 40
+        assert len(calls) == 2
+
+    def test_keeps_touched_entry(self, cache, tmp_path):
+        calls = []
+        with cache.entry("a", _writer(40, calls)) as content_dir:
+            pass
+        os.utime(content_dir / "blob.bin", ns=(0, 0))
+
+        with cache.entry("a", _writer(40, calls)) as content_dir:
+            assert (content_dir / "blob.bin").read_bytes() == b"x" * 40
+        new_cache = DirectoryLRUCache(str(tmp_path / "cache"), 100)
+        with new_cache.entry("a", _writer(40, calls)):
+            pass
+        assert len(calls) == 1
+
+    def test_put(self, cache, tmp_path):
+        source_dir = tmp_path / "source"
+        (source_dir / "nested").mkdir(parents=True)
+        (source_dir / "nested" / "result.json").write_text("{}")
+
+        cache.put("a", source_dir)
+
+        with cache.entry("a") as content_dir:
+            assert (content_dir / "nested" / "result.json").read_text() == "{}"
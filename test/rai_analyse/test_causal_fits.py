@@ -0,0 +1,96 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("econml")
+pytest.importorskip("responsibleai")
+
+from econml.solutions.causal_analysis import CausalAnalysis  # noqa: E402
+from responsibleai._managers.causal_manager import CausalManager  # noqa: E402
+
+from causal_fits import (  # noqa: E402
+    _select_outcome_model,
+    fit_with_outcome_model,
+    get_treatment_n_jobs,
+    replaced_causal_fit,
+)
+
+
+class _Manager:
+    # Only the fit of the RAI causal manager is needed
+    _fit_causal_analysis = CausalManager._fit_causal_analysis
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    n_rows = 300
+    X = pd.DataFrame(
+        {
+            "a": rng.normal(size=n_rows),
+            "k": np.array(list("PQ"))[rng.integers(0, 2, n_rows)],
+            "b": rng.normal(size=n_rows),
+        }
+    )
+    y = 2 * X["a"] - X["b"] + (X["k"] == "P") + rng.normal(size=n_rows)
+    return X, y
+
+
+def _causal_analysis(classification):
+    return CausalAnalysis(
+        ["a", "k"],
+        ["k"],
+        heterogeneity_inds=None,
+        classification=classification,
+        nuisance_models="linear",
+        heterogeneity_model="linear",
+        n_jobs=1,
+        random_state=0,
+    )
+
+
+class TestFitWithOutcomeModel:
+    @pytest.mark.parametrize("classification", [False, True])
+    def test_matches_cold_fit(self, data, classification):
+        X, y = data
+        if classification:
+            y = y > 0
+        reference = _causal_analysis(classification).fit(X, y)
+
+        causal_analysis = _causal_analysis(classification)
+        outcome_model = _select_outcome_model(causal_analysis, X, y)
+        fit_with_outcome_model(
+            _Manager()._fit_causal_analysis, causal_analysis, X, y, 50, outcome_model
+        )
+
+        assert "fit" not in vars(causal_analysis)
+        assert causal_analysis.trained_feature_indices_ == (
+            reference.trained_feature_indices_
+        )
+        pd.testing.assert_frame_equal(
+            causal_analysis.global_causal_effect(), reference.global_causal_effect()
+        )
+
+
+def test_replaced_causal_fit():
+    manager = _Manager()
+    calls = []
+
+    with replaced_causal_fit(manager, lambda *args: calls.append("outer")):
+        with replaced_causal_fit(manager, lambda *args: calls.append("inner")):
+            manager._fit_causal_analysis(None, None, None, 50)
+        manager._fit_causal_analysis(None, None, None, 50)
+
+    assert calls == ["inner", "outer"]
+    assert "_fit_causal_analysis" not in vars(manager)
+
+
+def test_get_treatment_n_jobs():
+    assert get_treatment_n_jobs(8, ["a", "b", "c"], 2) == 2
+    assert get_treatment_n_jobs(8, ["a", "b"], 16) == 2
+    assert get_treatment_n_jobs(1, ["a", "b"], 16) == 1
+    assert get_treatment_n_jobs(None, [], 16) == 1
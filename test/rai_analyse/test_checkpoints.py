@@ -0,0 +1,117 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("econml")
+pytest.importorskip("responsibleai")
+
+from econml.solutions.causal_analysis import CausalAnalysis  # noqa: E402
+from responsibleai._managers.causal_manager import CausalManager  # noqa: E402
+
+from checkpoints import CheckpointStore, checkpointed_causal_fits  # noqa: E402
+
+
+class _Manager:
+    # Only the fit of the RAI causal manager is needed
+    _fit_causal_analysis = CausalManager._fit_causal_analysis
+
+
+class _PreemptedStore(CheckpointStore):
+    def __init__(self, *args, n_saves):
+        super().__init__(*args)
+        self._n_saves = n_saves
+
+    def save(self, name, value):
+        super().save(name, value)
+        self._n_saves -= 1
+        if self._n_saves == 0:
+            raise KeyboardInterrupt("Preempted")
+
+
+@pytest.fixture(scope="module")
+def data():
+    rng = np.random.default_rng(0)
+    n_rows = 300
+    # One value of 'rare' has a single row, so EconML cannot fit it
+    rare = np.array(list("PQ"))[rng.integers(0, 2, n_rows)]
+    rare[0] = "R"
+    X = pd.DataFrame(
+        {
+            "a": rng.normal(size=n_rows),
+            "rare": rare,
+            "b": rng.normal(size=n_rows),
+            "c": rng.normal(size=n_rows),
+        }
+    )
+    y = 2 * X["a"] - X["b"] + rng.normal(size=n_rows)
+    return X, y
+
+
+def _causal_analysis():
+    return CausalAnalysis(
+        ["a", "rare", "b"],
+        ["rare"],
+        heterogeneity_inds=None,
+        classification=False,
+        nuisance_models="linear",
+        heterogeneity_model="linear",
+        n_jobs=1,
+        random_state=0,
+    )
+
+
+def _fit(causal_analysis, data, store):
+    X, y = data
+    manager = _Manager()
+    with checkpointed_causal_fits(manager, store):
+        manager._fit_causal_analysis(causal_analysis, X, y, 50)
+    return causal_analysis
+
+
+def _assert_same_analysis(causal_analysis, reference):
+    assert causal_analysis.feature_inds == reference.feature_inds
+    assert causal_analysis.trained_feature_indices_ == (
+        reference.trained_feature_indices_
+    )
+    assert [i for i, _ in causal_analysis.untrained_feature_indices_] == [
+        i for i, _ in reference.untrained_feature_indices_
+    ]
+    pd.testing.assert_frame_equal(
+        causal_analysis.global_causal_effect(), reference.global_causal_effect()
+    )
+
+
+@pytest.fixture(scope="module")
+def reference(data):
+    X, y = data
+    with pytest.warns(UserWarning):
+        return _causal_analysis().fit(X, y)
+
+
+class TestCheckpointedCausalFits:
+    def test_dropped_treatment_between_steps(self, data, reference, tmp_path):
+        # With one job, each step fits one treatment, and 'rare' is
+        # dropped in the second step
+        store = CheckpointStore(str(tmp_path), "causal", {})
+
+        causal_analysis = _fit(_causal_analysis(), data, store)
+
+        _assert_same_analysis(causal_analysis, reference)
+        assert [i for i, _ in causal_analysis.untrained_feature_indices_] == [1]
+
+    @pytest.mark.parametrize("n_saves", [1, 2])
+    def test_resume(self, data, reference, tmp_path, n_saves):
+        # Preempted after the first or second step, the latter having
+        # dropped 'rare'
+        store = _PreemptedStore(str(tmp_path), "causal", {}, n_saves=n_saves)
+        with pytest.raises(KeyboardInterrupt):
+            _fit(_causal_analysis(), data, store)
+
+        store = CheckpointStore(str(tmp_path), "causal", {})
+        causal_analysis = _fit(_causal_analysis(), data, store)
+
+        _assert_same_analysis(causal_analysis, reference)
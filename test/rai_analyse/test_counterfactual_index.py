@@ -0,0 +1,145 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LinearRegression, LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+
+pytest.importorskip("dice_ml")
+pytest.importorskip("responsibleai")
+
+import dice_ml  # noqa: E402
+
+from dice_ml.explainer_interfaces.explainer_base import ExplainerBase  # noqa: E402
+
+from artifact_cache import DirectoryLRUCache  # noqa: E402
+from counterfactual_index import KDTreeIndex  # noqa: E402
+
+
+def _explainer(model_type):
+    rng = np.random.default_rng(0)
+    train = pd.DataFrame(
+        {
+            "a": rng.normal(size=200),
+            "b": rng.normal(size=200),
+            "k": np.array(list("PQR"))[rng.integers(0, 3, 200)],
+        }
+    )
+    signal = train["a"] + train["b"] + (train["k"] == "P")
+    if model_type == "classifier":
+        # Three classes, so that each gets a segment of its own
+        train["y"] = np.digitize(signal, [-0.5, 1.0])
+        estimator = LogisticRegression()
+    else:
+        train["y"] = signal
+        estimator = LinearRegression()
+    model = Pipeline(
+        [
+            (
+                "encode",
+                ColumnTransformer(
+                    [("k", OneHotEncoder(), ["k"])], remainder="passthrough"
+                ),
+            ),
+            ("model", estimator),
+        ]
+    ).fit(train[["a", "b", "k"]], train["y"])
+    return dice_ml.Dice(
+        dice_ml.Data(dataframe=train, continuous_features=["a", "b"], outcome_name="y"),
+        dice_ml.Model(model=model, backend="sklearn", model_type=model_type),
+        method="kdtree",
+    )
+
+
+def _dice_segment(explainer, desired_range, desired_class):
+    return ExplainerBase.build_KD_tree(
+        explainer,
+        explainer.data_interface.data_df.copy(),
+        desired_range,
+        desired_class,
+        "y_pred",
+    )
+
+
+def _assert_same_segment(actual, expected):
+    actual_df, actual_tree, actual_predictions = actual
+    expected_df, expected_tree, expected_predictions = expected
+    pd.testing.assert_frame_equal(actual_df, expected_df)
+    np.testing.assert_array_equal(actual_predictions, expected_predictions)
+    if expected_tree is None:
+        assert actual_tree is None
+        return
+    np.testing.assert_array_equal(
+        np.asarray(actual_tree.data), np.asarray(expected_tree.data)
+    )
+    query = np.asarray(expected_tree.data)[:5]
+    for actual_result, expected_result in zip(
+        actual_tree.query(query, k=3), expected_tree.query(query, k=3)
+    ):
+        np.testing.assert_array_equal(actual_result, expected_result)
+
+
+def _build(index, explainer, desired_range, desired_class):
+    return index.build_KD_tree(
+        explainer,
+        explainer.data_interface.data_df.copy(),
+        desired_range,
+        desired_class,
+        "y_pred",
+    )
+
+
+class TestKDTreeIndex:
+    @pytest.mark.parametrize("use_cache", [False, True])
+    def test_classifier_matches_dice(self, tmp_path, use_cache):
+        explainer = _explainer("classifier")
+        cache = DirectoryLRUCache(str(tmp_path), 10 * 1024 * 1024)
+        # A second index over the same cache loads the saved trees
+        indices = [KDTreeIndex(cache, "key"), KDTreeIndex(cache, "key")]
+        if not use_cache:
+            indices = [KDTreeIndex(None, None)]
+
+        for index in indices:
+            # Class 3 is never predicted
+            for desired_class in [0, 1, 2, 3]:
+                _assert_same_segment(
+                    _build(index, explainer, None, desired_class),
+                    _dice_segment(explainer, None, desired_class),
+                )
+
+    @pytest.mark.parametrize("use_cache", [False, True])
+    def test_regressor_matches_dice(self, tmp_path, use_cache):
+        explainer = _explainer("regressor")
+        cache = DirectoryLRUCache(str(tmp_path), 10 * 1024 * 1024)
+        indices = [KDTreeIndex(cache, "key"), KDTreeIndex(cache, "key")]
+        if not use_cache:
+            indices = [KDTreeIndex(None, None)]
+
+        for index in indices:
+            # The last range holds no predictions
+            for desired_range in [[0.0, 1.5], [-1.0, 0.5], [100.0, 101.0]]:
+                _assert_same_segment(
+                    _build(index, explainer, desired_range, None),
+                    _dice_segment(explainer, desired_range, None),
+                )
+
+    def test_pickles_without_trees(self, tmp_path):
+        explainer = _explainer("classifier")
+        index = KDTreeIndex(DirectoryLRUCache(str(tmp_path), 10 * 1024 * 1024), "key")
+        _build(index, explainer, None, 1)
+
+        unpickled = pickle.loads(pickle.dumps(index))
+
+        assert unpickled._indices == {}
+        _assert_same_segment(
+            _build(unpickled, explainer, None, 1),
+            _dice_segment(explainer, None, 1),
+        )
@@ -0,0 +1,123 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+
+pytest.importorskip("dice_ml")
+
+import dice_ml  # noqa: E402
+
+from dice_ml.utils.exception import UserConfigValidationException  # noqa: E402
+
+from counterfactual_parallel import (  # noqa: E402
+    ParallelCounterfactualGenerator,
+    parallel_counterfactuals,
+)
+
+
+@pytest.fixture(scope="module")
+def explainer():
+    rng = np.random.default_rng(0)
+    train = pd.DataFrame({"a": rng.normal(size=200), "b": rng.normal(size=200)})
+    train["y"] = (train["a"] + train["b"] > 0).astype(int)
+    model = LogisticRegression().fit(train[["a", "b"]], train["y"])
+    return dice_ml.Dice(
+        dice_ml.Data(dataframe=train, continuous_features=["a", "b"], outcome_name="y"),
+        dice_ml.Model(model=model, backend="sklearn", model_type="classifier"),
+        method="random",
+    )
+
+
+@pytest.fixture
+def slow_explainer(explainer, monkeypatch):
+    # Never finishes for instances with a negative 'a'
+    generate = explainer._generate_counterfactuals
+
+    def _generate_counterfactuals(query_instance, total_CFs, **kwargs):
+        if query_instance["a"].iloc[0] < 0:
+            time.sleep(60)
+        return generate(query_instance, total_CFs, **kwargs)
+
+    monkeypatch.setattr(
+        explainer, "_generate_counterfactuals", _generate_counterfactuals
+    )
+    return explainer
+
+
+def _query_instances():
+    return pd.DataFrame({"a": [1.0, -1.0, 2.0], "b": [0.5, 0.5, -0.5]})
+
+
+class TestParallelCounterfactualGenerator:
+    def test_timeout_gives_empty_examples(self, slow_explainer):
+        generator = ParallelCounterfactualGenerator(slow_explainer, 1, 0.5)
+        query_instances = _query_instances()
+
+        explanations = generator(
+            query_instances, 2, desired_class="opposite", random_seed=0
+        )
+
+        examples = explanations.cf_examples_list
+        assert len(examples) == 3
+        assert generator.n_timeouts == 1
+        assert examples[1].final_cfs_df is None
+        assert examples[1].data_interface is slow_explainer.data_interface
+        test_instance = examples[1].test_instance_df
+        assert test_instance[["a", "b"]].values.tolist() == [[-1.0, 0.5]]
+        assert test_instance["y"].tolist() == (
+            slow_explainer.model.model.predict(query_instances[1:2]).tolist()
+        )
+        for i in [0, 2]:
+            assert len(examples[i].final_cfs_df) == 2
+        # The explanations serialise as DiCE's own do
+        assert explanations.to_json() is not None
+
+    def test_matches_dice(self, explainer):
+        generator = ParallelCounterfactualGenerator(explainer, 1, 60)
+        query_instances = _query_instances()
+
+        explanations = generator(
+            query_instances, 2, desired_class="opposite", random_seed=0
+        )
+        expected = explainer.generate_counterfactuals(
+            query_instances, 2, desired_class="opposite", random_seed=0
+        )
+
+        assert generator.n_timeouts == 0
+        for actual, reference in zip(
+            explanations.cf_examples_list, expected.cf_examples_list
+        ):
+            pd.testing.assert_frame_equal(actual.final_cfs_df, reference.final_cfs_df)
+
+    def test_total_cfs_must_be_positive(self, explainer):
+        generator = ParallelCounterfactualGenerator(explainer, 1, None)
+
+        with pytest.raises(UserConfigValidationException):
+            generator(_query_instances(), 0)
+
+
+class _CounterfactualManager:
+    def _create_diceml_explainer(self, method, continuous_features):
+        return dice_ml.Dice.__new__(dice_ml.Dice)
+
+
+def test_parallel_counterfactuals_wraps_explainers():
+    manager = _CounterfactualManager()
+
+    with parallel_counterfactuals(manager, 2, None) as generators:
+        explainer = manager._create_diceml_explainer("random", ["a"])
+    assert len(generators) == 1
+    assert explainer.generate_counterfactuals is generators[0]
+    assert "_create_diceml_explainer" not in vars(manager)
+
+    with parallel_counterfactuals(manager, 1, None) as generators:
+        explainer = manager._create_diceml_explainer("random", ["a"])
+    assert generators == []
+    assert "generate_counterfactuals" not in vars(explainer)
@@ -0,0 +1,124 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+
+pytest.importorskip("dice_ml")
+pytest.importorskip("responsibleai")
+
+from responsibleai import RAIInsights  # noqa: E402
+
+from counterfactual_targets import (  # noqa: E402
+    compute_concurrently,
+    get_target_configs,
+    shared_dice_setup,
+)
+
+
+def _dataset(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({"a": rng.normal(size=n_rows), "b": rng.normal(size=n_rows)})
+    data["y"] = (data["a"] + data["b"] > 0).astype(int)
+    return data
+
+
+@pytest.fixture
+def manager():
+    train = _dataset(200, 0)
+    model = LogisticRegression().fit(train[["a", "b"]], train["y"])
+    rai_i = RAIInsights(
+        model=model,
+        train=train,
+        test=_dataset(4, 1),
+        target_column="y",
+        task_type="classification",
+        categorical_features=[],
+    )
+    return rai_i.counterfactual
+
+
+def _add(manager, total_CFs, desired_class="opposite"):
+    manager.add(
+        total_CFs=total_CFs,
+        method="random",
+        desired_class=desired_class,
+        feature_importance=False,
+    )
+
+
+class TestComputeConcurrently:
+    def test_records_results_on_configs(self, manager, monkeypatch):
+        _add(manager, 2)
+        _add(manager, 3)
+
+        with shared_dice_setup(manager):
+            compute_concurrently(manager, 2)
+
+        configs = manager._counterfactual_config_list
+        assert all(c.is_computed for c in configs)
+        assert all(not c.has_computation_failed for c in configs)
+        assert [len(c.counterfactual_obj.cf_examples_list) for c in configs] == [4, 4]
+        assert [
+            len(c.counterfactual_obj.cf_examples_list[0].final_cfs_df) for c in configs
+        ] == [2, 3]
+        assert len(manager.get()) == 2
+
+        # Nothing is left for the manager's own compute()
+        def _fail(*args, **kwargs):
+            raise AssertionError("Computed again")
+
+        monkeypatch.setattr(manager, "_create_diceml_explainer", _fail, raising=False)
+        manager.compute()
+
+    def test_records_failures_on_configs(self, manager):
+        _add(manager, 2)
+        _add(manager, 3, desired_class=5)
+
+        with pytest.raises(Exception):
+            compute_concurrently(manager, 2)
+
+        configs = manager._counterfactual_config_list
+        assert all(c.is_computed for c in configs)
+        assert not configs[0].has_computation_failed
+        assert configs[0].counterfactual_obj is not None
+        assert configs[1].has_computation_failed
+        assert configs[1].failure_reason != ""
+
+    def test_single_config_left_to_manager(self, manager):
+        _add(manager, 2)
+
+        compute_concurrently(manager, 4)
+
+        assert not manager._counterfactual_config_list[0].is_computed
+
+
+def test_shared_dice_setup(manager):
+    with shared_dice_setup(manager):
+        first = manager._create_diceml_explainer("random", ["a", "b"])
+        second = manager._create_diceml_explainer("kdtree", ["a", "b"])
+        other_features = manager._create_diceml_explainer("random", ["a"])
+    assert "_create_diceml_explainer" not in vars(manager)
+
+    assert first is not second
+    assert first.data_interface is second.data_interface
+    assert first.model is second.model
+    assert other_features.data_interface is not first.data_interface
+    assert other_features.model is first.model
+
+
+def test_get_target_configs():
+    config = {"method": "random", "total_CFs": 10, "desired_class": "opposite"}
+
+    configs = get_target_configs(config, [{"desired_class": 0}, {"desired_class": 1}])
+
+    assert configs == [
+        {"method": "random", "total_CFs": 10, "desired_class": 0},
+        {"method": "random", "total_CFs": 10, "desired_class": 1},
+    ]
+    with pytest.raises(ValueError, match="Unknown counterfactual target keys"):
+        get_target_configs(config, [{"total_CFs": 5}])
@@ -0,0 +1,102 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+
+from types import SimpleNamespace
+
+import numpy as np
+
+from dashboard_arrays import (
+    ARRAY_REFERENCE_KEY,
+    extract_numeric_arrays,
+    load_dashboard_json,
+)
+
+
+def _rai_data(rng):
+    features = rng.normal(size=(300, 5)).tolist()
+    dataset = SimpleNamespace(
+        features=features,
+        true_y=rng.normal(size=2000).tolist(),
+        predicted_y=rng.normal(size=2000).tolist(),
+    )
+    local_importance = SimpleNamespace(scores=rng.normal(size=(300, 5)).tolist())
+    precomputed = SimpleNamespace(localFeatureImportance=local_importance)
+    explanation = SimpleNamespace(precomputedExplanations=precomputed)
+    counterfactual = SimpleNamespace(
+        cfs_list=rng.normal(size=(300, 4, 6)).tolist(),
+        local_importance=None,
+        feature_names=list("abcde"),
+    )
+    return SimpleNamespace(
+        dataset=dataset,
+        modelExplanationData=[explanation],
+        counterfactualData=[counterfactual],
+        errorAnalysisData=[],
+        causalAnalysisData=[],
+    )
+
+
+def _to_json(o):
+    if isinstance(o, SimpleNamespace):
+        return {k: _to_json(v) for k, v in vars(o).items()}
+    if isinstance(o, list):
+        return [_to_json(v) for v in o]
+    return o
+
+
+class TestExtractNumericArrays:
+    def test_only_payloads_extracted(self, tmp_path):
+        expected = _rai_data(np.random.default_rng(0))
+        rai_data = extract_numeric_arrays(
+            _rai_data(np.random.default_rng(0)), str(tmp_path)
+        )
+
+        local_importance = rai_data.modelExplanationData[
+            0
+        ].precomputedExplanations.localFeatureImportance
+        assert ARRAY_REFERENCE_KEY in local_importance.scores
+        assert ARRAY_REFERENCE_KEY in rai_data.counterfactualData[0].cfs_list
+        # The dataset keeps every digit
+        assert rai_data.dataset.features == expected.dataset.features
+        assert rai_data.dataset.true_y == expected.dataset.true_y
+        assert rai_data.dataset.predicted_y == expected.dataset.predicted_y
+
+        json_path = tmp_path / "dashboard.json"
+        with open(json_path, "w") as f:
+            json.dump(_to_json(rai_data), f)
+        loaded = load_dashboard_json(str(json_path))
+
+        scores = loaded["modelExplanationData"][0]["precomputedExplanations"][
+            "localFeatureImportance"
+        ]["scores"]
+        assert scores.dtype == np.float32
+        expected_scores = expected.modelExplanationData[
+            0
+        ].precomputedExplanations.localFeatureImportance.scores
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)
+        np.testing.assert_allclose(
+            loaded["counterfactualData"][0]["cfs_list"],
+            expected.counterfactualData[0].cfs_list,
+            rtol=1e-6,
+        )
+        assert loaded["dataset"] == _to_json(expected.dataset)
+
+    def test_small_and_non_numeric_payloads_inline(self, tmp_path):
+        rai_data = _rai_data(np.random.default_rng(0))
+        cfs_list = [[["x", 1.0]] * 4] * 300
+        rai_data.counterfactualData[0].cfs_list = cfs_list
+        rai_data.modelExplanationData[
+            0
+        ].precomputedExplanations.localFeatureImportance.scores = [[0.5, 0.25]]
+
+        rai_data = extract_numeric_arrays(rai_data, str(tmp_path))
+
+        assert rai_data.counterfactualData[0].cfs_list == cfs_list
+        local_importance = rai_data.modelExplanationData[
+            0
+        ].precomputedExplanations.localFeatureImportance
+        assert local_importance.scores == [[0.5, 0.25]]
+        assert not (tmp_path / "arrays").exists()
@@ -0,0 +1,135 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+import pytest
+
+from dataset_sampling import _allocate_quotas, count_rows, sample_dataset
+
+_N_ROWS = 1000
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    # Strata of 600, 300 and 90 rows, plus 10 rows with no stratum
+    strata = np.array(["a"] * 600 + ["b"] * 300 + ["c"] * 90 + [None] * 10)
+    return pd.DataFrame(
+        {
+            "row_id": np.arange(_N_ROWS),
+            "value": rng.normal(size=_N_ROWS),
+            "stratum": rng.permutation(strata),
+        }
+    )
+
+
+@pytest.fixture(params=["parquet", "arrow"])
+def dataset_path(request, rows, tmp_path):
+    # Several files of several record batches each, so that the sample
+    # is drawn across batch and file boundaries
+    table = pa.Table.from_pandas(rows, preserve_index=False)
+    for i, start in enumerate(range(0, _N_ROWS, 400)):
+        part = table.slice(start, 400)
+        if request.param == "parquet":
+            pq.write_table(
+                part, tmp_path / "part-{0}.parquet".format(i), row_group_size=64
+            )
+        else:
+            feather.write_feather(
+                part, str(tmp_path / "part-{0}.arrow".format(i)), chunksize=64
+            )
+    return str(tmp_path)
+
+
+class TestAllocateQuotas:
+    def test_proportional(self):
+        assert _allocate_quotas({"a": 600, "b": 300, "c": 100}, 100) == {
+            "a": 60,
+            "b": 30,
+            "c": 10,
+        }
+
+    def test_remainder_to_largest_fractions(self):
+        quotas = _allocate_quotas({"a": 1, "b": 1, "c": 1}, 2)
+
+        assert sum(quotas.values()) == 2
+        assert sorted(quotas.values()) == [0, 1, 1]
+
+        quotas = _allocate_quotas({"a": 5, "b": 3, "c": 2}, 7)
+        # Exact shares are 3.5, 2.1 and 1.4
+        assert quotas == {"a": 4, "b": 2, "c": 1}
+
+    def test_everything_fits(self):
+        counts = {"a": 5, "b": 3}
+
+        assert _allocate_quotas(counts, 10) == counts
+
+
+class TestSampleDataset:
+    def test_count_rows(self, dataset_path):
+        assert count_rows(dataset_path) == _N_ROWS
+
+    def test_reservoir_sample(self, dataset_path, rows):
+        sample = sample_dataset(dataset_path, 100, random_state=1)
+
+        assert len(sample) == 100
+        row_ids = sample["row_id"].to_numpy()
+        assert len(np.unique(row_ids)) == 100
+        # The sampled rows keep their order in the dataset
+        assert np.all(np.diff(row_ids) > 0)
+        pd.testing.assert_frame_equal(sample, rows.iloc[row_ids].reset_index(drop=True))
+
+    def test_deterministic_for_seed(self, dataset_path):
+        first = sample_dataset(dataset_path, 50, random_state=3)
+        second = sample_dataset(dataset_path, 50, random_state=3)
+        other = sample_dataset(dataset_path, 50, random_state=4)
+
+        pd.testing.assert_frame_equal(first, second)
+        assert not first["row_id"].equals(other["row_id"])
+
+    def test_sample_covers_dataset(self, dataset_path):
+        # Rows from late batches are as likely to be kept as early ones
+        row_ids = np.concatenate(
+            [
+                sample_dataset(dataset_path, 100, random_state=seed)["row_id"]
+                for seed in range(20)
+            ]
+        )
+
+        counts = np.bincount(row_ids // 250, minlength=4)
+        assert counts.min() > 0.8 * counts.max()
+
+    def test_stratified_quotas(self, dataset_path):
+        sample = sample_dataset(
+            dataset_path, 100, stratify_column="stratum", random_state=1
+        )
+
+        # The 990 rows with a stratum are shared out in proportion
+        assert sample["stratum"].value_counts().to_dict() == {
+            "a": 61,
+            "b": 30,
+            "c": 9,
+        }
+        assert sample["stratum"].notna().all()
+        assert np.all(np.diff(sample["row_id"].to_numpy()) > 0)
+
+    def test_columns(self, dataset_path):
+        sample = sample_dataset(
+            dataset_path,
+            10,
+            columns=["row_id", "stratum"],
+            stratify_column="stratum",
+            random_state=1,
+        )
+
+        assert list(sample.columns) == ["row_id", "stratum"]
+
+    def test_small_dataset_kept_whole(self, dataset_path, rows):
+        sample = sample_dataset(dataset_path, 2 * _N_ROWS, random_state=1)
+
+        pd.testing.assert_frame_equal(sample, rows)
@@ -0,0 +1,188 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("erroranalysis")
+
+from erroranalysis._internal.constants import Metrics, ModelTask  # noqa: E402
+from erroranalysis._internal.error_analyzer import ModelAnalyzer  # noqa: E402
+from erroranalysis._internal.matrix_filter import compute_matrix  # noqa: E402
+
+from error_tree_engine import HistogramErrorTreeEngine  # noqa: E402
+
+
+class _ConstantClassifier:
+    def predict(self, X):
+        return np.zeros(len(X), dtype=bool)
+
+    def predict_proba(self, X):
+        return np.repeat([[1.0, 0.0]], len(X), axis=0)
+
+
+class _ConstantRegressor:
+    def predict(self, X):
+        return np.zeros(len(X))
+
+
+def _features(n_rows, rng):
+    # c spans [-4, 4] so that the edges of the heatmap intervals are
+    # exact. Otherwise erroranalysis can count the maximum in the last
+    # interval, but leave it out of that interval's metric
+    c = rng.integers(-400, 401, n_rows) / 100
+    c[:2] = [-4.0, 4.0]
+    return pd.DataFrame(
+        {
+            "a": rng.integers(0, 50, n_rows).astype(float),
+            "b": rng.integers(0, 20, n_rows).astype(float),
+            "c": c,
+            "k": np.array(list("PQRST"))[rng.integers(0, 5, n_rows)],
+        }
+    )
+
+
+@pytest.fixture(scope="module")
+def classification_analyzer():
+    rng = np.random.default_rng(0)
+    X = _features(2000, rng)
+    # The errors depend on a, b and k, plus some noise so that no leaf
+    # is pure
+    errors = ((X["a"] > 30) & (X["b"] < 10)) | (X["k"] == "Q")
+    errors ^= rng.random(len(X)) < 0.1
+    return ModelAnalyzer(
+        _ConstantClassifier(),
+        X,
+        errors.to_numpy(),
+        list(X.columns),
+        ["k"],
+        model_task=ModelTask.CLASSIFICATION,
+        classes=[False, True],
+    )
+
+
+@pytest.fixture(
+    scope="module", params=[Metrics.MEAN_SQUARED_ERROR, Metrics.MEAN_ABSOLUTE_ERROR]
+)
+def regression_analyzer(request):
+    rng = np.random.default_rng(1)
+    X = _features(2000, rng)
+    y = 0.1 * X["a"] + (X["k"] == "R") + rng.normal(size=len(X))
+    return ModelAnalyzer(
+        _ConstantRegressor(),
+        X,
+        y.to_numpy(),
+        list(X.columns),
+        ["k"],
+        model_task=ModelTask.REGRESSION,
+        metric=request.param,
+    )
+
+
+def _leaves(tree):
+    return sorted(
+        (node["size"], node["error"], pytest.approx(node["metricValue"]))
+        for node in tree
+        if node["nodeName"] is None
+    )
+
+
+def _split_features(tree):
+    return sorted(node["nodeName"] for node in tree if node["nodeName"] is not None)
+
+
+def _assert_same_matrix(ours, reference):
+    if isinstance(reference, dict):
+        assert sorted(ours.keys()) == sorted(reference.keys())
+        for key in reference:
+            _assert_same_matrix(ours[key], reference[key])
+    elif isinstance(reference, list):
+        assert len(ours) == len(reference)
+        for ours_item, reference_item in zip(ours, reference):
+            _assert_same_matrix(ours_item, reference_item)
+    elif isinstance(reference, float):
+        assert ours == pytest.approx(reference)
+    else:
+        assert ours == reference
+
+
+class TestErrorTree:
+    @pytest.mark.parametrize("max_depth,num_leaves", [(1, 31), (2, 31), (3, 4), (3, 6)])
+    def test_same_partition_as_erroranalysis(
+        self, classification_analyzer, max_depth, num_leaves
+    ):
+        # The split thresholds differ (LightGBM splits halfway between
+        # values) but the rows end up in the same leaves
+        features = list(classification_analyzer.feature_names)
+        engine = HistogramErrorTreeEngine(classification_analyzer)
+
+        tree = engine.compute_error_tree(
+            features, None, None, max_depth=max_depth, num_leaves=num_leaves
+        )
+        reference = classification_analyzer.compute_error_tree(
+            features, None, None, max_depth=max_depth, num_leaves=num_leaves
+        )
+
+        assert _leaves(tree) == _leaves(reference)
+        assert _split_features(tree) == _split_features(reference)
+
+    def test_tree_limits(self, classification_analyzer):
+        features = list(classification_analyzer.feature_names)
+        engine = HistogramErrorTreeEngine(classification_analyzer)
+
+        tree = engine.compute_error_tree(
+            features, None, None, max_depth=4, num_leaves=5, min_child_samples=100
+        )
+
+        nodes = {node["id"]: node for node in tree}
+        leaves = [node for node in tree if node["nodeName"] is None]
+        assert len(leaves) <= 5
+        assert all(node["size"] >= 100 for node in leaves)
+        # The children of every split partition its rows
+        for node in tree:
+            if node["nodeName"] is not None:
+                children = [c for c in tree if c["parentId"] == node["id"]]
+                assert len(children) == 2
+                assert sum(c["size"] for c in children) == node["size"]
+                assert sum(c["error"] for c in children) == node["error"]
+        root = nodes[0]
+        assert root["size"] == 2000
+
+    def test_only_given_features(self, classification_analyzer):
+        engine = HistogramErrorTreeEngine(classification_analyzer)
+
+        tree = engine.compute_error_tree(["b", "c"], None, None, max_depth=3)
+
+        assert set(_split_features(tree)) <= {"b", "c"}
+
+
+class TestErrorHeatmap:
+    @pytest.mark.parametrize(
+        "features", [["a"], ["c"], ["k"], ["a", "c"], ["c", "k"], ["k", "b"]]
+    )
+    def test_classification_matches_erroranalysis(
+        self, classification_analyzer, features
+    ):
+        engine = HistogramErrorTreeEngine(classification_analyzer)
+
+        _assert_same_matrix(
+            engine.compute_matrix(features, None, None),
+            compute_matrix(classification_analyzer, features, None, None),
+        )
+
+    @pytest.mark.parametrize("features", [["b"], ["c", "a"], ["k", "c"]])
+    def test_regression_matches_erroranalysis(self, regression_analyzer, features):
+        engine = HistogramErrorTreeEngine(regression_analyzer)
+
+        _assert_same_matrix(
+            engine.compute_matrix(features, None, None),
+            compute_matrix(regression_analyzer, features, None, None),
+        )
+
+    def test_requires_a_feature(self, classification_analyzer):
+        engine = HistogramErrorTreeEngine(classification_analyzer)
+
+        with pytest.raises(ValueError, match="One or two features"):
+            engine.compute_matrix([None, None], None, None)
@@ -0,0 +1,190 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import json
+import os
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from constants import LocalImportanceMode
+from explanation_output import (
+    apply_local_importance_mode,
+    expand_top_k_local_importances,
+    from_top_k_scores,
+    load_explanation_settings,
+    save_explanation_settings,
+    store_top_k_local_importances,
+    to_top_k_scores,
+)
+
+
+def _rai_data(scores):
+    local_importance = SimpleNamespace(scores=scores)
+    precomputed = SimpleNamespace(localFeatureImportance=local_importance)
+    explanation = SimpleNamespace(precomputedExplanations=precomputed)
+    return SimpleNamespace(modelExplanationData=[explanation])
+
+
+class TestTopKScores:
+    @pytest.mark.parametrize("shape", [(7, 5), (3, 7, 5)])
+    def test_round_trip_keeps_largest_magnitudes(self, shape):
+        scores = np.random.default_rng(0).normal(size=shape)
+
+        dense = from_top_k_scores(to_top_k_scores(scores.tolist(), 2))
+
+        assert dense.shape == shape
+        magnitudes = np.sort(np.abs(scores), axis=-1)
+        kept = dense != 0
+        np.testing.assert_array_equal(kept.sum(axis=-1), 2)
+        np.testing.assert_array_equal(dense[kept], scores[kept])
+        # Every dropped score is no larger than the smallest one kept
+        smallest_kept = magnitudes[..., -2]
+        assert np.all(np.abs(np.where(kept, 0, scores)).max(axis=-1) <= smallest_kept)
+
+    def test_decreasing_magnitude_order(self):
+        scores = [[0.1, -3.0, 2.0, 0.5]]
+
+        top_k = to_top_k_scores(scores, 3)
+
+        assert top_k["indices"] == [[1, 2, 3]]
+        assert top_k["values"] == [[-3.0, 2.0, 0.5]]
+
+    def test_k_larger_than_features(self):
+        scores = np.random.default_rng(1).normal(size=(4, 3))
+
+        top_k = to_top_k_scores(scores, 10)
+
+        assert top_k["k"] == 3
+        np.testing.assert_array_equal(from_top_k_scores(top_k), scores)
+
+
+class TestApplyLocalImportanceMode:
+    def test_full_leaves_scores(self):
+        scores = [[1.0, -2.0, 3.0]]
+        rai_data = _rai_data(scores)
+
+        apply_local_importance_mode(rai_data, LocalImportanceMode.FULL, None)
+
+        precomputed = rai_data.modelExplanationData[0].precomputedExplanations
+        assert precomputed.localFeatureImportance.scores is scores
+
+    def test_top_k_writes_dense_scores(self):
+        rai_data = _rai_data([[1.0, -2.0, 3.0], [0.5, 0.0, -0.25]])
+
+        apply_local_importance_mode(rai_data, LocalImportanceMode.TOP_K, 1)
+
+        precomputed = rai_data.modelExplanationData[0].precomputedExplanations
+        assert precomputed.localFeatureImportance.scores == [
+            [0.0, 0.0, 3.0],
+            [0.5, 0.0, 0.0],
+        ]
+
+    def test_global_only_drops_local_importances(self):
+        rai_data = _rai_data([[1.0, -2.0, 3.0]])
+
+        apply_local_importance_mode(rai_data, LocalImportanceMode.GLOBAL_ONLY, None)
+
+        precomputed = rai_data.modelExplanationData[0].precomputedExplanations
+        assert precomputed.localFeatureImportance is None
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError, match="Unknown local importance mode"):
+            apply_local_importance_mode(_rai_data([[1.0]]), "sparse", 1)
+
+
+def _write_local_importances(directory, metadata, data):
+    directory.mkdir(parents=True)
+    file_path = directory / "local_importance_values.json"
+    with open(file_path, "w") as f:
+        json.dump({"metadata": metadata, "data": data}, f)
+    return file_path
+
+
+def _read_local_importances(file_path):
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+class TestStoredTopKLocalImportances:
+    def test_round_trip(self, tmp_path):
+        scores = [[[1.0, -2.0, 3.0], [0.5, 0.0, -0.25]]] * 2
+        file_path = _write_local_importances(
+            tmp_path / "explainer" / "id" / "data" / "explainer", "ndarray", scores
+        )
+
+        store_top_k_local_importances(tmp_path, 1)
+
+        stored = _read_local_importances(file_path)
+        assert stored["metadata"] == "rai_top_k"
+        assert stored["data"]["values"] == [[[3.0], [0.5]]] * 2
+
+        expand_top_k_local_importances(tmp_path)
+
+        assert _read_local_importances(file_path) == {
+            "metadata": "ndarray",
+            "data": [[[0.0, 0.0, 3.0], [0.5, 0.0, 0.0]]] * 2,
+        }
+
+    def test_linked_file_unchanged(self, tmp_path):
+        scores = [[1.0, -2.0, 3.0]]
+        file_path = _write_local_importances(tmp_path / "port", "list", scores)
+        (tmp_path / "staged").mkdir()
+        os.link(file_path, tmp_path / "staged" / file_path.name)
+
+        store_top_k_local_importances(tmp_path / "staged", 1)
+
+        assert _read_local_importances(file_path)["data"] == scores
+
+    def test_sparse_local_importances_unchanged(self, tmp_path):
+        sparse = {"data": [1.0], "indices": [2], "indptr": [0, 1], "shape": [1, 3]}
+        file_path = _write_local_importances(tmp_path / "explainer", "sparse", sparse)
+
+        store_top_k_local_importances(tmp_path, 1)
+        expand_top_k_local_importances(tmp_path)
+
+        assert _read_local_importances(file_path)["data"] == sparse
+
+    def test_loads_as_explanation(self, tmp_path):
+        serialization = pytest.importorskip(
+            "interpret_community.explanation.serialization"
+        )
+        explanation_module = pytest.importorskip(
+            "interpret_community.explanation.explanation"
+        )
+        scores = np.random.default_rng(0).normal(size=(2, 6, 4))
+        explanation = explanation_module._create_local_explanation(
+            local_importance_values=scores,
+            expected_values=[0.0, 0.0],
+            classification=True,
+            features=list("abcd"),
+            classes=["n", "y"],
+            method="test",
+        )
+        serialization.save_explanation(explanation, tmp_path / "explanation")
+
+        store_top_k_local_importances(tmp_path, 2)
+        expand_top_k_local_importances(tmp_path)
+
+        loaded = serialization.load_explanation(tmp_path / "explanation")
+        np.testing.assert_array_equal(
+            loaded.local_importance_values,
+            from_top_k_scores(to_top_k_scores(scores, 2)),
+        )
+
+
+def test_explanation_settings_round_trip(tmp_path):
+    assert load_explanation_settings(str(tmp_path)) == (
+        LocalImportanceMode.FULL,
+        None,
+    )
+
+    save_explanation_settings(str(tmp_path), LocalImportanceMode.TOP_K, 5)
+
+    assert load_explanation_settings(str(tmp_path)) == (
+        LocalImportanceMode.TOP_K,
+        5,
+    )
@@ -0,0 +1,231 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+import model_wrappers
+from model_wrappers import (
+    BatchedInferenceModel,
+    CachedPreprocessingPipeline,
+    MemoizedPredictionModel,
+    create_cached_preprocessing_pipeline,
+    create_model_wrapper,
+)
+
+
+class _CountingModel:
+    def __init__(self):
+        self.rows_scored = 0
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        self.rows_scored += len(X)
+        return X["a"].to_numpy() * 2
+
+    def predict_proba(self, X):
+        self.calls += 1
+        self.rows_scored += len(X)
+        p = 1 / (1 + np.exp(-X["a"].to_numpy()))
+        return np.stack([1 - p, p], axis=1)
+
+
+def _features(n_rows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {
+            "a": rng.normal(size=n_rows),
+            "b": rng.integers(0, 10, n_rows).astype(float),
+            "k": np.array(list("PQRS"))[rng.integers(0, 4, n_rows)],
+        }
+    )
+
+
+def _pipeline(X, y, sparse_output):
+    encoder = ColumnTransformer(
+        [("encode", OneHotEncoder(handle_unknown="ignore"), ["k"])],
+        remainder=StandardScaler(),
+        sparse_threshold=1.0 if sparse_output else 0.0,
+    )
+    return Pipeline([("preprocess", encoder), ("model", LogisticRegression())]).fit(
+        X, y
+    )
+
+
+@pytest.fixture
+def datasets():
+    return [_features(200, 0), _features(100, 1)]
+
+
+class TestCachedPreprocessingPipeline:
+    @pytest.mark.parametrize("sparse_output", [False, True])
+    def test_matches_pipeline(self, datasets, sparse_output):
+        train, test = datasets
+        pipeline = _pipeline(train, train["a"] > 0, sparse_output)
+        wrapped = create_cached_preprocessing_pipeline(pipeline, datasets)
+        assert isinstance(wrapped, CachedPreprocessingPipeline)
+        assert scipy.sparse.issparse(wrapped._transformed) == sparse_output
+
+        # Known rows, unseen rows, and both mixed together out of order
+        unseen = _features(30, 2)
+        mixed = pd.concat([test.iloc[:20], unseen, train.iloc[::-7]])
+        for X in [test, unseen, mixed]:
+            np.testing.assert_array_equal(wrapped.predict(X), pipeline.predict(X))
+            np.testing.assert_allclose(
+                wrapped.predict_proba(X), pipeline.predict_proba(X)
+            )
+
+    def test_first_hash_collision(self, datasets, monkeypatch):
+        train, test = datasets
+        pipeline = _pipeline(train, train["a"] > 0, False)
+        hash_rows = model_wrappers.hash_rows
+
+        def _colliding_hash_rows(X, hash_key=None):
+            # Every row gets the same first hash
+            if hash_key is None:
+                return np.zeros(len(X), dtype=np.uint64)
+            return hash_rows(X, hash_key)
+
+        monkeypatch.setattr(model_wrappers, "hash_rows", _colliding_hash_rows)
+        wrapped = create_cached_preprocessing_pipeline(pipeline, datasets)
+
+        np.testing.assert_allclose(
+            wrapped.predict_proba(test), pipeline.predict_proba(test)
+        )
+
+    def test_other_models_unchanged(self, datasets):
+        model = _CountingModel()
+        assert create_cached_preprocessing_pipeline(model, datasets) is model
+
+        train = datasets[0]
+        single_step = Pipeline([("model", LogisticRegression())]).fit(
+            train[["a", "b"]], train["a"] > 0
+        )
+        assert create_cached_preprocessing_pipeline(single_step, datasets) is (
+            single_step
+        )
+
+
+class TestMemoizedPredictionModel:
+    def test_scores_each_row_once(self):
+        model = _CountingModel()
+        memoized = MemoizedPredictionModel(model, max_rows=100)
+        X = _features(10, 0)
+
+        repeated = pd.concat([X, X.iloc[:5]])
+        np.testing.assert_array_equal(memoized.predict(repeated), repeated["a"] * 2)
+        assert model.calls == 1
+        assert model.rows_scored == 10
+
+        np.testing.assert_array_equal(memoized.predict(X.iloc[::-1]), X["a"][::-1] * 2)
+        assert model.calls == 1
+
+    def test_separate_cache_per_method(self):
+        model = _CountingModel()
+        memoized = MemoizedPredictionModel(model, max_rows=100)
+        X = _features(10, 0)
+
+        memoized.predict(X)
+        proba = memoized.predict_proba(X)
+
+        assert proba.shape == (10, 2)
+        assert model.calls == 2
+        assert model.rows_scored == 20
+
+    def test_evicts_least_recently_used_rows(self):
+        model = _CountingModel()
+        memoized = MemoizedPredictionModel(model, max_rows=10)
+        X = _features(15, 0)
+
+        memoized.predict(X.iloc[:10])
+        memoized.predict(X.iloc[10:])
+        model.rows_scored = 0
+        memoized.predict(X.iloc[5:])
+
+        assert model.rows_scored == 0
+        memoized.predict(X.iloc[:5])
+        assert model.rows_scored == 5
+
+    def test_first_hash_collision(self, monkeypatch):
+        hash_rows = model_wrappers.hash_rows
+
+        def _colliding_hash_rows(X, hash_key=None):
+            # Every row gets the same first hash
+            if hash_key is None:
+                return np.zeros(len(X), dtype=np.uint64)
+            return hash_rows(X, hash_key)
+
+        monkeypatch.setattr(model_wrappers, "hash_rows", _colliding_hash_rows)
+        model = _CountingModel()
+        memoized = MemoizedPredictionModel(model, max_rows=100)
+        X = _features(10, 0)
+
+        np.testing.assert_array_equal(memoized.predict(X), X["a"] * 2)
+        assert model.rows_scored == 10
+        np.testing.assert_array_equal(memoized.predict(X.iloc[::-1]), X["a"][::-1] * 2)
+
+    def test_empty_input(self):
+        memoized = MemoizedPredictionModel(_CountingModel(), max_rows=10)
+
+        assert len(memoized.predict(_features(0, 0))) == 0
+
+
+class _LabelModel:
+    def predict(self, X):
+        # The dtype is only as wide as the longest label in X
+        return np.array(["yes" if a > 0 else "no" for a in X["a"]])
+
+
+class TestBatchedInferenceModel:
+    @pytest.mark.parametrize("n_jobs", [1, 3])
+    def test_matches_model(self, n_jobs):
+        model = _CountingModel()
+        batched = BatchedInferenceModel(model, chunk_size=7, n_jobs=n_jobs)
+        X = _features(50, 0)
+
+        np.testing.assert_array_equal(batched.predict(X), X["a"] * 2)
+        np.testing.assert_array_equal(
+            batched.predict_proba(X), _CountingModel().predict_proba(X)
+        )
+        assert model.calls == 2 * 8
+        assert model.rows_scored == 2 * 50
+
+    @pytest.mark.parametrize("n_jobs", [1, 3])
+    def test_string_labels(self, n_jobs):
+        batched = BatchedInferenceModel(_LabelModel(), chunk_size=5, n_jobs=n_jobs)
+        X = _features(40, 0)
+        # The first chunk only has the shorter label
+        X.loc[:4, "a"] = -1.0
+        X.loc[5, "a"] = 1.0
+
+        np.testing.assert_array_equal(batched.predict(X), _LabelModel().predict(X))
+
+    def test_small_input_passed_through(self):
+        model = _CountingModel()
+        batched = BatchedInferenceModel(model, chunk_size=10)
+
+        batched.predict(_features(10, 0))
+        assert model.calls == 1
+
+    def test_no_predict_proba(self):
+        assert not hasattr(BatchedInferenceModel(_LabelModel(), 5), "predict_proba")
+
+
+def test_create_model_wrapper():
+    assert create_model_wrapper(None, 1, None) is None
+    assert create_model_wrapper(0, 1, 0) is None
+
+    wrapped = create_model_wrapper(4, 2, 100)(_CountingModel())
+
+    assert isinstance(wrapped, MemoizedPredictionModel)
+    X = _features(10, 0)
+    np.testing.assert_array_equal(wrapped.predict(X), X["a"] * 2)
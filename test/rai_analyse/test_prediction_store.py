@@ -0,0 +1,95 @@
+# ---------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# ---------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+
+pytest.importorskip("responsibleai")
+
+from responsibleai import RAIInsights  # noqa: E402
+
+from constants import RAIToolType  # noqa: E402
+from model_wrappers import (  # noqa: E402
+    ModelWrapper,
+    PredictionStoreModel,
+    save_prediction_store,
+)
+from rai_component_utilities import (  # noqa: E402
+    load_saved_features,
+    load_staged_rai_insights,
+)
+
+
+class _CountingModel(ModelWrapper):
+    def __init__(self, model):
+        super().__init__(model)
+        self.calls = 0
+
+    def predict(self, X):
+        self.calls += 1
+        return self._model.predict(X)
+
+    def predict_proba(self, X):
+        self.calls += 1
+        return self._model.predict_proba(X)
+
+
+def _dataset(n_rows, seed):
+    # Full precision floats, which do not survive the JSON round trip
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({"a": rng.normal(size=n_rows), "b": rng.random(n_rows)})
+    data["y"] = (data["a"] + data["b"] > 0.5).astype(int)
+    return data
+
+
+@pytest.fixture
+def saved_insights(tmp_path):
+    train = _dataset(200, 0)
+    test = _dataset(50, 1)
+    model = LogisticRegression().fit(train[["a", "b"]], train["y"])
+    RAIInsights(
+        model=model,
+        train=train,
+        test=test,
+        target_column="y",
+        task_type="classification",
+        categorical_features=[],
+    ).save(tmp_path)
+    save_prediction_store(
+        model, load_saved_features(tmp_path), "classification", tmp_path
+    )
+    return tmp_path, model
+
+
+class TestPredictionStore:
+    def test_lookups_hit_after_load(self, saved_insights):
+        output_dir, model = saved_insights
+        counting_models = []
+
+        def _model_wrapper(m):
+            counting_models.append(_CountingModel(m))
+            return counting_models[0]
+
+        rai_i = load_staged_rai_insights(
+            output_dir,
+            tool_type=RAIToolType.EXPLANATION,
+            model_wrapper=_model_wrapper,
+        )
+        assert isinstance(rai_i.model, PredictionStoreModel)
+
+        for data in [rai_i.train, rai_i.test]:
+            X = data.drop(columns=["y"])
+            np.testing.assert_array_equal(rai_i.model.predict(X), model.predict(X))
+            np.testing.assert_allclose(
+                rai_i.model.predict_proba(X), model.predict_proba(X)
+            )
+        assert counting_models[0].calls == 0
+
+        # Other rows still go to the model
+        X = rai_i.test.drop(columns=["y"]).iloc[:10]
+        np.testing.assert_array_equal(rai_i.model.predict(X), model.predict(X))
+        assert counting_models[0].calls == 1